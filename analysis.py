@@ -0,0 +1,318 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from autofocus import focus_score
+from camera_stream import POLICY_DROP_OLDEST, POLICY_LATEST
+from metrics import METRICS
+
+BACKPRESSURE_LATEST = 'latest'  # workers busy: skip to the newest frame once one is free
+BACKPRESSURE_QUEUE = 'queue'    # keep up to max_pending frames in order, dropping the oldest
+
+AnalysisResult = namedtuple('AnalysisResult', 'frame_id timestamp position machine_state stage value elapsed error')
+
+
+class AnalysisStage:
+    """Base class for analysis plugins.
+
+    Stages are pickled once into every worker process, where setup() is
+    called before the first frame; keep heavy state (models, buffers) out
+    of __init__ and create it there. process() gets a read-only view of
+    the frame in shared memory, valid only during the call, and returns a
+    small picklable result. Run the stage on every `every`-th frame.
+    """
+
+    name = "stage"
+
+    def __init__(self, every=1):
+        self.every = max(1, int(every))
+
+    def setup(self):
+        pass
+
+    def process(self, image):
+        raise NotImplementedError
+
+
+class FocusStage(AnalysisStage):
+    """Image sharpness (see autofocus.focus_score)."""
+
+    name = "focus"
+
+    def __init__(self, every=1, roi=None, size=256):
+        super().__init__(every)
+        self.roi = roi
+        self.size = size
+
+    def process(self, image):
+        return focus_score(image, self.roi, self.size)
+
+
+class IntensityStage(AnalysisStage):
+    """Mean and standard deviation of the grey level, e.g. to watch illumination."""
+
+    name = "intensity"
+
+    def process(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        mean, std = cv2.meanStdDev(gray)
+        return {'mean': float(mean[0, 0]), 'std': float(std[0, 0])}
+
+
+class BlobStage(AnalysisStage):
+    """Detect bright (or dark) blobs: count, areas and centroids in pixels."""
+
+    name = "blobs"
+
+    def __init__(self, every=1, threshold=None, invert=False, min_area=20, max_blobs=100):
+        super().__init__(every)
+        self.threshold = threshold  # None = Otsu
+        self.invert = invert
+        self.min_area = min_area
+        self.max_blobs = max_blobs
+
+    def process(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        mode = cv2.THRESH_BINARY_INV if self.invert else cv2.THRESH_BINARY
+        if self.threshold is None:
+            _, mask = cv2.threshold(gray, 0, 255, mode | cv2.THRESH_OTSU)
+        else:
+            _, mask = cv2.threshold(gray, self.threshold, 255, mode)
+        n, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= self.min_area) + 1
+        keep = keep[np.argsort(-stats[keep, cv2.CC_STAT_AREA])][:self.max_blobs]
+        return {
+            'count': int(len(keep)),
+            'areas': stats[keep, cv2.CC_STAT_AREA].tolist(),
+            'centroids': centroids[keep].round(1).tolist(),
+        }
+
+
+# --- Worker process side ---
+
+_worker = {}
+
+
+def _worker_init(shm_name, shape, dtype, stages):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    frames.flags.writeable = False
+    for stage in stages:
+        stage.setup()
+    _worker.update(shm=shm, frames=frames, stages=stages)
+
+
+def _worker_run(slot, seq):
+    image = _worker['frames'][slot]
+    results = []
+    for i, stage in enumerate(_worker['stages']):
+        if seq % stage.every:
+            continue
+        started = time.perf_counter()
+        try:
+            results.append((i, stage.process(image), time.perf_counter() - started, None))
+        except Exception as e:
+            results.append((i, None, time.perf_counter() - started, f"{type(e).__name__}: {e}"))
+    return results
+
+
+# --- Capture process side ---
+
+class AnalysisPipeline:
+    """Run analysis stages on camera frames in a pool of worker processes.
+
+    A dispatcher thread takes frames from its own CameraStream subscription
+    (so the preview is never delayed), keeps every `every`-th one and
+    copies it into a free slot of a ring in shared memory; workers read it
+    there in place, so only the slot number crosses the process boundary.
+    Each frame runs through all stages due for it in one worker.
+
+    Backpressure: with BACKPRESSURE_LATEST the subscription holds only the
+    newest frame, so frames arriving while every worker is busy are
+    skipped. With BACKPRESSURE_QUEUE up to `max_pending` frames wait in
+    order and the oldest is dropped beyond that.
+
+    Results are AnalysisResult tuples passed to on_result(result) on a
+    pool callback thread, tagged with the frame index and the stage
+    position from the last status report before dispatch.
+    """
+
+    def __init__(self, camera, stages, controller=None, workers=None, every=1,
+                 backpressure=BACKPRESSURE_LATEST, max_pending=4, on_result=None):
+        if backpressure not in (BACKPRESSURE_LATEST, BACKPRESSURE_QUEUE):
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Stage names must be unique: {names}")
+        self.camera = camera
+        self.stages = list(stages)
+        self.controller = controller
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.every = max(1, int(every))
+        self.backpressure = backpressure
+        self.max_pending = max_pending
+        self.on_result = on_result
+        self.running = False
+        self.error = None
+
+        self.frames_seen = 0
+        self.frames_dispatched = 0
+        self.frames_analysed = 0
+        self.frames_failed = 0
+        self._shm = None
+        self._ring = None
+        self._free = []
+        self._slots_free = threading.Condition()
+        self._pool = None
+        self._frames = None
+        self._thread = None
+        self._latency = METRICS.histogram('analysis_latency_seconds',
+                                          help="Frame capture to all stage results back in the capture process")
+        self._stage_time = {s.name: METRICS.histogram('analysis_stage_seconds', {'stage': s.name},
+                                                      help="Time one stage spent on one frame in a worker")
+                            for s in self.stages}
+
+    def start(self, timeout=5.0):
+        """Allocate the shared ring from the first frame and start the workers."""
+        if self.running:
+            return True
+        if self.backpressure == BACKPRESSURE_LATEST:
+            self._frames = self.camera.subscribe('analysis', POLICY_LATEST)
+        else:
+            self._frames = self.camera.subscribe('analysis', POLICY_DROP_OLDEST, self.max_pending)
+        first = self._frames.get(timeout=timeout)
+        if first is None:
+            self._frames.close()
+            self.error = "No frame from camera."
+            return False
+        with first:
+            shape, dtype = first.image.shape, first.image.dtype
+
+        # One slot per busy worker plus one being filled
+        slots = self.workers + 1
+        ring_shape = (slots,) + shape
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(ring_shape)) * dtype.itemsize)
+        self._ring = np.ndarray(ring_shape, dtype=dtype, buffer=self._shm.buf)
+        self._free = list(range(slots))
+        # spawn: forking a process that runs Qt and capture threads is unsafe
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init, initargs=(self._shm.name, ring_shape, dtype.str, self.stages))
+        self.error = None
+        self.running = True
+        METRICS.add_collector(('analysis', id(self)), self._collect_metrics)
+        self._thread = threading.Thread(target=self._dispatch, name="analysis-dispatch", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop dispatching, wait for frames in flight and free the shared ring."""
+        if not self.running:
+            return
+        self.running = False
+        METRICS.remove_collector(('analysis', id(self)))
+        with self._slots_free:
+            self._slots_free.notify_all()
+        self._thread.join()
+        self._thread = None
+        self._frames.close()
+        self._frames = None
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        self._ring = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'frames_seen': self.frames_seen,
+            'frames_dispatched': self.frames_dispatched,
+            'frames_analysed': self.frames_analysed,
+            'frames_failed': self.frames_failed,
+            'frames_dropped': self._frames.dropped if self._frames else 0,
+            'in_flight': len(self._ring) - len(self._free) if self._ring is not None else 0,
+        }
+
+    def _dispatch(self):
+        while self.running:
+            # Wait for a slot before taking a frame, so that the frame taken is the newest
+            with self._slots_free:
+                self._slots_free.wait_for(lambda: self._free or not self.running)
+                if not self.running:
+                    return
+            frame = self._frames.get(timeout=0.5)
+            if frame is None:
+                continue
+            with frame:
+                self.frames_seen += 1
+                if self.frames_seen % self.every:
+                    continue
+                if frame.image.shape != self._ring.shape[1:]:
+                    self.frames_failed += 1  # resolution changed; restart the pipeline
+                    continue
+                with self._slots_free:
+                    slot = self._free.pop()
+                np.copyto(self._ring[slot], frame.image)
+                frame_id, timestamp = frame.index, frame.timestamp
+            seq = self.frames_dispatched
+            self.frames_dispatched += 1
+            position, machine_state = None, None
+            if self.controller is not None:
+                state = self.controller.state
+                position, machine_state = tuple(state.work_position), state.state
+            try:
+                future = self._pool.submit(_worker_run, slot, seq)
+            except RuntimeError:  # pool broken or shutting down
+                self._release(slot)
+                break
+            future.add_done_callback(
+                lambda f, s=slot, tag=(frame_id, timestamp, position, machine_state): self._done(f, s, tag))
+
+    def _release(self, slot):
+        with self._slots_free:
+            self._free.append(slot)
+            self._slots_free.notify()
+
+    def _done(self, future, slot, tag):
+        self._release(slot)
+        frame_id, timestamp, position, machine_state = tag
+        try:
+            results = future.result()
+        except Exception as e:
+            self.frames_failed += 1
+            print(f"Analysis worker error: {e}")
+            return
+        self.frames_analysed += 1
+        if METRICS.enabled:
+            self._latency.observe(time.perf_counter() - timestamp)
+        for index, value, elapsed, error in results:
+            stage = self.stages[index].name
+            if METRICS.enabled:
+                self._stage_time[stage].observe(elapsed)
+            if self.on_result:
+                try:
+                    self.on_result(AnalysisResult(frame_id, timestamp, position, machine_state,
+                                                  stage, value, elapsed, error))
+                except Exception as e:
+                    print(f"Analysis listener error: {e}")
+
+    def _collect_metrics(self):
+        for name, value in self.stats().items():
+            if name != 'workers':
+                yield f"analysis_{name}" + ("_total" if name != 'in_flight' else ""), None, value
@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from camera_stream import POLICY_LATEST
+
+AutofocusResult = namedtuple('AutofocusResult', 'z score elapsed evaluations')
+
+_GOLDEN = (math.sqrt(5.0) - 1.0) / 2.0
+
+
+def focus_score(image, roi=None, size=256):
+    """Variance of the Laplacian of a downscaled greyscale ROI; higher = sharper."""
+    if roi is not None:
+        x, y, w, h = roi
+        image = image[y:y + h, x:x + w]
+    h, w = image.shape[:2]
+    if w > size:
+        image = cv2.resize(image, (size, max(1, int(h * size / w))), interpolation=cv2.INTER_AREA)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(image, cv2.CV_32F).var())
+
+
+class Autofocus:
+    """Coarse-to-fine Z focus search driven through CNCController.
+
+    1. Coarse: one continuous Z sweep across `z_range`. While the stage
+       moves, frames are scored on a worker thread and tagged with a Z
+       interpolated from the status reports received during the sweep.
+    2. Fine: golden-section search around the coarse peak with discrete
+       moves until the bracket is smaller than `tolerance`.
+
+    The stage is left at the best Z. Coordinates are work coordinates (the
+    same ones G90 moves use).
+    """
+
+    def __init__(self, controller, camera, roi=None, size=256, sweep_feed=300,
+                 move_feed=600, tolerance=0.005, dwell=0.05, poll_hz=50):
+        self.controller = controller
+        self.camera = camera
+        self.roi = roi
+        self.size = size
+        self.sweep_feed = sweep_feed    # mm/min during the coarse sweep
+        self.move_feed = move_feed      # mm/min for fine steps
+        self.tolerance = tolerance      # mm
+        self.dwell = dwell              # s after each fine step
+        self.poll_hz = poll_hz
+        self.move_timeout = 60.0
+        self.evaluations = []           # (z, score) of everything scored in the last run
+
+    def score(self, image):
+        return focus_score(image, self.roi, self.size)
+
+    def run(self, z_center=None, z_range=0.4):
+        """Find the sharpest Z within z_center +/- z_range/2; returns AutofocusResult."""
+        start = time.perf_counter()
+        self.evaluations = []
+        if z_center is None:
+            z_center = self.controller.state.snapshot()['work_position'][2]
+        z_low = z_center - z_range / 2.0
+        z_high = z_center + z_range / 2.0
+
+        frames = self.camera.subscribe('autofocus', POLICY_LATEST)
+        try:
+            z_coarse, bracket = self._coarse_sweep(frames, z_low, z_high)
+            if z_coarse is None:
+                # No status reports to tag frames with: search the whole range
+                z_coarse, bracket = z_center, z_range / 2.0
+            lo = max(z_low, z_coarse - bracket)
+            hi = min(z_high, z_coarse + bracket)
+            z_best, best_score = self._golden_section(frames, lo, hi)
+        finally:
+            frames.close()
+        self._move_z(z_best)
+        return AutofocusResult(z_best, best_score, time.perf_counter() - start, len(self.evaluations))
+
+    def _coarse_sweep(self, frames, z_low, z_high):
+        """Sweep once from z_low to z_high; returns (peak z, bracket half-width)."""
+        if self._move_z(z_low) is None:
+            raise RuntimeError("Autofocus: could not reach sweep start.")
+
+        samples = []  # (perf_counter time, work z) from status reports
+
+        def on_state(state):
+            samples.append((time.perf_counter(), state.work_position[2]))
+
+        started_polling = not self.controller.is_polling()
+        self.controller.state.subscribe(on_state)
+        if started_polling:
+            self.controller.start_status_polling(self.poll_hz)
+
+        scorer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autofocus")
+        scored = []
+        done = threading.Event()
+        try:
+            sweep = self.controller.submit(
+                f"G1 Z{z_high:.4f} F{self.sweep_feed:g}\nG4 P0", timeout=self.move_timeout)
+            sweep.add_done_callback(lambda f: done.set())
+            while not done.is_set():
+                frame = frames.get(timeout=0.2)
+                if frame is not None:
+                    scored.append(scorer.submit(self._score_frame, frame))
+        finally:
+            scorer.shutdown(wait=True)
+            self.controller.state.unsubscribe(on_state)
+            if started_polling:
+                self.controller.stop_status_polling()
+
+        if len(samples) < 2 or not scored:
+            return None, None
+        times = np.array([t for t, _ in samples])
+        zs = np.array([z for _, z in samples])
+        results = np.array([f.result() for f in scored])  # (timestamp, score)
+        frame_z = np.interp(results[:, 0], times, zs)
+        for z, score in zip(frame_z, results[:, 1]):
+            self.evaluations.append((float(z), float(score)))
+        peak = int(np.argmax(results[:, 1]))
+        # Z spacing between scored frames bounds how far off the peak can be
+        spacing = (z_high - z_low) / max(1, len(scored) - 1)
+        return float(frame_z[peak]), max(2.0 * spacing, 2.0 * self.tolerance)
+
+    def _score_frame(self, frame):
+        with frame:
+            return frame.timestamp, self.score(frame.image)
+
+    def _golden_section(self, frames, lo, hi):
+        """Maximise the focus score on [lo, hi]."""
+        cache = {}
+
+        def evaluate(z):
+            key = round(z, 5)
+            if key not in cache:
+                cache[key] = self._score_at(frames, z)
+                self.evaluations.append((z, cache[key]))
+            return cache[key]
+
+        a, b = lo, hi
+        c = b - _GOLDEN * (b - a)
+        d = a + _GOLDEN * (b - a)
+        fc, fd = evaluate(c), evaluate(d)
+        while b - a > self.tolerance:
+            if fc > fd:
+                b, d, fd = d, c, fc
+                c = b - _GOLDEN * (b - a)
+                fc = evaluate(c)
+            else:
+                a, c, fc = c, d, fd
+                d = a + _GOLDEN * (b - a)
+                fd = evaluate(d)
+        return (c, fc) if fc > fd else (d, fd)
+
+    def _score_at(self, frames, z):
+        if self._move_z(z) is None:
+            raise RuntimeError(f"Autofocus: move to Z{z:.4f} failed.")
+        if self.dwell > 0:
+            time.sleep(self.dwell)
+        after = time.perf_counter()
+        while True:
+            frame = frames.get(timeout=2.0)
+            if frame is None:
+                raise RuntimeError("Autofocus: camera delivered no frame.")
+            if frame.timestamp >= after:
+                return self._score_frame(frame)[1]
+            frame.release()
+
+    def _move_z(self, z):
+        reply = self.controller.submit(f"G90\nG1 Z{z:.4f} F{self.move_feed:g}\nG4 P0",
+                                       timeout=self.move_timeout).result()
+        if reply is None or reply.startswith('error'):
+            return None
+        return reply
\ No newline at end of file
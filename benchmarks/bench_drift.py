@@ -0,0 +1,91 @@
+"""Benchmark closed-loop drift correction on a simulated stage that loses steps.
+
+The SimulatedController slips by --drift mm after every move, which its
+position reports do not show; the VirtualCamera sees the real position.
+The same scan is run without and with a DriftCorrector. Reports the
+position error of the captured tiles, the tiles corrected, the time spent
+registering and correcting, and the scan time. Registration is relative
+to the first tile, so its own slip stays; the error relative to it is
+what the mosaic sees.
+
+Run from the repository root:
+    python benchmarks/bench_drift.py [--drift 0.003 -0.002] [--size 320]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from camera_stream import CameraStream
+from cnc_control import CNCController
+from drift import DriftCorrector
+from simulator import SimulatedController, VirtualCamera
+from tile_scan import ScanPlan, TileScanner
+
+
+class RecordingScanner(TileScanner):
+    """Remembers where the stage really was for the frame kept for each tile."""
+
+    def __init__(self, sim, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sim = sim
+        self.errors_mm = {}
+        self._tile = None
+
+    def _settle(self, tile):
+        self._tile = tile
+        return super()._settle(tile)
+
+    def _capture_after(self, frames, after):
+        frame = super()._capture_after(frames, after)
+        x, y, _ = self.sim.physical_position()
+        self.errors_mm[self._tile.index] = (x - self._tile.x, y - self._tile.y)
+        return frame
+
+
+def run(args, correct):
+    sim = SimulatedController(drift=args.drift)
+    controller = CNCController(sim.start(), baudrate=sim.baudrate)
+    controller.connect()
+    mm_per_px = 0.002
+    camera = CameraStream(capture=VirtualCamera(args.width, args.height, stage=sim, mm_per_px=mm_per_px))
+    camera.start()
+    corrector = DriftCorrector(controller, mm_per_px=mm_per_px, size=args.size) if correct else None
+    plan = ScanPlan(0, 0, args.region[0], args.region[1], args.width * mm_per_px, args.height * mm_per_px)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            scanner = RecordingScanner(sim, controller, camera, plan, tmp, dwell=0.05, image_ext=".png",
+                                       drift_corrector=corrector)
+            stats = scanner.run()
+    finally:
+        camera.stop()
+        controller.disconnect()
+        sim.stop()
+    errors = np.array([scanner.errors_mm[i] for i in sorted(scanner.errors_mm)]) * 1000
+    absolute = np.hypot(*errors.T)
+    relative = np.hypot(*(errors - errors[0]).T)
+    label = "corrected" if correct else "open loop"
+    print(f"[{label}] {stats['done']} tiles in {stats['elapsed_s']:.2f} s, "
+          f"tile error mean {absolute.mean():.1f} um / max {absolute.max():.1f} um, "
+          f"relative to the first tile {relative.mean():.1f} / {relative.max():.1f} um")
+    if corrector is not None:
+        c = corrector.stats()
+        print(f"[{label}] {stats['corrected']} tiles corrected, {c['checks']} registrations at "
+              f"{c['avg_ms']:.1f} ms, {stats['avg_ms']['drift']:.1f} ms per tile with corrective moves")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drift", type=float, nargs=2, default=[0.003, -0.002], help="slip per move, mm")
+    parser.add_argument("--region", type=float, nargs=2, default=[12.0, 6.0], help="scan width and height, mm")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--size", type=int, default=320, help="registration image width")
+    args = parser.parse_args()
+
+    run(args, correct=False)
+    run(args, correct=True)
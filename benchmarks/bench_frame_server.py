@@ -0,0 +1,119 @@
+"""Benchmark FrameServer CPU use against the number of viewers.
+
+The server, CameraStream and VirtualCamera run in this process; viewers
+run in a separate process so their CPU is not counted. For each client
+count the server process CPU (all threads) is sampled over a fixed window.
+With encode-once the JPEG cost stays flat and only socket writes grow with
+the number of viewers; `naive encodes/s` is what one encode per viewer
+would have cost.
+
+Run from the repository root:
+    python benchmarks/bench_frame_server.py [--clients 0 1 2 4 8 16 32] [--slow 2]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_stream import CameraStream
+from frame_server import FrameServer
+from simulator import VirtualCamera
+
+MARKER = b"--frame\r\n"
+
+
+async def _viewer(port, query, seconds, slow, counts, index):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+    writer.write(f"GET /stream.mjpg?{query} HTTP/1.1\r\n\r\n".encode())
+    tail = b""
+    end = time.monotonic() + seconds
+    try:
+        while time.monotonic() < end:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            chunk = tail + data
+            counts[index] += chunk.count(MARKER)
+            tail = chunk[-(len(MARKER) - 1):]
+            if slow:
+                await asyncio.sleep(0.1)  # reads ~640 KB/s at most
+    finally:
+        writer.close()
+
+
+def run_viewers(port, clients, slow, query, seconds, results):
+    async def main():
+        counts = [0] * clients
+        await asyncio.gather(*(_viewer(port, query, seconds, i < slow, counts, i) for i in range(clients)))
+        return counts
+    results.put(asyncio.run(main()))
+
+
+def measure(server, clients, args):
+    results = multiprocessing.Queue()
+    viewers = None
+    if clients:
+        viewers = multiprocessing.Process(target=run_viewers, args=(
+            server.port, clients, min(args.slow, clients), args.query, args.seconds + 1.0, results))
+        viewers.start()
+        deadline = time.monotonic() + 5.0
+        while len(server.clients) < clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+    time.sleep(0.5)  # let the viewers reach a steady state
+
+    encoded = sum(server.frames_encoded.values())
+    cpu, wall = time.process_time(), time.perf_counter()
+    time.sleep(args.seconds)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    encoded = sum(server.frames_encoded.values()) - encoded
+
+    counts = []
+    if viewers:
+        counts = results.get()
+        viewers.join()
+    elapsed = args.seconds + 1.0
+    fast = counts[min(args.slow, clients):]
+    slow = counts[:min(args.slow, clients)]
+    return {
+        'cpu': 100.0 * cpu / wall,
+        'encodes': encoded / wall,
+        'fast_fps': sum(fast) / len(fast) / elapsed if fast else 0.0,
+        'slow_fps': sum(slow) / len(slow) / elapsed if slow else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[0, 1, 2, 4, 8, 16, 32])
+    parser.add_argument("--slow", type=int, default=1, help="viewers that read slower than the stream")
+    parser.add_argument("--query", default="quality=80", help="stream query, e.g. 'quality=50&fps=15'")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    camera = CameraStream(capture=VirtualCamera(args.width, args.height, fps=args.fps))
+    if not camera.start():
+        sys.exit(f"Camera failed: {camera.error}")
+    server = FrameServer(camera, port=0)
+    server.start()
+    try:
+        print(f"{args.width}x{args.height} @ {args.fps:g} fps, {args.query}, {args.slow} slow viewer(s)")
+        print(f"{'viewers':>8} {'server CPU':>11} {'encodes/s':>10} {'naive encodes/s':>16} "
+              f"{'viewer fps':>11} {'slow fps':>9}")
+        for clients in args.clients:
+            r = measure(server, clients, args)
+            naive = r['encodes'] * max(clients, 1) if clients else 0.0
+            print(f"{clients:>8} {r['cpu']:>10.1f}% {r['encodes']:>10.1f} {naive:>16.1f} "
+                  f"{r['fast_fps']:>11.1f} {r['slow_fps']:>9.1f}")
+            deadline = time.monotonic() + 5.0
+            while server.clients and time.monotonic() < deadline:
+                time.sleep(0.01)
+    finally:
+        server.stop()
+        camera.stop()
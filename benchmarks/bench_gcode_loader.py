@@ -0,0 +1,58 @@
+"""Throughput of the streaming G-code loader (lines per second).
+
+Writes a synthetic program (moves with comments, optionally arcs) to a
+temporary file and times preprocessing it with and without arc expansion.
+
+Run from the repository root:
+    python benchmarks/bench_gcode_loader.py [--lines 500000] [--arc-segment 0.1]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcode_loader import GCodeProgram
+
+
+def write_program(path, lines):
+    with open(path, "w") as f:
+        f.write("G21 G90 ; metric, absolute\n")
+        for i in range(lines):
+            x = (i % 200) * 0.05
+            if i % 50 == 49:
+                f.write(f"G03 X{x:.4f} Y0.0000 I0.0250 J0.0000 F1200.000\n")
+            elif i % 10 == 0:
+                f.write(f"G01 X{x:.4f} Y{(i % 7) * 0.1:.4f} F1500.000 ; segment {i}\n")
+            else:
+                f.write(f"  X{x:.4f} Y{(i % 7) * 0.1:.4f}  (pass {i // 200})\n")
+
+
+def run(path, arc_segment):
+    program = GCodeProgram(path, arc_segment=arc_segment)
+    start = time.perf_counter()
+    for _ in program:
+        pass
+    elapsed = time.perf_counter() - start
+    return program, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--arc-segment", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "program.nc")
+        write_program(path, args.lines)
+        size = os.path.getsize(path)
+        print(f"{args.lines} source lines, {size / 1e6:.1f} MB")
+        for label, arc_segment in (("clean only", None), ("arc expansion", args.arc_segment)):
+            program, elapsed = run(path, arc_segment)
+            print(f"{label:>14}: {program.lines_read / elapsed:,.0f} source lines/s, "
+                  f"{program.lines_sent} lines out, "
+                  f"{program.bytes_sent / 1e6:.1f} MB encoded "
+                  f"({100.0 * program.bytes_sent / size:.0f}% of source) in {elapsed:.2f} s")
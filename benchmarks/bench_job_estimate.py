@@ -0,0 +1,49 @@
+"""Time to estimate a large G-code program with JobEstimator.
+
+Run from the repository root:
+    python benchmarks/bench_job_estimate.py [--lines 1000000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_estimate import JobEstimator
+
+
+def write_program(path, lines):
+    with open(path, "w") as f:
+        f.write("G21 G90 ; metric, absolute\nG0 X0 Y0 Z1\n")
+        for i in range(lines):
+            x = (i % 400) * 0.025
+            y = (i // 400) * 0.05
+            if i % 100 == 99:
+                f.write(f"G2 X{x:.3f} Y{y:.3f} I0.0125 J0 F800\n")
+            elif i % 20 == 0:
+                f.write(f"G1 X{x:.3f} Y{y:.3f} Z-0.1 F1200 ; pass {i // 400}\n")
+            else:
+                f.write(f"X{x:.3f} Y{y:.3f}\n")
+        f.write("G0 Z5\nM30\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "program.nc")
+        write_program(path, args.lines)
+        print(f"{args.lines} lines, {os.path.getsize(path) / 1e6:.1f} MB")
+
+        estimator = JobEstimator()
+        start = time.perf_counter()
+        estimate = estimator.estimate_program(path)
+        elapsed = time.perf_counter() - start
+
+    print(f"Estimated in {elapsed:.2f} s ({args.lines / elapsed:,.0f} lines/s)")
+    print(f"Job: {estimate.duration / 60:.1f} min over {estimate.moves} moves, "
+          f"{estimate.distance:.0f} mm, bounds {estimate.bounds}, travel {estimate.travel}")
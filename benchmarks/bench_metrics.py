@@ -0,0 +1,51 @@
+"""Cost of the instrumentation hooks, disabled and enabled.
+
+Run from the repository root:
+    python benchmarks/bench_metrics.py [--events 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics
+
+
+def hook(metrics, hist, events):
+    # Same shape as the hooks in the hot paths
+    start = time.perf_counter()
+    for _ in range(events):
+        if metrics.enabled:
+            t0 = time.perf_counter()
+            hist.observe(time.perf_counter() - t0)
+    return (time.perf_counter() - start) / events
+
+
+def baseline(events):
+    start = time.perf_counter()
+    for _ in range(events):
+        pass
+    return (time.perf_counter() - start) / events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000000)
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    hist = metrics.histogram('bench_seconds')
+    empty = baseline(args.events)
+    disabled = hook(metrics, hist, args.events)
+    metrics.enable()
+    enabled = hook(metrics, hist, args.events)
+
+    print(f"disabled hook: {1e9 * (disabled - empty):.0f} ns/event")
+    print(f"enabled hook:  {1e9 * (enabled - empty):.0f} ns/event (two perf_counter calls + observe)")
+    print(f"histogram: {hist.count} samples, p50 {1e9 * hist.quantile(0.5):.0f} ns, "
+          f"{len(hist.counts) * hist.counts.itemsize} bytes of bucket storage")
+    start = time.perf_counter()
+    text = metrics.to_prometheus()
+    print(f"Prometheus dump: {len(text)} bytes in {1000 * (time.perf_counter() - start):.2f} ms")
@@ -0,0 +1,82 @@
+"""Benchmark mosaic stitching during a simulated tile scan.
+
+A VirtualCamera scan is fed to a MosaicStitcher while it runs. Reports the
+scan time with and without stitching, the time close() takes to place the
+remaining tiles, how many tiles were registered, the registration
+corrections (the simulator renders the stage position exactly, so they
+should stay within a pixel or two) and how well each saved tile matches
+the canvas where it was placed (mean absolute difference, grey levels).
+
+Run from the repository root:
+    python benchmarks/bench_mosaic.py [--region 6 4] [--overlap 0.15]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from camera_stream import CameraStream
+from cnc_control import CNCController
+from mosaic import MosaicStitcher
+from simulator import SimulatedController, VirtualCamera
+from tile_scan import ScanPlan, TileScanner
+
+
+def run(args, stitch):
+    sim = SimulatedController()
+    controller = CNCController(sim.start(), baudrate=sim.baudrate)
+    controller.connect()
+    mm_per_px = 0.002
+    camera = CameraStream(capture=VirtualCamera(args.width, args.height, stage=sim, mm_per_px=mm_per_px))
+    camera.start()
+    plan = ScanPlan(0, 0, args.region[0], args.region[1], args.width * mm_per_px, args.height * mm_per_px,
+                    overlap=args.overlap)
+    label = "stitched" if stitch else "no stitching"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            stitcher = MosaicStitcher(os.path.join(tmp, "mosaic"), plan.bounds(), mm_per_px) if stitch else None
+            scanner = TileScanner(controller, camera, plan, tmp, dwell=0.05, image_ext=".png", stitcher=stitcher)
+            stats = scanner.run()
+            print(f"[{label}] {stats['done']} tiles in {stats['elapsed_s']:.2f} s")
+            if stitcher is None:
+                return
+            started = time.perf_counter()
+            stitcher.close()
+            closing = time.perf_counter() - started
+            canvas = stitcher.levels[0]
+            shifts, diffs = [], []
+            for tile in plan.tiles():
+                nx, ny, fx, fy = stitcher._final[(tile.row, tile.col)]
+                shifts.append(np.hypot(fx - nx, fy - ny))
+                image = cv2.imread(scanner.tile_path(tile))
+                h, w = image.shape[:2]
+                placed = np.asarray(canvas[fy:fy + h, fx:fx + w])
+                if placed.shape == image.shape:
+                    diffs.append(np.abs(placed.astype(np.float32) - image).mean())
+            print(f"[{label}] canvas {stitcher.width}x{stitcher.height} px, {len(stitcher.levels)} levels, "
+                  f"close() {closing:.2f} s, {stitcher.tiles_registered}/{stitcher.tiles_placed} tiles registered, "
+                  f"{len(stitcher.errors) + stitcher.registration_errors} errors")
+            print(f"[{label}] registration correction mean {np.mean(shifts):.1f} px / max {np.max(shifts):.1f} px, "
+                  f"tile vs canvas difference mean {np.mean(diffs):.1f} / max {np.max(diffs):.1f}")
+    finally:
+        camera.stop()
+        controller.disconnect()
+        sim.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--region", type=float, nargs=2, default=[6.0, 4.0], help="scan width and height, mm")
+    parser.add_argument("--overlap", type=float, default=0.15)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+
+    run(args, stitch=False)
+    run(args, stitch=True)
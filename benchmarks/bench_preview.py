@@ -0,0 +1,59 @@
+"""CPU cost per displayed preview frame: legacy path vs PreviewRenderer.
+
+Run from the repository root:
+    python benchmarks/bench_preview.py [--width 3840 --height 2160 --frames 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtWidgets import QApplication
+
+from preview import PreviewRenderer
+
+
+def legacy_render(frame, width, height):
+    """The original update_frame path: full-res cvtColor, then Qt scaling."""
+    rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    h, w, ch = rgb_image.shape
+    qt_image = QImage(rgb_image.data, w, h, ch * w, QImage.Format_RGB888)
+    pixmap = QPixmap.fromImage(qt_image)
+    return pixmap.scaled(width, height, Qt.KeepAspectRatio)
+
+
+def measure(render, frames, width, height):
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for i in range(args.frames):
+        render(frames[i % len(frames)], width, height)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return 1000.0 * cpu / args.frames, 1000.0 * wall / args.frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--target-width", type=int, default=640)
+    parser.add_argument("--target-height", type=int, default=480)
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8) for _ in range(4)]
+    renderer = PreviewRenderer()
+
+    print(f"Source {args.width}x{args.height} -> preview {args.target_width}x{args.target_height}, {args.frames} frames")
+    for name, render in (("legacy", legacy_render), ("renderer", renderer.render)):
+        cpu_ms, wall_ms = measure(render, frames, args.target_width, args.target_height)
+        print(f"{name:>10}: {cpu_ms:7.2f} ms CPU / frame   {wall_ms:7.2f} ms wall / frame")
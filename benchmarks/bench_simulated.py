@@ -0,0 +1,213 @@
+"""Hardware-free benchmarks against the simulated controller and camera.
+
+Sections (all by default, or pick with --only):
+    throughput  lines/s streamed with character counting vs one-at-a-time
+    latency     round trip of a single command (send -> ok)
+    camera      frames/s captured and delivered by CameraStream
+    discovery   time to find N simulated controllers and M virtual cameras
+    stations    scans scheduled across N stations in one process, one of which fails
+
+Run from the repository root:
+    python benchmarks/bench_simulated.py [--only throughput] [--baudrate 115200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from camera_stream import CameraStream, POLICY_LATEST
+from cnc_control import CNCController
+from device_discovery import DeviceDiscovery
+from initialial_communication_base import InitialCommunication
+from simulator import SimulatedController, VirtualCamera
+from stations import Station, StationManager
+from tile_scan import ScanPlan
+
+
+def connect(sim):
+    controller = CNCController(sim.start(), baudrate=sim.baudrate)
+    controller.connect()
+    return controller
+
+
+def bench_throughput(args):
+    # time_scale=0: moves finish instantly, so only the serial link limits throughput
+    sim = SimulatedController(baudrate=args.baudrate, time_scale=0.0)
+    controller = connect(sim)
+    try:
+        lines = [f"G1 X{i % 100 * 0.01:.2f} Y{i % 37 * 0.01:.2f} F3000" for i in range(args.lines)]
+        # Full duplex: the longer of line and 'ok\r\n' limits the rate
+        wire_limit = args.baudrate / 10.0 / max(sum(len(l) + 1 for l in lines) / len(lines), 4)
+
+        start = time.perf_counter()
+        failed = controller.stream(lines)
+        streamed = len(lines) / (time.perf_counter() - start)
+
+        count = min(len(lines), 300)
+        start = time.perf_counter()
+        for line in lines[:count]:
+            controller.stream([line])  # wait for each ok before sending the next line
+        single = count / (time.perf_counter() - start)
+    finally:
+        controller.disconnect()
+        sim.stop()
+    print(f"[throughput] streamed {streamed:,.0f} lines/s, one-at-a-time {single:,.0f} lines/s, "
+          f"wire limit ~{wire_limit:,.0f} lines/s; {len(failed)} failed, "
+          f"RX high water {sim.rx_high_water}/{sim.rx_buffer_size} B, overflows {sim.rx_overflows}")
+
+
+def bench_latency(args):
+    sim = SimulatedController(baudrate=args.baudrate, time_scale=0.0)
+    controller = connect(sim)
+    try:
+        samples = []
+        for _ in range(args.round_trips):
+            start = time.perf_counter()
+            controller.stream(["G90"])
+            samples.append(time.perf_counter() - start)
+    finally:
+        controller.disconnect()
+        sim.stop()
+    ms = np.array(samples) * 1000.0
+    print(f"[latency] {len(ms)} round trips: mean {ms.mean():.2f} ms, p50 {np.percentile(ms, 50):.2f} ms, "
+          f"p99 {np.percentile(ms, 99):.2f} ms, max {ms.max():.2f} ms")
+
+
+def bench_camera(args):
+    capture = VirtualCamera(args.width, args.height, fps=args.fps)
+    camera = CameraStream(capture=capture)
+    if not camera.start():
+        print(f"[camera] could not start: {camera.error}")
+        return
+    display = camera.subscribe("bench", POLICY_LATEST)
+    delivered = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < args.seconds:
+            frame = display.get(timeout=0.5)
+            if frame is not None:
+                delivered += 1
+                frame.release()
+        elapsed = time.perf_counter() - start
+        stats = camera.stats()
+    finally:
+        display.close()
+        camera.stop()
+    target = f"{args.fps:g}" if args.fps else "unpaced"
+    print(f"[camera] {args.width}x{args.height} @ {target}: captured {stats['frames_captured'] / elapsed:.1f} fps, "
+          f"delivered {delivered / elapsed:.1f} fps, dropped {display.dropped}, "
+          f"pool exhausted {stats['pool_exhausted']}")
+
+
+class SimulatedCommunication(InitialCommunication):
+    """InitialCommunication that sees simulated ports and virtual cameras only."""
+
+    def __init__(self, ports, cameras, **kwargs):
+        super().__init__(**kwargs)
+        self.ports = ports
+        self.max_cam_index = cameras
+
+    def get_serial_port_info(self):
+        return [(port, "Simulated controller", "0000:0000") for port in self.ports]
+
+    def get_camera_names_windows(self):
+        return {}
+
+    def probe_camera(self, index):
+        capture = VirtualCamera(640, 480, fps=30)
+        try:
+            return capture.isOpened() and capture.read()[0]
+        finally:
+            capture.release()
+
+
+def bench_discovery(args):
+    sims = [SimulatedController(baudrate=args.baudrate) for _ in range(args.controllers)]
+    ports = [sim.start() for sim in sims]
+    try:
+        comm = SimulatedCommunication(ports, args.cameras, cnc_cmds=['$I'])
+        with tempfile.TemporaryDirectory() as tmp:
+            discovery = DeviceDiscovery(comm, cache_path=os.path.join(tmp, "cache.json"), probe_ports=True)
+            found = {}
+            start = time.perf_counter()
+            discovery.discover(on_done=lambda p, c: found.update(ports=p, cameras=c))
+            elapsed = time.perf_counter() - start
+    finally:
+        for sim in sims:
+            sim.stop()
+    controllers = sum(1 for port in found['ports'] if port[3])
+    print(f"[discovery] {controllers}/{args.controllers} controllers and "
+          f"{len(found['cameras'])}/{args.cameras} cameras in {elapsed:.2f} s")
+
+
+def run_scans(count, args, fail_after=None):
+    sims = [SimulatedController(baudrate=args.baudrate) for _ in range(count)]
+    stations = [Station(f"s{i}", sim.start(), VirtualCamera(640, 480, stage=sim, seed=i)) for i, sim in enumerate(sims)]
+    manager = StationManager(stations)
+    manager.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        plan = ScanPlan(0, 0, 4, 3, 1.2, 0.9)
+        start, cpu = time.perf_counter(), time.process_time()
+        futures = [manager.submit_scan(plan, os.path.join(tmp, f"scan{i}"), dwell=0.05) for i in range(args.scans)]
+        if fail_after is not None:
+            time.sleep(fail_after)
+            sims[-1].stop()  # unplug the last station mid-scan
+        threads = threading.active_count()
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result()['done'])
+            except Exception as e:
+                results.append(e)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    manager.stop()
+    for sim in sims:
+        sim.stop()
+    completed = sum(1 for r in results if not isinstance(r, Exception))
+    return elapsed, cpu, threads, completed, len(plan)
+
+
+def bench_stations(args):
+    elapsed, _, _, _, tiles = run_scans(1, args)
+    print(f"[stations] {args.scans} scans of {tiles} tiles on 1 station: {elapsed:.2f} s")
+    elapsed, cpu, threads, completed, _ = run_scans(args.stations, args)
+    print(f"[stations] same on {args.stations} stations: {elapsed:.2f} s, {100 * cpu / elapsed:.0f}% CPU, "
+          f"{threads} threads, {completed}/{args.scans} scans completed")
+    elapsed, _, _, completed, _ = run_scans(args.stations, args, fail_after=0.5)
+    print(f"[stations] with one station unplugged after 0.5 s: {elapsed:.2f} s, "
+          f"{completed}/{args.scans} scans completed")
+
+
+SECTIONS = {
+    'throughput': bench_throughput,
+    'latency': bench_latency,
+    'camera': bench_camera,
+    'discovery': bench_discovery,
+    'stations': bench_stations,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=sorted(SECTIONS), action="append")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--round-trips", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=float, default=30.0, help="0 = as fast as possible")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--controllers", type=int, default=4)
+    parser.add_argument("--cameras", type=int, default=3)
+    parser.add_argument("--stations", type=int, default=4)
+    parser.add_argument("--scans", type=int, default=8)
+    args = parser.parse_args()
+
+    for name in args.only or SECTIONS:
+        SECTIONS[name](args)
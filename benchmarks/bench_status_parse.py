@@ -0,0 +1,45 @@
+"""Cost of parsing one GRBL status report into MachineState.
+
+Run from the repository root:
+    python benchmarks/bench_status_parse.py [--reports 200000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from machine_state import MachineState
+
+REPORTS = [
+    "<Idle|MPos:0.000,0.000,0.000|FS:0,0|WCO:0.000,0.000,0.000>",
+    "<Run|MPos:12.345,-3.210,1.500|Bf:15,128|FS:3000,0>",
+    "<Run|MPos:12.400,-3.210,1.500|Bf:14,96|FS:3000,0|Ov:100,100,100>",
+    "<Jog|WPos:5.000,2.500,-0.250|Bf:15,127|FS:1200,0>",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reports", type=int, default=200000)
+    args = parser.parse_args()
+
+    state = MachineState()
+    notifications = [0]
+
+    def on_change(_state):
+        notifications[0] += 1
+
+    state.subscribe(on_change)
+    lines = [REPORTS[i % len(REPORTS)] for i in range(args.reports)]
+
+    start = time.perf_counter()
+    for line in lines:
+        state.update_from_status(line)
+    elapsed = time.perf_counter() - start
+
+    per_report_us = 1e6 * elapsed / args.reports
+    print(f"{args.reports} reports in {elapsed:.3f} s: {per_report_us:.2f} us/report")
+    print(f"At 50 Hz polling that is {100 * per_report_us * 50 / 1e6:.4f} % of one core")
+    print(f"{notifications[0]} change notifications, final state: {state.snapshot()}")
@@ -0,0 +1,280 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+POLICY_LATEST = 'latest'            # consumer only ever sees the newest frame
+POLICY_DROP_OLDEST = 'drop_oldest'  # bounded FIFO, oldest frame dropped when full
+
+
+class Frame:
+    """A captured image that lives in one of the stream's pool buffers.
+
+    The image is not copied; call release() (or use the frame as a context
+    manager) once done with it so the buffer can be reused for capture.
+    """
+    __slots__ = ('index', 'timestamp', 'image', '_slot', '_stream', '_released')
+
+    def __init__(self, index, timestamp, image, slot, stream):
+        self.index = index
+        self.timestamp = timestamp  # time.perf_counter() right after read()
+        self.image = image
+        self._slot = slot
+        self._stream = stream
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._stream._release(self._slot)
+
+    def _release_locked(self):
+        # Variant of release() for callers already holding the stream lock
+        if not self._released:
+            self._released = True
+            self._stream._unref(self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameSubscriber:
+    """A consumer's view of the stream with its own queue and drop policy."""
+
+    def __init__(self, stream, name, policy=POLICY_LATEST, depth=1):
+        if policy not in (POLICY_LATEST, POLICY_DROP_OLDEST):
+            raise ValueError(f"Unknown frame policy: {policy}")
+        self.stream = stream
+        self.name = name
+        self.policy = policy
+        self.depth = 1 if policy == POLICY_LATEST else max(1, depth)
+        self._frames = deque()
+        self._ready = threading.Condition(stream._lock)
+        self.delivered = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def get(self, timeout=None):
+        """Return the next Frame, or None if none arrives within timeout.
+
+        timeout=0 returns immediately; the caller must release() the frame.
+        """
+        with self._ready:
+            if not self._frames and timeout != 0:
+                self._ready.wait_for(lambda: self._frames or not self.stream.running, timeout)
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self.delivered += 1
+        latency = time.perf_counter() - frame.timestamp
+        self.latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        return frame
+
+    def pending(self):
+        """Number of frames waiting to be taken."""
+        return len(self._frames)
+
+    def close(self):
+        """Unsubscribe and give back any queued frames."""
+        self.stream._unsubscribe(self)
+
+    def stats(self):
+        return {
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'queued': len(self._frames),
+            'latency_avg_ms': 1000.0 * self.latency_total / self.delivered if self.delivered else 0.0,
+            'latency_max_ms': 1000.0 * self.latency_max,
+        }
+
+    def _push(self, frame):
+        # Called by the capture thread with the stream lock held
+        if self.policy == POLICY_LATEST:
+            while self._frames:
+                self._frames.popleft()._release_locked()
+                self.dropped += 1
+        elif len(self._frames) >= self.depth:
+            self._frames.popleft()._release_locked()
+            self.dropped += 1
+        self._frames.append(frame)
+        self._ready.notify()
+
+
+class CameraStream:
+    """Capture frames on a background thread at the camera's native rate.
+
+    Frames are read straight into a fixed pool of preallocated numpy buffers
+    with `read(image=...)`. Each consumer subscribes with its own policy and
+    gets the same buffers without copies; a buffer returns to the pool once
+    every consumer has released it. If every buffer is still held, the
+    frame is grabbed and discarded so the camera never backs up.
+
+    `capture` may be any object with the cv2.VideoCapture interface; by
+    default cv2.VideoCapture(cam_index) is opened.
+    """
+
+    def __init__(self, cam_index=0, width=None, height=None, pool_size=8, capture=None):
+        self.cam_index = cam_index
+        self.width = width
+        self.height = height
+        self.pool_size = max(2, pool_size)
+        self.cap = capture
+        self.running = False
+        self.error = None
+
+        self._lock = threading.Lock()
+        self._buffers = []
+        self._refs = []
+        self._free = deque()
+        self._subscribers = []
+        self._thread = None
+
+        self.frames_captured = 0
+        self.pool_exhausted = 0
+        self.read_failures = 0
+        self.fps = 0.0
+
+    def start(self):
+        """Open the camera, allocate the buffer pool and start capturing."""
+        if self.running:
+            return True
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(self.cam_index)
+        if not self.cap.isOpened():
+            self.error = f"Camera {self.cam_index} could not be opened."
+            return False
+        if self.width and self.height:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+
+        ret, first = self.cap.read()
+        if not ret:
+            self.error = f"Camera {self.cam_index} delivered no frame."
+            return False
+        self._buffers = [first] + [np.empty_like(first) for _ in range(self.pool_size - 1)]
+        self._refs = [0] * self.pool_size
+        self._free = deque(range(self.pool_size))
+
+        self.error = None
+        self.running = True
+        self._interval = METRICS.histogram('camera_frame_interval_seconds', {'camera': self.cam_index},
+                                           help="Time between consecutive captured frames")
+        METRICS.add_collector(('camera', id(self)), self._collect_metrics)
+        self._thread = threading.Thread(target=self._run, name=f"camera-{self.cam_index}", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop capturing and release the camera."""
+        self.running = False
+        METRICS.remove_collector(('camera', id(self)))
+        if self._thread and threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._thread = None
+        with self._lock:
+            for sub in self._subscribers:
+                sub._ready.notify_all()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def subscribe(self, name, policy=POLICY_LATEST, depth=1):
+        """Register a consumer and return its FrameSubscriber."""
+        sub = FrameSubscriber(self, name, policy, depth)
+        with self._lock:
+            self._subscribers.append(sub)
+        return sub
+
+    def stats(self):
+        return {
+            'frames_captured': self.frames_captured,
+            'fps': self.fps,
+            'pool_exhausted': self.pool_exhausted,
+            'read_failures': self.read_failures,
+            'subscribers': {sub.name: sub.stats() for sub in self._subscribers},
+        }
+
+    def _collect_metrics(self):
+        labels = {'camera': self.cam_index}
+        yield 'camera_frames_captured_total', labels, self.frames_captured
+        yield 'camera_fps', labels, self.fps
+        yield 'camera_pool_exhausted_total', labels, self.pool_exhausted
+        yield 'camera_read_failures_total', labels, self.read_failures
+        for sub in list(self._subscribers):
+            sub_labels = dict(labels, subscriber=sub.name)
+            yield 'camera_frames_delivered_total', sub_labels, sub.delivered
+            yield 'camera_frames_dropped_total', sub_labels, sub.dropped
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            while sub._frames:
+                sub._frames.popleft()._release_locked()
+
+    def _release(self, slot):
+        with self._lock:
+            self._unref(slot)
+
+    def _unref(self, slot):
+        self._refs[slot] -= 1
+        if self._refs[slot] == 0:
+            self._free.append(slot)
+
+    def _run(self):
+        last = time.perf_counter()
+        failures = 0
+        while self.running:
+            with self._lock:
+                slot = self._free.popleft() if self._free else None
+            if slot is None:
+                # Every buffer is held by a consumer: drop this frame
+                self.cap.grab()
+                self.pool_exhausted += 1
+                continue
+
+            ret, image = self.cap.read(image=self._buffers[slot])
+            now = time.perf_counter()
+            if not ret:
+                with self._lock:
+                    self._free.append(slot)
+                self.read_failures += 1
+                failures += 1
+                if failures > 50 or not self.cap.isOpened():
+                    self.error = "Camera stopped delivering frames."
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            if image is not self._buffers[slot]:
+                # The backend allocated a new array (e.g. resolution change)
+                self._buffers[slot] = image
+
+            self.frames_captured += 1
+            dt = now - last
+            last = now
+            if dt > 0:
+                self.fps = 0.9 * self.fps + 0.1 / dt if self.fps else 1.0 / dt
+            if METRICS.enabled:
+                self._interval.observe(dt)
+
+            with self._lock:
+                self._refs[slot] = 1  # held by the capture thread while publishing
+                for sub in self._subscribers:
+                    self._refs[slot] += 1
+                    sub._push(Frame(self.frames_captured, now, image, slot, self))
+                self._unref(slot)
+        self.running = False
+        with self._lock:
+            for sub in self._subscribers:
+                sub._ready.notify_all()
\ No newline at end of file
@@ -1,39 +1,308 @@
 import serial
 import time
+import os
+import re
+import threading
+from collections import deque
+
+from command_queue import CommandQueue, PRIORITY_NORMAL
+from serial_reader import SerialReader
+from machine_state import MachineState
+from gcode_loader import GCodeLine
+from metrics import METRICS
+
+# GRBL real-time commands: executed immediately, never queued or acknowledged
+REALTIME_COMMANDS = {
+    'status': b'?',
+    'feed_hold': b'!',
+    'cycle_start': b'~',
+    'jog_cancel': b'\x85',
+    'soft_reset': b'\x18',
+}
+
+# Startup banners of GRBL and Marlin; the board is ready once one arrives
+BANNER_PREFIXES = ('Grbl', 'start')
+FIRMWARE_GRBL = 'grbl'
+FIRMWARE_MARLIN = 'marlin'
+
+_MODAL_WORDS = re.compile(r'G0*(90|91)(?![\d.])|F([-+]?[\d.]+)')
 
 class CNCController:
-    def __init__(self, port, baudrate=115200, timeout=3):
+    def __init__(self, port, baudrate=115200, timeout=3, rx_buffer_size=128):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.ser = None
         self.step_size = 1.0  # Default step size in mm
+        self.rx_buffer_size = rx_buffer_size  # GRBL serial RX buffer in bytes
+        self.commands = CommandQueue(name=f"cnc-io-{port}")
+        self._write_lock = threading.Lock()
+        self._closing = threading.Event()
+        self.reader = SerialReader()  # sole consumer of the port once connected
+        self.reader.subscribe('message', self._print_message)
+        self.state = MachineState()
+        self.reader.subscribe('status', self.state.update_from_status)
+        self.reader.subscribe('message', self.state.handle_message)
+        self._poll_thread = None
+        self._poll_stop = threading.Event()
+        self.modal = {'distance': None, 'feed': None}  # last G90/G91 and F sent
+        self.firmware = None  # FIRMWARE_GRBL/FIRMWARE_MARLIN from the banner, None if none seen
+        self.session_log = None  # session_log.SessionLog, set by its attach()
+        self._round_trip = METRICS.histogram('cnc_command_seconds', {'port': port},
+                                             help="Time from writing a line to its ok/error")
+
+    def connect(self, boot_timeout=2.0):
+        """Establish serial connection to the CNC device.
 
-    def connect(self):
-        """Establish serial connection to the CNC device."""
+        Opening the port resets most boards; this returns as soon as the
+        startup banner arrives, or after `boot_timeout` s for boards that
+        do not print one.
+        """
+        booted = threading.Event()
+
+        def on_message(line):
+            if line.startswith(BANNER_PREFIXES):
+                self.firmware = FIRMWARE_GRBL if line.startswith('Grbl') else FIRMWARE_MARLIN
+                booted.set()
+
+        self.reader.subscribe('message', on_message)
         try:
+            self._closing.clear()
+            self.modal = {'distance': None, 'feed': None}
             self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
-            time.sleep(2)  # Wait for initialization
+            self.reader.start(self.ser)  # captures the startup banner
+            booted.wait(boot_timeout)  # Wait for initialization
             if self.ser.is_open:
+                self.commands.start()
+                METRICS.add_collector(('cnc', self.port), self._collect_metrics)
                 print(f"CNC connected on {self.port}")
         except serial.SerialException as e:
             print(f"Error while connecting to CNC: {e}")
             self.ser = None
+        finally:
+            self.reader.unsubscribe('message', on_message)
+
+    def send_command(self, cmd, timeout=None):
+        """Send a G-code or M-code command to the CNC and optionally read the response.
 
-    def send_command(self, cmd):
-        """Send a G-code or M-code command to the CNC and optionally read the response."""
+        Multi-line commands are streamed line by line; the reply of the last
+        line is returned, or the first error reply if a line was rejected.
+        `timeout` overrides self.timeout for commands that reply late
+        (homing, `G4 P0` after a long move).
+        """
         if self.ser and self.ser.is_open:
-            self.ser.write((cmd + '\n').encode('utf-8'))
+            response = None
+            for line, reply in self._stream_lines(cmd.splitlines(), timeout):
+                if response is None or not response.startswith('error'):
+                    response = reply
             print(f"Command sent: {cmd}")
-            response = self.ser.readline().decode('utf-8').strip()
             print(f"Response: {response}")
             return response
         else:
             print("Serial connection not open.")
             return None
 
+    def submit(self, cmd, priority=PRIORITY_NORMAL, timeout=None):
+        """Queue a command on the I/O worker; returns a Future for its response."""
+        return self.commands.submit(self.send_command, cmd, timeout, priority=priority)
+
+    def submit_program(self, program, on_reply=None, priority=PRIORITY_NORMAL):
+        """Queue a whole program for streaming; the Future resolves to the failed lines."""
+        return self.commands.submit(self.stream, program, on_reply, priority=priority)
+
+    def realtime(self, name):
+        """Write a real-time command (see REALTIME_COMMANDS) bypassing the queue."""
+        if not (self.ser and self.ser.is_open):
+            print("Serial connection not open.")
+            return False
+        self._write(REALTIME_COMMANDS[name])
+        if self.session_log is not None:
+            self.session_log.realtime(name)
+        return True
+
+    def feed_hold(self):
+        return self.realtime('feed_hold')
+
+    def cycle_start(self):
+        return self.realtime('cycle_start')
+
+    def status_query(self):
+        return self.realtime('status')
+
+    def jog_cancel(self):
+        return self.realtime('jog_cancel')
+
+    def start_status_polling(self, rate_hz=20):
+        """Query the real-time status rate_hz times per second to keep self.state current."""
+        self.stop_status_polling()
+        if not (self.ser and self.ser.is_open) or rate_hz <= 0:
+            return False
+        self._poll_stop.clear()
+        self._poll_thread = threading.Thread(
+            target=self._poll_status, args=(1.0 / rate_hz,),
+            name=f"cnc-status-{self.port}", daemon=True)
+        self._poll_thread.start()
+        return True
+
+    def is_polling(self):
+        return self._poll_thread is not None and self._poll_thread.is_alive()
+
+    def stop_status_polling(self):
+        self._poll_stop.set()
+        if self._poll_thread and self._poll_thread is not threading.current_thread():
+            self._poll_thread.join()
+        self._poll_thread = None
+
+    def _poll_status(self, interval):
+        next_poll = time.monotonic()
+        while not self._poll_stop.is_set():
+            try:
+                self._write(REALTIME_COMMANDS['status'])
+            except (serial.SerialException, OSError, AttributeError):
+                break
+            # Fixed-rate schedule that does not drift with write time
+            next_poll += interval
+            delay = next_poll - time.monotonic()
+            if delay < 0:
+                next_poll = time.monotonic()
+                delay = 0
+            if self._poll_stop.wait(delay):
+                break
+
+    def stream(self, program, on_reply=None):
+        """Stream a G-code program using character-counting flow control.
+
+        `program` may be a multi-line string, a path (os.PathLike), an open file or any
+        iterable of lines, including a gcode_loader.GCodeProgram whose
+        pre-encoded lines are written as-is. Lines are sent as long as they fit into the
+        controller's RX buffer, so the planner never runs dry between short
+        segments. Each `ok`/`error:N` is matched to the line that caused it
+        and passed to `on_reply(line, reply)`. Returns a list of
+        (line, reply) pairs for lines that failed or timed out.
+        """
+        if not (self.ser and self.ser.is_open):
+            print("Serial connection not open.")
+            return None
+
+        if isinstance(program, os.PathLike):
+            with open(program, 'r', encoding='utf-8', errors='ignore') as f:
+                return self.stream(f, on_reply)
+        if isinstance(program, str):
+            program = program.splitlines()
+
+        failed = []
+        for line, reply in self._stream_lines(program):
+            if on_reply:
+                on_reply(line, reply)
+            if reply is None or reply.startswith('error'):
+                failed.append((line, reply))
+        return failed
+
+    def _stream_lines(self, lines, timeout=None):
+        """Yield (line, reply) pairs while keeping the RX buffer filled."""
+        pending = deque()  # (line, byte count, write time) in the controller's buffer
+        log = self.session_log
+        timed = METRICS.enabled or log is not None
+        buffered = 0
+        self.reader.clear_acks()
+        for raw in lines:
+            if self._closing.is_set():
+                return
+            if isinstance(raw, GCodeLine):
+                line, data = raw.text, raw.data  # already cleaned and encoded
+            else:
+                line = self._clean_line(raw)
+                if not line:
+                    continue
+                data = (line + '\n').encode('utf-8')
+            if len(data) > self.rx_buffer_size:
+                raise ValueError(f"Line exceeds RX buffer ({self.rx_buffer_size} bytes): {line}")
+
+            # Wait for replies until the next line fits into the buffer
+            while pending and buffered + len(data) > self.rx_buffer_size:
+                sent, size, sent_at = pending.popleft()
+                buffered -= size
+                reply = self._read_reply(timeout)
+                if timed:
+                    self._observe_reply(log, sent, reply, time.perf_counter() - sent_at)
+                yield sent, reply
+                if reply is None:
+                    if not self._closing.is_set():
+                        print(f"Timeout waiting for reply to: {sent}")
+                    return
+
+            self._write(data)
+            if log is not None:
+                log.sent(line)
+            self._track_modal(line)
+            pending.append((line, len(data), time.perf_counter() if timed else 0.0))
+            buffered += len(data)
+
+        while pending:
+            sent, _, sent_at = pending.popleft()
+            reply = self._read_reply(timeout)
+            if timed:
+                self._observe_reply(log, sent, reply, time.perf_counter() - sent_at)
+            yield sent, reply
+            if reply is None:
+                if not self._closing.is_set():
+                    print(f"Timeout waiting for reply to: {sent}")
+                return
+
+    def _observe_reply(self, log, line, reply, latency):
+        if METRICS.enabled:
+            self._round_trip.observe(latency)
+        if log is not None:
+            log.received(reply, line, latency)
+
+    def _track_modal(self, line):
+        """Remember the distance mode and feed rate last sent to the controller."""
+        if line.startswith('$'):  # $J= jogs carry their own modes
+            return
+        for distance, feed in _MODAL_WORDS.findall(line.upper()):
+            if distance:
+                self.modal['distance'] = 'G' + distance
+            elif feed:
+                self.modal['feed'] = float(feed)
+
+    def _write(self, data):
+        with self._write_lock:
+            self.ser.write(data)
+
+    def _read_reply(self, timeout=None):
+        """Wait for the next `ok` or `error` reply; None on timeout."""
+        return self.reader.wait_ack(self.timeout if timeout is None else timeout)
+
+    @staticmethod
+    def _print_message(line):
+        print(f"CNC message: {line}")
+
+    def _collect_metrics(self):
+        labels = {'port': self.port}
+        yield 'cnc_queue_depth', labels, self.commands.pending()
+        yield 'cnc_planner_blocks_free', labels, self.state.buffer_blocks
+        yield 'cnc_rx_bytes_free', labels, self.state.buffer_bytes
+        yield 'cnc_status_reports_total', labels, self.state.reports
+
+    @staticmethod
+    def _clean_line(line):
+        """Strip whitespace and `;` comments from a G-code line."""
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='ignore')
+        return line.split(';', 1)[0].strip()
+
     def disconnect(self):
-        """Close the serial connection to the CNC device."""
+        """Stop the I/O worker and close the serial connection to the CNC device.
+
+        Queued commands are cancelled; a command already being sent stops
+        after its current line, and one waiting for a reply stops waiting.
+        """
+        self._closing.set()  # stops a running stream after its current line
+        METRICS.remove_collector(('cnc', self.port))
+        self.stop_status_polling()
+        self.reader.interrupt()
+        self.commands.shutdown(wait=True, cancel_pending=True)
+        self.reader.stop()
         if self.ser and self.ser.is_open:
             self.ser.close()
             print("CNC connection closed.")
@@ -0,0 +1,88 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import METRICS
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_STOP = object()
+
+
+class CommandQueue:
+    """Run controller I/O jobs one at a time on a dedicated worker thread.
+
+    Jobs are ordered by priority and then by submission order. Every job
+    returns a concurrent.futures.Future so callers (e.g. the Qt event loop)
+    never block on serial I/O.
+    """
+
+    def __init__(self, name="cnc-io"):
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._thread = None
+        self._wait = METRICS.histogram('command_queue_wait_seconds', {'queue': name},
+                                       help="Time a job waited in the queue before running")
+
+    def start(self):
+        """Start the worker thread if it is not running yet."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future for its result."""
+        future = Future()
+        if not self.is_running():
+            future.set_exception(RuntimeError("Command queue is not running."))
+            return future
+        queued_at = time.perf_counter() if METRICS.enabled else 0.0
+        self._queue.put((priority, next(self._counter), future, fn, args, kwargs, queued_at))
+        return future
+
+    def pending(self):
+        """Number of jobs waiting to be executed."""
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True, cancel_pending=True):
+        """Stop the worker after the current job; optionally cancel queued jobs."""
+        if cancel_pending:
+            self._cancel_pending()
+        if self.is_running():
+            # The stop marker sorts after every real job of any priority
+            self._queue.put((PRIORITY_LOW + 1, next(self._counter), _STOP, None, (), {}, 0.0))
+            if wait and threading.current_thread() is not self._thread:
+                self._thread.join()
+
+    def _cancel_pending(self):
+        while True:
+            try:
+                _, _, future, _, _, _, _ = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if future is not _STOP:
+                future.cancel()
+
+    def _run(self):
+        while True:
+            _, _, future, fn, args, kwargs, queued_at = self._queue.get()
+            if future is _STOP:
+                break
+            if queued_at and METRICS.enabled:
+                self._wait.observe(time.perf_counter() - queued_at)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self._cancel_pending()
\ No newline at end of file
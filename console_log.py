@@ -0,0 +1,90 @@
+import re
+from collections import deque
+
+from PySide6.QtCore import QTimer
+from PySide6.QtWidgets import QPlainTextEdit
+
+LOG_CAPACITY = 2000   # lines kept in the widget and waiting to be shown
+LOG_FLUSH_MS = 100    # at most ~10 redraws per second however fast lines arrive
+
+# Periodic controller output that is only noise in the console: status
+# reports, Marlin busy/temperature/position auto-reports. It still goes to
+# the session log.
+STATUS_CHATTER = re.compile(r'^(<.*>|echo:busy|busy:|ok T:|T:\d|X:[-\d.]+ Y:[-\d.]+ Z:[-\d.]+ E:)')
+
+
+class ConsoleLog(QPlainTextEdit):
+    """Read-only console that can be fed from any thread at any rate.
+
+    append() only puts the line into a bounded buffer; a timer moves
+    everything buffered into the widget with a single appendPlainText()
+    every `flush_ms`, so a burst of lines costs one relayout. The widget
+    keeps at most `capacity` lines (oldest removed), and lines that pile
+    up faster than they are shown are dropped and counted. Consecutive
+    repeats are folded into one line with a count.
+
+    With a SessionLog, application lines are also recorded there as events.
+    """
+
+    def __init__(self, capacity=LOG_CAPACITY, flush_ms=LOG_FLUSH_MS, chatter=STATUS_CHATTER, session_log=None):
+        super().__init__()
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setMaximumBlockCount(capacity)
+        self.chatter = chatter
+        self.session_log = session_log
+        self.dropped = 0
+        self.filtered = 0
+        self._pending = deque(maxlen=capacity)  # appended by any thread, drained by the timer
+        self._last_line = None
+        self._repeats = 0
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start(flush_ms)
+
+    def append(self, text):
+        """Queue an application line (same name as QTextEdit.append)."""
+        if self.session_log is not None:
+            self.session_log.event(text)
+        self._queue(text)
+
+    def append_message(self, line):
+        """Queue a line of controller output; status chatter is not shown."""
+        if self.chatter is not None and self.chatter.match(line):
+            self.filtered += 1
+            return
+        self._queue(f"CNC: {line}")
+
+    def _queue(self, text):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(text)
+
+    def flush(self):
+        if not self._pending and not self.dropped:
+            return
+        lines = []
+        if self.dropped:
+            lines.append(f"... {self.dropped} lines not shown")
+            self.dropped = 0
+        while self._pending:
+            line = self._pending.popleft()
+            if line == self._last_line:
+                self._repeats += 1
+                continue
+            self._fold_repeats(lines)
+            self._last_line = line
+            lines.append(line)
+        self._fold_repeats(lines)
+        if not lines:
+            return
+        scrollbar = self.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+        self.appendPlainText("\n".join(lines))
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def _fold_repeats(self, lines):
+        if self._repeats:
+            lines.append(f"    (repeated {self._repeats} more time{'s' if self._repeats > 1 else ''})")
+            self._repeats = 0
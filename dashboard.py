@@ -0,0 +1,135 @@
+from PySide6.QtCore import QObject, QTimer, Qt, Signal
+from PySide6.QtWidgets import QGridLayout, QGroupBox, QLabel, QPushButton, QVBoxLayout, QWidget
+
+from camera_stream import POLICY_LATEST
+from preview import PreviewRenderer
+from stations import STATE_FAULT, STATE_OFFLINE
+
+DASHBOARD_FPS = 5          # previews are thumbnails; full rate stays with the station GUI
+TILE_SIZE = (320, 240)
+STATE_COLORS = {'ready': '#2e7d32', 'busy': '#1565c0', 'connecting': '#f9a825', 'fault': '#c62828'}
+
+
+class StationSignals(QObject):
+    """Deliver station state changes from worker threads to the GUI thread."""
+    changed = Signal(str)
+
+
+class StationTile(QGroupBox):
+    """Preview and status of one station."""
+
+    def __init__(self, station, manager):
+        super().__init__(station.name)
+        self.station = station
+        self.manager = manager
+        self.renderer = PreviewRenderer()
+        self.frames = None
+        self._camera = None
+
+        layout = QVBoxLayout()
+        self.preview = QLabel()
+        self.preview.setFixedSize(*TILE_SIZE)
+        self.preview.setAlignment(Qt.AlignCenter)
+        self.preview.setStyleSheet("background: black;")
+        self.status_label = QLabel()
+        self.detail_label = QLabel()
+        self.reconnect_button = QPushButton("Reconnect")
+        self.reconnect_button.clicked.connect(lambda: self.manager.reconnect(self.station.name))
+        layout.addWidget(self.preview)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.detail_label)
+        layout.addWidget(self.reconnect_button)
+        self.setLayout(layout)
+        self.update_state()
+
+    def update_state(self):
+        st = self.station
+        color = STATE_COLORS.get(st.state, '#757575')
+        text = f"<b style='color:{color}'>{st.state}</b>"
+        if st.job:
+            text += f" &nbsp;{st.job}"
+        if st.error:
+            text += f"<br><span style='color:#c62828'>{st.error}</span>"
+        self.status_label.setText(text)
+        self.reconnect_button.setVisible(st.state in (STATE_FAULT, STATE_OFFLINE))
+        # A reconnected station has a new CameraStream
+        if st.camera is not self._camera:
+            self._resubscribe(st.camera)
+
+    def refresh(self):
+        st = self.station
+        if self.frames is not None:
+            frame = self.frames.get(timeout=0)
+            if frame is not None:
+                self.preview.setPixmap(self.renderer.render(
+                    frame, self.preview.width(), self.preview.height(), self.devicePixelRatioF()))
+        if st.controller is not None:
+            m = st.controller.state
+            x, y, z = m.work_position
+            self.detail_label.setText(f"{m.state}  X {x:.3f}  Y {y:.3f}  Z {z:.3f}")
+        else:
+            self.detail_label.setText("")
+
+    def close_stream(self):
+        self._resubscribe(None)
+
+    def _resubscribe(self, camera):
+        if self.frames is not None:
+            self.frames.close()
+            self.frames = None
+        self.renderer.clear()
+        self.preview.clear()
+        self._camera = camera
+        if camera is not None:
+            self.frames = camera.subscribe('dashboard', POLICY_LATEST)
+
+
+class StationDashboard(QWidget):
+    """Grid of all stations of a StationManager, refreshed at DASHBOARD_FPS.
+
+    Each tile takes only the newest frame on a timer tick and scales it to
+    thumbnail size, so N previews cost N small resizes per tick rather than
+    N full-rate displays.
+    """
+
+    def __init__(self, manager, columns=3, fps=DASHBOARD_FPS):
+        super().__init__()
+        self.manager = manager
+        self.setWindowTitle("Microstep Stations")
+        self.signals = StationSignals()
+        self.signals.changed.connect(self.station_changed)
+        manager.on_change = lambda station: self.signals.changed.emit(station.name)
+
+        layout = QVBoxLayout()
+        grid = QGridLayout()
+        self.tiles = {}
+        for i, station in enumerate(manager.stations.values()):
+            tile = StationTile(station, manager)
+            self.tiles[station.name] = tile
+            grid.addWidget(tile, i // columns, i % columns)
+        layout.addLayout(grid)
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+        self.setLayout(layout)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(int(1000 / fps))
+
+    def station_changed(self, name):
+        tile = self.tiles.get(name)
+        if tile:
+            tile.update_state()
+
+    def refresh(self):
+        for tile in self.tiles.values():
+            tile.refresh()
+        states = [st.state for st in self.manager.stations.values()]
+        counts = ", ".join(f"{states.count(s)} {s}" for s in sorted(set(states)))
+        self.summary_label.setText(f"{counts}; {self.manager.pending()} jobs queued")
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        for tile in self.tiles.values():
+            tile.close_stream()
+        event.accept()
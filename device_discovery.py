@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".microstep", "device_cache.json")
+
+
+class DeviceDiscovery:
+    """Find serial ports and cameras concurrently, backed by an on-disk cache.
+
+    cached_ports()/cached_cameras() return the last known inventory
+    instantly. start() revalidates it in the background: every device is
+    probed on a worker pool and reported through the callbacks as soon as
+    its probe finishes. Probes still running at the deadline are not
+    dropped: the device keeps its cached entry, and the result is reported
+    (and cached) whenever the probe finishes. Each probe closes its own
+    port or camera handle. Ports are keyed by device name and VID:PID,
+    cameras by index and name.
+
+    Callbacks run on worker threads:
+        on_port((port, description, vid_pid, is_cnc))  is_cnc is None if not probed
+        on_camera((index, name))
+        on_done(ports, cameras)  the confirmed inventory
+    """
+
+    def __init__(self, comm, cache_path=DEFAULT_CACHE_PATH, max_workers=8, deadline=3.0, probe_ports=False):
+        self.comm = comm
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.deadline = deadline
+        # Probing writes comm.cnc_cmds to every port, so it is opt-in
+        self.probe_ports = probe_ports
+        self._cache = self._load_cache()
+        self._lock = threading.Lock()  # the cache is updated by probes finishing late
+        self._thread = None
+
+    # --- Cache ---
+
+    def cached_ports(self):
+        return [(e['port'], e['description'], e['vid_pid'], e.get('is_cnc'))
+                for e in self._cache['ports'].values()]
+
+    def cached_cameras(self):
+        return sorted((e['index'], e['name']) for e in self._cache['cameras'].values())
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            return {'ports': dict(cache.get('ports', {})), 'cameras': dict(cache.get('cameras', {}))}
+        except (OSError, ValueError):
+            return {'ports': {}, 'cameras': {}}
+
+    def _save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.comm.log(f"Could not write device cache: {e}")
+
+    # --- Discovery ---
+
+    def start(self, on_port=None, on_camera=None, on_done=None):
+        """Revalidate the inventory in the background."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self.discover, args=(on_port, on_camera, on_done),
+            name="device-discovery", daemon=True)
+        self._thread.start()
+
+    def discover(self, on_port=None, on_camera=None, on_done=None):
+        """Probe all devices concurrently; returns once every probe finished or the deadline passed.
+
+        Devices whose probe is still running at the deadline keep their
+        cached entry in the inventory; when the probe finishes later its
+        result is reported through the callbacks and the cache.
+        """
+        started = time.perf_counter()
+        ports = {}
+        found_cameras = {}  # index -> name reported so far
+        camera_names = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="discovery")
+        probes = {}  # future -> ('names',) | ('camera', index) | ('port', key, port, desc, vid_pid)
+        try:
+            probes[pool.submit(self.comm.get_camera_names_windows)] = ('names',)
+            for i in range(self.comm.max_cam_index):
+                probes[pool.submit(self.comm.probe_camera, i)] = ('camera', i)
+
+            for port, desc, vid_pid in self.comm.get_serial_port_info():
+                key = f"{port}|{vid_pid}"
+                if self.probe_ports:
+                    probes[pool.submit(self.comm.is_cnc_port, port)] = ('port', key, port, desc, vid_pid)
+                else:
+                    is_cnc = self._cache['ports'].get(key, {}).get('is_cnc')
+                    ports[key] = self._report_port(on_port, port, desc, vid_pid, is_cnc)
+
+            # All probes run at once, so they share one deadline; report each as it finishes
+            deadline_at = time.perf_counter() + self.deadline
+            for future in self._completed(probes, deadline_at):
+                probe = probes[future]
+                if probe[0] == 'port':
+                    _, key, port, desc, vid_pid = probe
+                    ports[key] = self._report_port(on_port, port, desc, vid_pid, future.result())
+                elif probe[0] == 'camera':
+                    if future.result():
+                        index = probe[1]
+                        name = camera_names.get(index) or self._cached_name(index) or f"Camera {index}"
+                        found_cameras[index] = name
+                        if on_camera:
+                            on_camera((index, name))
+                else:
+                    camera_names = future.result() or {}
+                    # Cameras reported before the names arrived get their real name
+                    for index, name in sorted(found_cameras.items()):
+                        if camera_names.get(index, name) != name:
+                            found_cameras[index] = camera_names[index]
+                            if on_camera:
+                                on_camera((index, camera_names[index]))
+        finally:
+            # Slow probes keep running; the pool's threads end with them
+            pool.shutdown(wait=False)
+
+        late = [future for future in probes if not future.done()]
+        for future in late:
+            probe = probes[future]
+            # Not answering in time is not the same as being gone: keep the cached entry
+            if probe[0] == 'port':
+                _, key, port, desc, vid_pid = probe
+                ports[key] = self._cache['ports'].get(key) or \
+                    {'port': port, 'description': desc, 'vid_pid': vid_pid, 'is_cnc': None}
+            elif probe[0] == 'camera' and self._cached_name(probe[1]):
+                found_cameras[probe[1]] = camera_names.get(probe[1]) or self._cached_name(probe[1])
+        cameras = {f"{index}|{name}": {'index': index, 'name': name} for index, name in found_cameras.items()}
+
+        with self._lock:
+            self._cache = {'ports': ports, 'cameras': cameras}
+            self._save_cache()
+        for future in late:
+            future.add_done_callback(lambda f, probe=probes[future]: self._late_result(f, probe, on_port, on_camera))
+        self.comm.log(f"Device discovery took {time.perf_counter() - started:.2f} s")
+        if on_done:
+            on_done(self.cached_ports(), self.cached_cameras())
+
+    def _late_result(self, future, probe, on_port, on_camera):
+        """Record a probe that finished after the deadline and report it."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            if probe[0] == 'port':
+                _, key, port, desc, vid_pid = probe
+                entry = self._report_port(on_port, port, desc, vid_pid, future.result())
+                self._cache['ports'][key] = entry
+            elif probe[0] == 'camera':
+                index = probe[1]
+                name = self._cached_name(index) or f"Camera {index}"
+                entry_key = f"{index}|{name}"
+                if future.result():
+                    self._cache['cameras'][entry_key] = {'index': index, 'name': name}
+                    if on_camera:
+                        on_camera((index, name))
+                else:
+                    self._cache['cameras'].pop(entry_key, None)
+            else:
+                for index, name in (future.result() or {}).items():
+                    old = next((k for k, e in self._cache['cameras'].items() if e['index'] == index), None)
+                    if old is not None and self._cache['cameras'][old]['name'] != name:
+                        del self._cache['cameras'][old]
+                        self._cache['cameras'][f"{index}|{name}"] = {'index': index, 'name': name}
+                        if on_camera:
+                            on_camera((index, name))
+            self._save_cache()
+
+    def _cached_name(self, index):
+        """Name of camera `index` in the cache, or None if it is not cached."""
+        for entry in self._cache['cameras'].values():
+            if entry['index'] == index:
+                return entry['name']
+        return None
+
+    def _completed(self, futures, deadline_at):
+        """Yield futures that finished successfully before deadline_at."""
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline_at - time.perf_counter())):
+                if future.exception() is None:
+                    yield future
+        except FuturesTimeout:
+            self.comm.log("Device probe deadline exceeded; slow devices are reported when they answer.")
+
+    @staticmethod
+    def _report_port(on_port, port, desc, vid_pid, is_cnc):
+        if on_port:
+            on_port((port, desc, vid_pid, is_cnc))
+        return {'port': port, 'description': desc, 'vid_pid': vid_pid, 'is_cnc': is_cnc}
\ No newline at end of file
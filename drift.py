@@ -0,0 +1,280 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from camera_stream import POLICY_LATEST
+
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.expanduser("~"), ".microstep", "calibration.json")
+
+# DriftMeasurement.status
+STATUS_FIRST = 'first'            # nothing to compare with yet
+STATUS_OK = 'ok'                  # error below tolerance
+STATUS_DRIFT = 'drift'            # error worth correcting
+STATUS_WEAK = 'weak'              # correlation peak too weak (featureless image)
+STATUS_REJECTED = 'rejected'      # error larger than max_correction: treated as a mismatch
+STATUS_NO_OVERLAP = 'no_overlap'  # frames do not overlap enough to compare
+STATUS_CORRECTED = 'corrected'    # drift, and a corrective move was sent
+
+DriftMeasurement = namedtuple('DriftMeasurement', 'status dx dy dx_px dy_px response elapsed')
+
+MIN_OVERLAP = 16  # rows or columns of the reduced images that must overlap
+
+
+def default_px_per_mm(mm_per_px):
+    """Calibration matrix for an uncalibrated camera: image x along +X, rows along -Y."""
+    return [[-1.0 / mm_per_px, 0.0], [0.0, 1.0 / mm_per_px]]
+
+
+def load_calibration(path=DEFAULT_CALIBRATION_PATH):
+    """The px_per_mm matrix saved by DriftCorrector.save_calibration()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['px_per_mm']
+
+
+class DriftCorrector:
+    """Measure stage drift from the camera image and correct it.
+
+    Every checked frame is compared with the frame before it (or with a
+    reference set by set_reference()): from the intended stage positions
+    of both frames the expected image shift is known, so only the
+    overlapping parts are cut out of reduced greyscale copies (at most
+    `size` px wide) and phase-correlated. The remaining shift is the
+    position error, converted to mm with the calibration matrix. Errors
+    are relative to the first frame checked (or the reference), which is
+    assumed to be where it was meant to be.
+
+    The calibration `px_per_mm` is a 2x2 matrix giving the image shift
+    (as cv2.phaseCorrelate reports it, in full-resolution pixels) for a
+    1 mm stage move in X (first column) and Y; calibrate() measures it.
+    Without one, `mm_per_px` is used with the usual orientation: image x
+    along stage +X and image rows along -Y, so that a +X move shifts the
+    content towards -x.
+
+    correct() moves the stage back onto the intended position and adds
+    the error to `offset`, the estimated physical-minus-commanded position.
+    Absolute moves should go to target(x, y) so that later moves land
+    where intended, e.g. after lost steps.
+    """
+
+    def __init__(self, controller, mm_per_px=None, px_per_mm=None, size=320, min_response=0.1,
+                 tolerance=0.005, max_correction=0.1, max_corrections=2, feed=600, move_timeout=30.0):
+        if px_per_mm is None:
+            if not mm_per_px:
+                raise ValueError("DriftCorrector needs mm_per_px or a px_per_mm calibration.")
+            px_per_mm = default_px_per_mm(mm_per_px)
+        self.controller = controller
+        self.px_per_mm = np.array(px_per_mm, dtype=np.float64)
+        self.size = size
+        self.min_response = min_response
+        self.tolerance = tolerance            # mm; smaller errors are left alone
+        self.max_correction = max_correction  # mm; larger "errors" are mis-registrations
+        self.max_corrections = max_corrections  # per position, for callers that re-check
+        self.feed = feed
+        self.move_timeout = move_timeout
+        self.offset = np.zeros(2)
+        self.corrections = 0
+        self.checks = 0
+        self.time_total = 0.0
+        self._previous = None   # (reduced image, physical x, y)
+        self._reference = None
+        self._windows = {}
+        self._gray = None
+        self._scale = 1.0
+
+    # --- Calibration ---
+
+    @classmethod
+    def from_calibration(cls, controller, path=DEFAULT_CALIBRATION_PATH, **kwargs):
+        return cls(controller, px_per_mm=load_calibration(path), **kwargs)
+
+    def save_calibration(self, path=DEFAULT_CALIBRATION_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'px_per_mm': self.px_per_mm.tolist(), 'time': time.time()}, f, indent=1)
+
+    def calibrate(self, camera, step=0.05, fraction=0.25, dwell=0.2):
+        """Measure px_per_mm with moves along X and Y around the current position.
+
+        A first move of `step` mm gives the rough scale; the matrix is then
+        measured again with moves of about `fraction` of the image width,
+        so that the pixel rounding of the shift hardly matters.
+        """
+        frames = camera.subscribe('drift-calibration', POLICY_LATEST)
+        try:
+            # Start from a commanded position: status reports are rounded
+            x, y, _ = self.controller.state.work_position
+            self._move_to(x, y)
+            base = self._capture(frames, dwell)
+            expected = np.zeros((2, 2))
+            for _ in range(2):
+                columns = []
+                for axis in (0, 1):
+                    # +step and -step: twice the baseline for the same overlap
+                    shifts = []
+                    for sign in (1, -1):
+                        dx, dy = (sign * step, 0.0) if axis == 0 else (0.0, sign * step)
+                        self._move_to(x + dx, y + dy)
+                        moved = self._capture(frames, dwell)
+                        shift, response = self._register(base, moved, sign * expected[:, axis] * step / self._scale)
+                        if shift is None or response < self.min_response:
+                            raise RuntimeError(f"Calibration image too featureless (response {response:.2f}).")
+                        shifts.append(shift)
+                    self._move_to(x, y)
+                    columns.append((shifts[0] - shifts[1]) * self._scale / (2 * step))
+                self.px_per_mm = expected = np.array(columns, dtype=np.float64).T
+                px_per_mm = max(np.abs(self.px_per_mm).max(), 1e-9)
+                step = fraction * base.shape[1] * self._scale / px_per_mm
+        finally:
+            frames.close()
+        self._previous = None
+        return self.px_per_mm
+
+    # --- Measurement ---
+
+    def set_reference(self, image, x, y):
+        """Compare later frames with this one (physical position x, y) instead of the previous frame."""
+        self._reference = (self._reduce(image).copy(), x, y)
+
+    def clear_reference(self):
+        self._reference = None
+
+    def reset(self):
+        """Forget the previous frame, e.g. before a new scan row or scan."""
+        self._previous = None
+
+    def target(self, x, y):
+        """Coordinates to command so that the stage physically arrives at (x, y)."""
+        return x - self.offset[0], y - self.offset[1]
+
+    def check(self, image, x, y):
+        """Measure how far the stage is from the intended position (x, y).
+
+        The frame is remembered at its measured physical position, so the
+        next check (for instance after correct() and a fresh frame at the
+        same tile) is measured against it.
+        """
+        started = time.perf_counter()
+        small = self._reduce(image)
+        compare = self._reference or self._previous
+        if compare is None:
+            measurement = DriftMeasurement(STATUS_FIRST, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        else:
+            measurement = self._measure(compare, small, x, y)
+        elapsed = time.perf_counter() - started
+        measurement = measurement._replace(elapsed=elapsed)
+        self.checks += 1
+        self.time_total += elapsed
+
+        if measurement.status in (STATUS_OK, STATUS_DRIFT):
+            self._previous = (small.copy(), x + measurement.dx, y + measurement.dy)
+        else:
+            self._previous = (small.copy(), x, y)
+        return measurement
+
+    def correct(self, measurement, x, y):
+        """Move back onto the intended position (x, y) after a STATUS_DRIFT measurement.
+
+        Returns the measurement marked corrected; other measurements are
+        returned unchanged without moving.
+        """
+        if measurement.status != STATUS_DRIFT:
+            return measurement
+        self.offset += (measurement.dx, measurement.dy)
+        self.corrections += 1
+        self._move_to(*self.target(x, y))
+        return measurement._replace(status=STATUS_CORRECTED)
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'corrections': self.corrections,
+            'offset_mm': self.offset.tolist(),
+            'avg_ms': 1000.0 * self.time_total / self.checks if self.checks else 0.0,
+        }
+
+    def _measure(self, compare, small, x, y):
+        ref, rx, ry = compare
+        # Expected shift from the reference to this frame, in reduced pixels
+        expected = self.px_per_mm @ (x - rx, y - ry) / self._scale
+        shift, response = self._register(ref, small, expected)
+        if shift is None:
+            return DriftMeasurement(STATUS_NO_OVERLAP, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        # Remaining shift beyond what the commanded move explains, in full-resolution pixels
+        ex, ey = (shift - expected) * self._scale
+        dx, dy = np.linalg.solve(self.px_per_mm, (ex, ey))
+        if response < self.min_response:
+            status = STATUS_WEAK
+        elif max(abs(dx), abs(dy)) > self.max_correction:
+            status = STATUS_REJECTED
+        elif max(abs(dx), abs(dy)) >= self.tolerance:
+            status = STATUS_DRIFT
+        else:
+            status = STATUS_OK
+        return DriftMeasurement(status, float(dx), float(dy), float(ex), float(ey), float(response), 0.0)
+
+    # --- Helpers ---
+
+    def _reduce(self, image):
+        """Greyscale float32 copy at most `size` px wide, in a reused buffer."""
+        h, w = image.shape[:2]
+        self._scale = max(1.0, w / self.size)
+        size = (max(1, int(round(w / self._scale))), max(1, int(round(h / self._scale))))
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if size != (w, h):
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if self._gray is None or self._gray.shape != image.shape:
+            self._gray = np.empty(image.shape, np.float32)
+        np.copyto(self._gray, image, casting='unsafe')
+        return self._gray
+
+    def _register(self, a, b, expected):
+        """Shift of b relative to a (reduced pixels), given roughly `expected`.
+
+        Only the parts that overlap after the expected shift are correlated,
+        so the result is the expected integer shift plus a small residual.
+        Returns (array [sx, sy], response), or (None, 0.0) without overlap.
+        """
+        kx, ky = int(round(expected[0])), int(round(expected[1]))
+        h, w = b.shape
+        if abs(kx) > w - MIN_OVERLAP or abs(ky) > h - MIN_OVERLAP:
+            return None, 0.0
+        a = a[max(0, -ky):h - max(0, ky), max(0, -kx):w - max(0, kx)]
+        b = b[max(0, ky):h - max(0, -ky), max(0, kx):w - max(0, -kx)]
+        # Without the mean the window itself would correlate, even between featureless frames
+        (sx, sy), response = cv2.phaseCorrelate(a - a.mean(), b - b.mean(), self._window(a.shape))
+        return np.array((kx + sx, ky + sy)), response
+
+    def _window(self, shape):
+        window = self._windows.get(shape)
+        if window is None:
+            window = self._windows[shape] = cv2.createHanningWindow(shape[::-1], cv2.CV_32F)
+        return window
+
+    def _move_to(self, x, y):
+        distance = self.controller.modal.get('distance') or "G90"
+        cmd = f"G90\nG1 X{x:.4f} Y{y:.4f} F{self.feed}\nG4 P0"
+        if distance != "G90":
+            cmd += f"\n{distance}"
+        reply = self.controller.submit(cmd, timeout=self.move_timeout).result()
+        if reply is None or reply.startswith('error'):
+            raise RuntimeError(f"Corrective move failed: {reply}")
+
+    def _capture(self, frames, dwell):
+        time.sleep(dwell)
+        after = time.perf_counter()
+        deadline = after + 2.0
+        while time.perf_counter() < deadline:
+            frame = frames.get(timeout=max(0.0, deadline - time.perf_counter()))
+            if frame is None:
+                break
+            with frame:
+                if frame.timestamp >= after:
+                    return self._reduce(frame.image).copy()
+        raise TimeoutError("No frame for calibration.")
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from camera_stream import POLICY_LATEST
+
+
+class FocusStacker:
+    """Streaming extended-depth-of-field merge of a Z-stack.
+
+    Each slice is merged as soon as it arrives: per pixel, the slice wins
+    where its local sharpness (smoothed absolute Laplacian) beats the best
+    seen so far. Only the running sharpness map, the composite, a depth
+    index map and a few scratch buffers are kept, so memory does not grow
+    with the number of slices.
+    """
+
+    def __init__(self, blur=5, track_depth=True):
+        self.blur = blur | 1  # Gaussian kernel size must be odd
+        self.track_depth = track_depth
+        self.reset()
+
+    def reset(self):
+        self.slices = 0
+        self.composite = None   # HxW(xC) like the input frames
+        self.best = None        # float32 best sharpness per pixel
+        self.depth = None       # uint16 index of the winning slice
+        self._gray = None
+        self._sharp = None
+        self._mask = None
+
+    def nbytes(self):
+        """Memory held by the stacker's arrays."""
+        arrays = (self.composite, self.best, self.depth, self._gray, self._sharp, self._mask)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def add(self, image, index=None):
+        """Merge one slice; `index` (default: running count) goes to the depth map."""
+        index = self.slices if index is None else index
+        if self.composite is None or self.composite.shape != image.shape:
+            self._allocate(image)
+        sharp = self._sharpness(image)
+        if self.slices == 0:
+            np.copyto(self.best, sharp)
+            np.copyto(self.composite, image)
+            if self.depth is not None:
+                self.depth.fill(index)
+        else:
+            mask = np.greater(sharp, self.best, out=self._mask)
+            np.copyto(self.best, sharp, where=mask)
+            np.copyto(self.composite, image, where=mask[..., None] if image.ndim == 3 else mask)
+            if self.depth is not None:
+                np.copyto(self.depth, index, where=mask, casting='unsafe')
+        self.slices += 1
+
+    def result(self):
+        """The all-in-focus composite (the stacker's own buffer, not a copy)."""
+        return self.composite
+
+    def _allocate(self, image):
+        h, w = image.shape[:2]
+        self.slices = 0
+        self.composite = np.empty_like(image)
+        self.best = np.empty((h, w), np.float32)
+        self.depth = np.empty((h, w), np.uint16) if self.track_depth else None
+        self._gray = np.empty((h, w), np.uint8)
+        self._sharp = np.empty((h, w), np.float32)
+        self._mask = np.empty((h, w), bool)
+
+    def _sharpness(self, image):
+        if image.ndim == 3:
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            gray = self._gray
+        else:
+            gray = image
+        cv2.Laplacian(gray, cv2.CV_32F, dst=self._sharp, ksize=3)
+        np.abs(self._sharp, out=self._sharp)
+        cv2.GaussianBlur(self._sharp, (self.blur, self.blur), 0, dst=self._sharp)
+        return self._sharp
+
+
+def acquire_stack(controller, camera, z_positions, stacker=None, feed=600, dwell=0.05,
+                  settle_detector=None, move_timeout=60.0, max_pending_merges=2):
+    """Step through z_positions and merge one frame per slice into `stacker`.
+
+    Merging a slice runs on a worker thread while the stage already moves
+    to the next Z. At most `max_pending_merges` slices wait for merging,
+    each holding a camera buffer; beyond that acquisition waits. Returns
+    the stacker.
+    """
+    stacker = stacker or FocusStacker()
+    frames = camera.subscribe('focus-stack', POLICY_LATEST)
+    merger = ThreadPoolExecutor(max_workers=1, thread_name_prefix="focus-stack")
+    pending_merges = threading.BoundedSemaphore(max_pending_merges)
+
+    def merge(frame, index):
+        try:
+            with frame:
+                stacker.add(frame.image, index)
+        finally:
+            pending_merges.release()
+
+    def move(z):
+        return controller.submit(f"G90\nG1 Z{z:.4f} F{feed:g}\nG4 P0", timeout=move_timeout)
+
+    try:
+        pending = move(z_positions[0]) if len(z_positions) else None
+        for i in range(len(z_positions)):
+            reply = pending.result()
+            if reply is None or reply.startswith('error'):
+                raise RuntimeError(f"Focus stack: move to Z{z_positions[i]} failed ({reply}).")
+            frame = None
+            if settle_detector is not None:
+                frame = settle_detector.wait_stable(after=time.perf_counter(), keep_frame=True).frame
+            elif dwell > 0:
+                time.sleep(dwell)
+            after = time.perf_counter()
+            while frame is None:
+                frame = frames.get(timeout=2.0)
+                if frame is None:
+                    raise RuntimeError("Focus stack: camera delivered no frame.")
+                if frame.timestamp < after:
+                    frame.release()
+                    frame = None
+            if i + 1 < len(z_positions):
+                pending = move(z_positions[i + 1])
+            pending_merges.acquire()
+            merger.submit(merge, frame, i)
+    finally:
+        merger.shutdown(wait=True)
+        frames.close()
+    return stacker
\ No newline at end of file
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+
+from camera_stream import POLICY_LATEST
+from metrics import METRICS
+
+BOUNDARY = "frame"
+DEFAULT_QUALITIES = (50, 80)
+REQUEST_TIMEOUT = 5.0
+
+EncodedFrame = namedtuple('EncodedFrame', 'seq timestamp header data')
+
+INDEX_PAGE = """<!doctype html>
+<html><head><title>Microstep</title></head>
+<body style="margin:0;background:#111">
+<img src="/stream.mjpg{query}" style="max-width:100%;display:block;margin:auto">
+</body></html>
+"""
+
+
+class StreamClient:
+    """One connected viewer, its limits and what it has been sent."""
+
+    def __init__(self, peer, quality, max_fps=None, max_kbps=None):
+        self.peer = peer
+        self.quality = quality
+        self.max_fps = max_fps
+        self.max_kbps = max_kbps
+        self.connected_at = time.time()
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+    def next_send_delay(self, size):
+        """Seconds to wait after sending `size` bytes to respect the caps."""
+        delay = 1.0 / self.max_fps if self.max_fps else 0.0
+        if self.max_kbps:
+            delay = max(delay, size * 8 / (self.max_kbps * 1000.0))
+        return delay
+
+    def stats(self):
+        elapsed = max(time.time() - self.connected_at, 1e-9)
+        return {
+            'peer': self.peer,
+            'quality': self.quality,
+            'max_fps': self.max_fps,
+            'max_kbps': self.max_kbps,
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+            'fps': self.frames_sent / elapsed,
+            'kbps': self.bytes_sent * 8 / 1000.0 / elapsed,
+        }
+
+
+class FrameServer:
+    """Serve the camera as MJPEG over HTTP to any number of viewers.
+
+    A single encoder thread takes the newest frame from a POLICY_LATEST
+    subscription and JPEG-encodes it once for every quality level that
+    currently has a viewer; all viewers of that level are sent the same
+    bytes. The HTTP side runs on an asyncio loop in its own thread. Each
+    viewer always gets the newest encoded frame once its socket has
+    drained, so a slow viewer skips frames instead of queueing them and
+    never holds more than `write_buffer` bytes in this process.
+
+    Routes: / (viewer page), /stream.mjpg, /snapshot.jpg, /stats (JSON).
+    Viewers may ask for ?quality=, ?fps= and ?kbps=; quality is rounded to
+    the nearest configured level, fps/kbps can only tighten the server caps.
+    """
+
+    def __init__(self, camera, host="127.0.0.1", port=8080, qualities=DEFAULT_QUALITIES,
+                 default_quality=None, max_fps=None, max_kbps=None, write_buffer=256 * 1024,
+                 stall_timeout=10.0):
+        self.camera = camera
+        self.host = host
+        self.port = port
+        self.qualities = tuple(sorted(set(qualities)))
+        self.default_quality = self._nearest_quality(default_quality or self.qualities[-1])
+        self.max_fps = max_fps
+        self.max_kbps = max_kbps
+        self.write_buffer = write_buffer
+        self.stall_timeout = stall_timeout  # drop a viewer whose socket has not drained for this long
+
+        self.running = False
+        self.error = None
+        self.clients = []
+        self.frames_encoded = {q: 0 for q in self.qualities}
+        self.bytes_encoded = {q: 0 for q in self.qualities}
+        self._demand = {q: 0 for q in self.qualities}
+        self._active = ()  # qualities with viewers; replaced whole, read by the encoder thread
+        self._latest = {}
+        self._seq = 0
+        self._frames = None
+        self._loop = None
+        self._server = None
+        self._new_frame = None
+        self._tasks = set()
+        self._ready = threading.Event()
+        self._loop_thread = None
+        self._encode_thread = None
+        self._encode_time = {q: METRICS.histogram('frame_server_encode_seconds', {'quality': q},
+                                                  help="Time to JPEG-encode one frame")
+                             for q in self.qualities}
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Bind the server and start encoding; returns the bound port or None."""
+        if self.running:
+            return self.port
+        self.running = True
+        self.error = None
+        self._ready.clear()
+        self._loop_thread = threading.Thread(target=self._run_loop, name="frame-server", daemon=True)
+        self._loop_thread.start()
+        self._ready.wait()
+        if self.error:
+            self.running = False
+            self._loop_thread.join()
+            return None
+        self._frames = self.camera.subscribe('frame-server', POLICY_LATEST)
+        self._encode_thread = threading.Thread(target=self._encode_loop, name="frame-encoder", daemon=True)
+        self._encode_thread.start()
+        METRICS.add_collector(('frame_server', id(self)), self._collect_metrics)
+        print(f"Frame server on http://{self.host}:{self.port}/")
+        return self.port
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        METRICS.remove_collector(('frame_server', id(self)))
+        if self._encode_thread:
+            self._encode_thread.join()
+            self._encode_thread = None
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._shutdown)
+        if self._loop_thread:
+            self._loop_thread.join()
+            self._loop_thread = None
+        print("Frame server stopped.")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def stats(self):
+        clients = list(self.clients)
+        return {
+            'clients': len(clients),
+            'frames_encoded': dict(self.frames_encoded),
+            'mean_frame_bytes': {q: self.bytes_encoded[q] / n for q, n in self.frames_encoded.items() if n},
+            'viewers': [c.stats() for c in clients],
+        }
+
+    # --- Encoding ---
+
+    def _nearest_quality(self, quality):
+        return min(self.qualities, key=lambda q: abs(q - quality))
+
+    def _encode_loop(self):
+        while self.running:
+            frame = self._frames.get(timeout=0.5)
+            if frame is None:
+                continue
+            encoded = {}
+            with frame:
+                for quality in self._active:
+                    started = time.perf_counter()
+                    ok, buf = cv2.imencode('.jpg', frame.image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    if METRICS.enabled:
+                        self._encode_time[quality].observe(time.perf_counter() - started)
+                    if ok:
+                        encoded[quality] = buf
+            if not encoded:
+                continue
+            self._seq += 1
+            published = {}
+            for quality, buf in encoded.items():
+                header = (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                          f"Content-Length: {buf.size}\r\n\r\n").encode('ascii')
+                published[quality] = EncodedFrame(self._seq, frame.timestamp, header, memoryview(buf))
+                self.frames_encoded[quality] += 1
+                self.bytes_encoded[quality] += buf.size
+            try:
+                self._loop.call_soon_threadsafe(self._publish, published)
+            except RuntimeError:  # loop already closed
+                break
+
+    def _publish(self, published):
+        # Runs on the event loop: swap in the new frames and wake every viewer
+        self._latest.update(published)
+        self._new_frame.set()
+        self._new_frame = asyncio.Event()
+
+    def _add_demand(self, quality, delta):
+        self._demand[quality] += delta
+        if not self._demand[quality]:
+            self._latest.pop(quality, None)  # stale by the time a viewer returns
+        self._active = tuple(q for q, n in self._demand.items() if n > 0)
+
+    # --- Event loop ---
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        try:
+            self._new_frame = asyncio.Event()
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self.error = f"Could not start frame server on {self.host}:{self.port}: {e}"
+            print(self.error)
+            self._loop = None
+            loop.close()
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+            self._loop = None
+
+    def _shutdown(self):
+        self._server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        self._new_frame.set()
+
+        async def finish():
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.ensure_future(finish())
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        writer.transport.set_write_buffer_limits(high=self.write_buffer)
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            method, target = request.split(b"\r\n", 1)[0].decode('latin-1').split(" ")[:2]
+            url = urlsplit(target)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if method != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+            elif url.path in ("/", "/index.html"):
+                query = f"?{url.query}" if url.query else ""
+                await self._respond(writer, "200 OK", "text/html", INDEX_PAGE.format(query=query).encode())
+            elif url.path == "/stream.mjpg":
+                await self._stream(writer, self._make_client(writer, params))
+            elif url.path == "/snapshot.jpg":
+                await self._snapshot(writer, self._make_client(writer, params))
+            elif url.path == "/stats":
+                await self._respond(writer, "200 OK", "application/json", json.dumps(self.stats()).encode())
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", b"Not found\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    def _make_client(self, writer, params):
+        quality = self._nearest_quality(float(params.get('quality', self.default_quality)))
+        max_fps = _tighter(self.max_fps, params.get('fps'))
+        max_kbps = _tighter(self.max_kbps, params.get('kbps'))
+        peer = writer.get_extra_info('peername')
+        return StreamClient(f"{peer[0]}:{peer[1]}" if peer else "?", quality, max_fps, max_kbps)
+
+    async def _respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+        await writer.drain()
+
+    async def _next_frame(self, client, after_seq):
+        """Wait for a frame at the client's quality newer than after_seq."""
+        while self.running:
+            frame = self._latest.get(client.quality)
+            if frame is not None and frame.seq > after_seq:
+                return frame
+            await self._new_frame.wait()
+        return None
+
+    async def _snapshot(self, writer, client):
+        self._add_demand(client.quality, 1)
+        try:
+            frame = await asyncio.wait_for(self._next_frame(client, self._seq), REQUEST_TIMEOUT)
+        finally:
+            self._add_demand(client.quality, -1)
+        if frame is None:
+            await self._respond(writer, "503 Service Unavailable", "text/plain", b"No frame\n")
+        else:
+            await self._respond(writer, "200 OK", "image/jpeg", bytes(frame.data))
+
+    async def _stream(self, writer, client):
+        loop = asyncio.get_running_loop()
+        writer.write(("HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nConnection: close\r\n"
+                      f"Content-Type: multipart/x-mixed-replace; boundary={BOUNDARY}\r\n\r\n").encode('ascii'))
+        self.clients.append(client)
+        self._add_demand(client.quality, 1)
+        last_seq = None
+        try:
+            while self.running:
+                frame = await self._next_frame(client, last_seq or 0)
+                if frame is None:
+                    break
+                if last_seq is not None:
+                    client.frames_skipped += frame.seq - last_seq - 1
+                sent_at = loop.time()
+                writer.write(frame.header)
+                writer.write(frame.data)
+                writer.write(b"\r\n")
+                # Blocks only while this client's socket is backed up; newer frames replace older ones meanwhile
+                await asyncio.wait_for(writer.drain(), self.stall_timeout)
+                last_seq = frame.seq
+                client.frames_sent += 1
+                client.bytes_sent += len(frame.header) + len(frame.data) + 2
+                wait = sent_at + client.next_send_delay(len(frame.data)) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            self._add_demand(client.quality, -1)
+            self.clients.remove(client)
+
+    def _collect_metrics(self):
+        yield 'frame_server_clients', None, len(self.clients)
+        for quality in self.qualities:
+            yield 'frame_server_frames_encoded_total', {'quality': quality}, self.frames_encoded[quality]
+        clients = list(self.clients)
+        yield 'frame_server_frames_sent_total', None, sum(c.frames_sent for c in clients)
+        yield 'frame_server_frames_skipped_total', None, sum(c.frames_skipped for c in clients)
+        yield 'frame_server_bytes_sent_total', None, sum(c.bytes_sent for c in clients)
+
+
+def _tighter(limit, requested):
+    """The smaller of a server limit and a client's requested limit (either may be None)."""
+    if requested is not None:
+        requested = float(requested)
+        if requested <= 0:
+            requested = None
+    if limit is None or requested is None:
+        return requested if limit is None else limit
+    return min(limit, requested)
@@ -0,0 +1,223 @@
+import math
+import os
+import re
+from collections import namedtuple
+
+# A preprocessed line: source line number, cleaned text, encoded bytes incl. newline
+GCodeLine = namedtuple('GCodeLine', 'number text data')
+
+GRBL_LINE_LENGTH = 80  # GRBL's LINE_BUFFER_SIZE, including the newline
+
+_WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_PAREN_COMMENT = re.compile(r'\([^)]*\)')
+_INTEGER_WORDS = frozenset('GMNTPL')
+
+
+class GCodeError(ValueError):
+    """A program line that cannot be sent (too long, malformed arc, ...)."""
+
+    def __init__(self, number, message):
+        super().__init__(f"Line {number}: {message}")
+        self.number = number
+
+
+def format_number(value, precision=4):
+    """Shortest decimal text for value at the given precision ('-0' -> '0')."""
+    text = f"{value:.{precision}f}".rstrip('0').rstrip('.')
+    return '0' if text in ('-0', '', '-') else text
+
+
+class GCodePreprocessor:
+    """Clean, normalise and optionally arc-expand G-code one line at a time.
+
+    - strips `;` and `( )` comments, whitespace and blank lines
+    - upper-cases words and rewrites numbers (`G01` -> `G1`, `X1.5000` -> `X1.5`)
+    - with `arc_segment` (mm), expands G2/G3 arcs in the XY plane into G1 chords
+    - checks every line against `max_line_length` and encodes it to bytes
+
+    Only the modal state needed for arc expansion (distance mode, motion
+    mode, position) is tracked.
+    """
+
+    def __init__(self, precision=4, arc_segment=None, max_line_length=GRBL_LINE_LENGTH):
+        self.precision = precision
+        self.arc_segment = arc_segment
+        self.max_line_length = max_line_length
+        self.absolute = True
+        self.motion = None
+        self.position = [0.0, 0.0, 0.0]
+
+    def process(self, number, raw):
+        """Return the GCodeLines produced by one source line (often one, maybe none)."""
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8', errors='ignore')
+        line = raw.split(';', 1)[0]
+        if '(' in line:
+            line = _PAREN_COMMENT.sub('', line)
+        line = line.strip().upper()
+        if not line:
+            return []
+        if line[0] in '$%' or line.startswith('[') or line.startswith('M117'):
+            # System commands and messages pass through untouched
+            return [self._make(number, line.replace(' ', '') if line[0] == '%' else line)]
+
+        words = _WORD.findall(line)
+        if not words:
+            return []
+        texts = self._expand(number, words)
+        return [self._make(number, text) for text in texts]
+
+    def _make(self, number, text):
+        data = (text + '\n').encode('ascii', errors='ignore')
+        if self.max_line_length and len(data) > self.max_line_length:
+            raise GCodeError(number, f"{len(data)} bytes exceed the controller limit of {self.max_line_length}")
+        return GCodeLine(number, text, data)
+
+    def _normalise(self, words):
+        parts = []
+        for letter, value in words:
+            number = float(value)
+            if letter in _INTEGER_WORDS and number == int(number):
+                parts.append(f"{letter}{int(number)}")
+            else:
+                parts.append(letter + format_number(number, self.precision))
+        return ''.join(parts)
+
+    def _expand(self, number, words):
+        values = {}
+        arc_motion = None
+        for letter, value in words:
+            if letter == 'G':
+                code = float(value)
+                if code in (90.0, 91.0):
+                    self.absolute = code == 90.0
+                elif code in (0.0, 1.0, 2.0, 3.0):
+                    self.motion = int(code)
+            elif letter in 'XYZIJRF':
+                values[letter] = float(value)
+
+        start = list(self.position)
+        target = list(start)
+        for i, axis in enumerate('XYZ'):
+            if axis in values:
+                target[i] = values[axis] if self.absolute else start[i] + values[axis]
+        moved = any(axis in values for axis in 'XYZ')
+        if moved:
+            self.position = target
+
+        if self.motion in (2, 3) and moved:
+            arc_motion = self.motion
+        if arc_motion is None or not self.arc_segment:
+            return [self._normalise(words)]
+        return self._arc_segments(number, arc_motion, start, target, values, words)
+
+    def _arc_segments(self, number, motion, start, end, values, words):
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        if 'R' in values:
+            r = values['R']
+            h = 4.0 * r * r - dx * dx - dy * dy
+            if h < 0 or (dx == 0 and dy == 0):
+                raise GCodeError(number, "arc radius does not reach the end point")
+            factor = -math.sqrt(h) / math.hypot(dx, dy)
+            if motion == 3:
+                factor = -factor
+            if r < 0:
+                factor = -factor
+            i_off, j_off = 0.5 * (dx - dy * factor), 0.5 * (dy + dx * factor)
+        else:
+            i_off, j_off = values.get('I', 0.0), values.get('J', 0.0)
+        cx, cy = start[0] + i_off, start[1] + j_off
+        radius = math.hypot(i_off, j_off)
+        if radius == 0:
+            raise GCodeError(number, "arc has zero radius")
+
+        a0 = math.atan2(start[1] - cy, start[0] - cx)
+        a1 = math.atan2(end[1] - cy, end[0] - cx)
+        sweep = a1 - a0
+        if motion == 2 and sweep >= 0:
+            sweep -= 2 * math.pi
+        elif motion == 3 and sweep <= 0:
+            sweep += 2 * math.pi
+        segments = max(1, int(math.ceil(abs(sweep) * radius / self.arc_segment)))
+
+        # Keep any other words of the line (e.g. a G90 or M code) on the first segment
+        prefix = self._normalise([(l, v) for l, v in words
+                                  if l not in 'XYZIJRF' and not (l == 'G' and float(v) in (2.0, 3.0))])
+        feed = f"F{format_number(values['F'], self.precision)}" if 'F' in values else ''
+        lines = []
+        p = self.precision
+        previous = start
+        for k in range(1, segments + 1):
+            if k == segments:
+                point = end  # land exactly on the programmed end point
+            else:
+                angle = a0 + sweep * k / segments
+                point = (cx + radius * math.cos(angle), cy + radius * math.sin(angle),
+                         start[2] + (end[2] - start[2]) * k / segments)
+            base = (0.0, 0.0, 0.0) if self.absolute else previous
+            coords = f"X{format_number(point[0] - base[0], p)}Y{format_number(point[1] - base[1], p)}"
+            if end[2] != start[2]:
+                coords += f"Z{format_number(point[2] - base[2], p)}"
+            previous = point
+            if k == 1:
+                lines.append(prefix + 'G1' + coords + feed)
+            else:
+                lines.append('G1' + coords)
+        # Motion mode stays G2/G3 here, so later coordinate-only lines of the
+        # arc are expanded too, even though the controller is now in G1
+        return lines
+
+
+class GCodeProgram:
+    """Lazily load and preprocess a G-code file, counting what was sent.
+
+    Iterating yields GCodeLines one by one, so files of any size never sit
+    in memory. Pass the program to CNCController.stream()/submit_program()
+    with `on_reply=program.on_reply` to also count acknowledgements.
+    """
+
+    def __init__(self, path, precision=4, arc_segment=None, max_line_length=GRBL_LINE_LENGTH,
+                 encoding='utf-8'):
+        self.path = path
+        self.precision = precision
+        self.arc_segment = arc_segment
+        self.max_line_length = max_line_length
+        self.encoding = encoding
+        self.total_bytes = os.path.getsize(path)
+        self.lines_read = 0     # source lines consumed
+        self.bytes_read = 0     # source bytes consumed
+        self.lines_sent = 0     # preprocessed lines handed to the sender
+        self.bytes_sent = 0     # encoded bytes handed to the sender
+        self.lines_acked = 0
+        self.errors = 0
+
+    def __iter__(self):
+        pre = GCodePreprocessor(self.precision, self.arc_segment, self.max_line_length)
+        with open(self.path, 'rb') as f:
+            for number, raw in enumerate(f, 1):
+                self.lines_read = number
+                self.bytes_read += len(raw)
+                for line in pre.process(number, raw.decode(self.encoding, errors='ignore')):
+                    self.lines_sent += 1
+                    self.bytes_sent += len(line.data)
+                    yield line
+
+    def on_reply(self, line, reply):
+        if reply is not None and reply.startswith('ok'):
+            self.lines_acked += 1
+        else:
+            self.errors += 1
+
+    def progress(self):
+        """Fraction of the source file consumed (0..1)."""
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+
+
+def load_gcode(source, precision=4, arc_segment=None, max_line_length=GRBL_LINE_LENGTH):
+    """Yield preprocessed GCodeLines from a path, open file or iterable of lines."""
+    if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+        yield from GCodeProgram(source, precision, arc_segment, max_line_length)
+        return
+    pre = GCodePreprocessor(precision, arc_segment, max_line_length)
+    for number, raw in enumerate(source, 1):
+        yield from pre.process(number, raw)
@@ -1,44 +1,58 @@
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout,
-    QComboBox, QGroupBox, QFormLayout, QLineEdit, QTextEdit,
+    QComboBox, QGroupBox, QFormLayout, QLineEdit,
     
     # QApplication,QMessageBox 
 
 )
-from PySide6.QtCore import QTimer, QThread, Signal
-from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtGui import QGuiApplication
 
+import os
+import time
 # import sys
-# import time
 
-import cv2
+from initialial_communication_base import InitialCommunication
+from device_discovery import DeviceDiscovery
+from cnc_control import CNCController, FIRMWARE_GRBL
+from jog import JogController
+from camera_stream import CameraStream
+from preview import PreviewRenderer
+from recorder import Recorder
+from frame_server import FrameServer
+from analysis import AnalysisPipeline, FocusStage, IntensityStage
+from console_log import ConsoleLog
+from session_log import SessionLog
+from metrics import METRICS
 
-#from archive.stream import CameraStream
 
-from initialial_communication_base import InitialCommunication
-from cnc_control import CNCController
+class CommandSignals(QObject):
+    """Deliver command results and controller messages to the GUI thread."""
+    reply = Signal(str, object)
+    state = Signal(object)
 
 
-class InitReaderThread(QThread):
-    new_line = Signal(str)
+STATUS_POLL_HZ = 20
+HOLD_TO_JOG_MS = 300
+JOG_FEED = 3000
+RECORDINGS_DIR = "recordings"
+SESSION_LOG_DIR = "logs"
+METRICS_OVERLAY_MS = 500
+FRAME_SERVER_HOST = "0.0.0.0"  # reachable from other workstations
+FRAME_SERVER_PORT = 8080
+ANALYSIS_EVERY = 3  # analyse every n-th captured frame
+
+
+class AnalysisSignals(QObject):
+    """Deliver analysis results from the pipeline's callback thread to the GUI thread."""
+    result = Signal(object)
 
-    def __init__(self, ser):
-        super().__init__()
-        self.ser = ser
-        self.running = True
-
-    def run(self):
-        while self.running and self.ser and self.ser.is_open:
-            if self.ser.in_waiting:
-                line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    self.new_line.emit(line)
-            else:
-                self.msleep(50)
 
-    def stop(self):
-        self.running = False
-        self.wait()
+class DiscoverySignals(QObject):
+    """Deliver device discovery results from worker threads to the GUI thread."""
+    port_found = Signal(object)
+    camera_found = Signal(object)
+    finished = Signal(object, object)
 
 
 class MicroscopeGUI(QWidget):
@@ -48,18 +62,53 @@ class MicroscopeGUI(QWidget):
         self.setGeometry(100, 100, 800, 750)
 
         self.comm = InitialCommunication(debug=False)
+        self.discovery = DeviceDiscovery(self.comm)
         self.cnc_controller = None
-        self.cap = None
-        self.reader_thread = None
-
+        self.jog = None
+        self.held_jog = None
+        self.camera = None
+        self.display_frames = None
+        self.renderer = PreviewRenderer()
+        self.recorder = None
+        self.frame_server = None
+        self.analysis = None
+        self.analysis_results = {}
+        self.session_log = SessionLog(os.path.join(SESSION_LOG_DIR, time.strftime("session_%Y%m%d_%H%M%S.jsonl")))
+        try:
+            self.session_log.start()
+        except OSError as e:
+            print(f"Session log disabled: {e}")
+            self.session_log = None
         self.available_cams = []
         self.available_ports = []
+        self.display_latency = METRICS.histogram('display_latency_seconds', help="Frame capture to preview pixmap")
+        self.render_time = METRICS.histogram('preview_render_seconds', help="Frame to scaled QPixmap conversion")
 
         self.init_ui()
 
+        self.analysis_signals = AnalysisSignals()
+        self.analysis_signals.result.connect(self.show_analysis_result)
+
+        self.command_signals = CommandSignals()
+        self.command_signals.reply.connect(self.show_command_reply)
+        self.command_signals.state.connect(self.show_machine_state)
+
+        self.discovery_signals = DiscoverySignals()
+        self.discovery_signals.port_found.connect(self.add_port)
+        self.discovery_signals.camera_found.connect(self.add_camera)
+        self.discovery_signals.finished.connect(self.discovery_finished)
+
+        # Display refresh only; capture runs at the camera's own rate in CameraStream
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
 
+        self.hold_timer = QTimer()
+        self.hold_timer.setSingleShot(True)
+        self.hold_timer.timeout.connect(self.start_hold_jog)
+
+        self.metrics_timer = QTimer()
+        self.metrics_timer.timeout.connect(self.refresh_metrics_overlay)
+
         self.populate_device_lists()
 
     def init_ui(self):
@@ -81,8 +130,17 @@ class MicroscopeGUI(QWidget):
         self.video_label.setFixedHeight(480)
         layout.addWidget(self.video_label)
 
-        self.response_box = QTextEdit()
-        self.response_box.setReadOnly(True)
+        self.analysis_label = QLabel()
+        self.analysis_label.hide()
+        layout.addWidget(self.analysis_label)
+
+        self.metrics_overlay = QLabel(self.video_label)
+        self.metrics_overlay.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 160); color: #8f8; font-family: monospace; padding: 4px;")
+        self.metrics_overlay.move(4, 4)
+        self.metrics_overlay.hide()
+
+        self.response_box = ConsoleLog(session_log=self.session_log)
         self.response_box.setFixedHeight(80)
         layout.addWidget(self.response_box)
 
@@ -94,13 +152,44 @@ class MicroscopeGUI(QWidget):
         self.cnc_button.clicked.connect(self.send_cnc_command)
         self.cnc_button.setEnabled(False)
 
+        self.hold_button = QPushButton("Feed Hold")
+        self.hold_button.clicked.connect(self.feed_hold)
+        self.hold_button.setEnabled(False)
+
         self.stop_button = QPushButton("Stop Camera")
         self.stop_button.clicked.connect(self.stop_camera)
         self.stop_button.setEnabled(False)
 
+        self.record_button = QPushButton("Record")
+        self.record_button.setCheckable(True)
+        self.record_button.toggled.connect(self.toggle_recording)
+        self.record_button.setEnabled(False)
+
         button_layout.addWidget(self.connect_button)
         button_layout.addWidget(self.cnc_button)
+        button_layout.addWidget(self.hold_button)
         button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.record_button)
+
+        self.share_button = QPushButton("Share")
+        self.share_button.setCheckable(True)
+        self.share_button.toggled.connect(self.toggle_sharing)
+        self.share_button.setEnabled(False)
+        button_layout.addWidget(self.share_button)
+
+        self.analyze_button = QPushButton("Analyze")
+        self.analyze_button.setCheckable(True)
+        self.analyze_button.toggled.connect(self.toggle_analysis)
+        self.analyze_button.setEnabled(False)
+        button_layout.addWidget(self.analyze_button)
+
+        self.metrics_button = QPushButton("Stats")
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.toggled.connect(self.toggle_metrics)
+        self.save_metrics_button = QPushButton("Save Stats")
+        self.save_metrics_button.clicked.connect(self.save_metrics)
+        button_layout.addWidget(self.metrics_button)
+        button_layout.addWidget(self.save_metrics_button)
 
         layout.addLayout(button_layout)
 
@@ -114,6 +203,9 @@ class MicroscopeGUI(QWidget):
         step_layout.addWidget(self.step_input)
         cnc_move_layout.addLayout(step_layout)
 
+        self.position_label = QLabel("Position: unknown")
+        cnc_move_layout.addWidget(self.position_label)
+
         xyz_button_layout = QHBoxLayout()
 
         x_layout = QVBoxLayout()
@@ -141,57 +233,117 @@ class MicroscopeGUI(QWidget):
         cnc_move_group.setLayout(cnc_move_layout)
         layout.addWidget(cnc_move_group)
 
-        self.btn_x_pos.clicked.connect(lambda: self.move_axis('X', 1))
-        self.btn_x_neg.clicked.connect(lambda: self.move_axis('X', -1))
-        self.btn_y_pos.clicked.connect(lambda: self.move_axis('Y', 1))
-        self.btn_y_neg.clicked.connect(lambda: self.move_axis('Y', -1))
-        self.btn_z_pos.clicked.connect(lambda: self.move_axis('Z', 1))
-        self.btn_z_neg.clicked.connect(lambda: self.move_axis('Z', -1))
+        # Click = one (coalesced) step, press and hold = continuous jog
+        self.btn_x_pos.pressed.connect(lambda: self.jog_pressed('X', 1))
+        self.btn_x_neg.pressed.connect(lambda: self.jog_pressed('X', -1))
+        self.btn_y_pos.pressed.connect(lambda: self.jog_pressed('Y', 1))
+        self.btn_y_neg.pressed.connect(lambda: self.jog_pressed('Y', -1))
+        self.btn_z_pos.pressed.connect(lambda: self.jog_pressed('Z', 1))
+        self.btn_z_neg.pressed.connect(lambda: self.jog_pressed('Z', -1))
+        for button in (self.btn_x_pos, self.btn_x_neg, self.btn_y_pos,
+                       self.btn_y_neg, self.btn_z_pos, self.btn_z_neg):
+            button.released.connect(self.jog_released)
 
         self.setLayout(layout)
 
     def populate_device_lists(self):
-        serial_ports_info = self.comm.get_serial_port_info()
-        self.available_ports = [info[0] for info in serial_ports_info]
+        """Show the cached inventory at once and revalidate it in the background."""
+        self.set_port_list(self.discovery.cached_ports())
+        self.set_camera_list(self.discovery.cached_cameras())
+        self.discovery.start(
+            on_port=self.discovery_signals.port_found.emit,
+            on_camera=self.discovery_signals.camera_found.emit,
+            on_done=self.discovery_signals.finished.emit)
+
+    def set_port_list(self, ports):
+        current = self.current_port()
+        self.available_ports = []
         self.port_dropdown.clear()
-        for port, desc, vidpid in serial_ports_info:
-            self.port_dropdown.addItem(f"{port} - {desc} (VID:PID={vidpid})")
+        for info in ports:
+            self.add_port(info)
+        if current in self.available_ports:
+            self.port_dropdown.setCurrentIndex(self.available_ports.index(current))
 
-        cam_infos = self.comm.find_cameras()
-        self.available_cams = [i for i, _ in cam_infos]
+    def set_camera_list(self, cameras):
+        current = self.current_camera()
+        self.available_cams = []
         self.cam_dropdown.clear()
-        for i, name in cam_infos:
+        for info in cameras:
+            self.add_camera(info)
+        if current in self.available_cams:
+            self.cam_dropdown.setCurrentIndex(self.available_cams.index(current))
+
+    def add_port(self, info):
+        port, desc, vidpid, is_cnc = info
+        text = f"{port} - {desc} (VID:PID={vidpid})" + (" [CNC]" if is_cnc else "")
+        if port in self.available_ports:
+            self.port_dropdown.setItemText(self.available_ports.index(port), text)
+        else:
+            self.available_ports.append(port)
+            self.port_dropdown.addItem(text)
+
+    def add_camera(self, info):
+        i, name = info
+        if i in self.available_cams:
+            self.cam_dropdown.setItemText(self.available_cams.index(i), f"{i}: {name}")
+        else:
+            self.available_cams.append(i)
             self.cam_dropdown.addItem(f"{i}: {name}")
 
+    def discovery_finished(self, ports, cameras):
+        # Drop cached entries that are gone; slow ones stay and are reported when they answer
+        self.set_port_list(ports)
+        self.set_camera_list(cameras)
+
+    def current_port(self):
+        index = self.port_dropdown.currentIndex()
+        return self.available_ports[index] if 0 <= index < len(self.available_ports) else None
+
+    def current_camera(self):
+        index = self.cam_dropdown.currentIndex()
+        return self.available_cams[index] if 0 <= index < len(self.available_cams) else None
+
     def handle_device_selection(self):
         self.stop_camera()
-        if self.cnc_controller:
-            self.cnc_controller.disconnect()
-            self.cnc_controller = None
+        self.close_cnc()
         self.cnc_button.setEnabled(False)
+        self.hold_button.setEnabled(False)
 
         cam_index = self.cam_dropdown.currentIndex()
         if cam_index >= 0 and cam_index < len(self.available_cams):
-            self.cap = cv2.VideoCapture(self.available_cams[cam_index])
-            if not self.cap.isOpened():
-                self.response_box.append("Could not open selected camera.")
+            self.camera = CameraStream(self.available_cams[cam_index])
+            if not self.camera.start():
+                self.response_box.append(f"Could not open selected camera. {self.camera.error}")
+                self.camera = None
                 return
-            self.timer.start(30)
+            self.display_frames = self.camera.subscribe('display')
+            self.timer.start(self.display_interval_ms())
             self.stop_button.setEnabled(True)
+            self.record_button.setEnabled(True)
+            self.share_button.setEnabled(True)
+            self.analyze_button.setEnabled(True)
         else:
-            self.cap = None
+            self.camera = None
 
         port_index = self.port_dropdown.currentIndex()
         if port_index >= 0 and port_index < len(self.available_ports):
             port = self.available_ports[port_index]
             self.cnc_controller = CNCController(port)
+            # Subscribe before connecting so the startup banner is not missed
+            self.cnc_controller.reader.subscribe('message', self.response_box.append_message)
+            if self.session_log:
+                self.session_log.attach(self.cnc_controller)
+            self.cnc_controller.state.subscribe(lambda state: self.command_signals.state.emit(state.snapshot()))
             self.cnc_controller.connect()
             if self.cnc_controller.ser and self.cnc_controller.ser.is_open:
-                self.reader_thread = InitReaderThread(self.cnc_controller.ser)
-                self.reader_thread.new_line.connect(self.response_box.append)
-                self.reader_thread.start()
                 self.response_box.append(f"CNC connected on {port}. Awaiting initialization response from device...")
                 self.cnc_button.setEnabled(True)
+                self.hold_button.setEnabled(True)
+                self.cnc_controller.start_status_polling(STATUS_POLL_HZ)
+                # $J= jogging is GRBL only; Marlin and silent boards get G91/G1 moves
+                self.jog = JogController(self.cnc_controller, feed=JOG_FEED,
+                                         grbl_jog=self.cnc_controller.firmware == FIRMWARE_GRBL,
+                                         on_reply=self.command_signals.reply.emit)
             else:
                 self.response_box.append(f"Port {port} could not be opened.")
                 self.cnc_controller = None
@@ -209,43 +361,201 @@ class MicroscopeGUI(QWidget):
             self.response_box.append("Step size must be a valid number.")
             return
 
-        distance = step_size * direction
-        self.cnc_controller.send_command("G91")
-        cmd = f"G1 {axis}{distance:.3f} F3000"
-        response = self.cnc_controller.send_command(cmd)
-        self.cnc_controller.send_command("G90")
-        self.response_box.append(f"Move {axis}  {distance}mm   Status: {response or 'No response.'}")
+        self.jog.step(axis, step_size * direction)
+
+    def jog_pressed(self, axis, direction):
+        self.held_jog = (axis, direction)
+        self.hold_timer.start(HOLD_TO_JOG_MS)
+
+    def start_hold_jog(self):
+        if self.held_jog and self.jog:
+            self.jog.start_continuous(*self.held_jog)
+
+    def jog_released(self):
+        held, self.held_jog = self.held_jog, None
+        if self.hold_timer.isActive():
+            self.hold_timer.stop()
+            if held:
+                self.move_axis(*held)
+        elif self.jog:
+            self.jog.stop_continuous()
+
+    def submit_command(self, cmd, label):
+        """Queue a command on the CNC worker and report its reply when done."""
+        future = self.cnc_controller.submit(cmd)
+        future.add_done_callback(lambda f: self.command_signals.reply.emit(label, self._future_reply(f)))
+
+    @staticmethod
+    def _future_reply(future):
+        if future.cancelled():
+            return "Cancelled."
+        if future.exception() is not None:
+            return f"Error: {future.exception()}"
+        return future.result()
+
+    def show_command_reply(self, label, response):
+        self.response_box.append(f"{label} {response or 'No response.'}")
+
+    def show_machine_state(self, state):
+        x, y, z = state['work_position']
+        text = f"{state['state']}   X: {x:.3f}  Y: {y:.3f}  Z: {z:.3f}   F: {state['feed']:.0f}"
+        if state['alarm']:
+            text += f"   ALARM {state['alarm']}"
+        self.position_label.setText(text)
+
+    def feed_hold(self):
+        if self.cnc_controller:
+            self.cnc_controller.feed_hold()
+            self.response_box.append("Feed hold sent.")
 
     def update_frame(self):
-        if self.cap is not None and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = rgb_image.shape
-                bytes_per_line = ch * w
-                qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-                pixmap = QPixmap.fromImage(qt_image)
-                self.video_label.setPixmap(pixmap)
+        if self.display_frames is None:
+            return
+        # Latest-frame-wins: frames superseded before this refresh are skipped
+        frame = self.display_frames.get(timeout=0)
+        if frame is None:
+            return
+        size = self.video_label.contentsRect().size()
+        timed = METRICS.enabled
+        if timed:
+            t0 = time.perf_counter()
+        pixmap = self.renderer.render(frame, size.width(), size.height(), self.video_label.devicePixelRatioF())
+        self.video_label.setPixmap(pixmap)
+        if timed:
+            now = time.perf_counter()
+            self.render_time.observe(now - t0)
+            self.display_latency.observe(now - frame.timestamp)
+
+    def display_interval_ms(self):
+        """Refresh the preview once per screen refresh (vsync) interval."""
+        screen = self.screen() or QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen else 60.0
+        return max(1, int(1000 / (rate or 60.0)))
+
+    def toggle_recording(self, enabled):
+        if enabled and self.camera and not self.recorder:
+            path = os.path.join(RECORDINGS_DIR, time.strftime("%Y%m%d_%H%M%S"))
+            self.recorder = Recorder(self.camera, path, controller=self.cnc_controller)
+            self.recorder.start()
+            self.response_box.append(f"Recording to {path}")
+        elif not enabled and self.recorder:
+            self.recorder.stop()
+            stats = self.recorder.stats()
+            self.response_box.append(
+                f"Recording stopped: {stats['frames_written']} frames, {stats['frames_dropped']} dropped, "
+                f"{stats['mb_per_s']:.1f} MB/s")
+            self.recorder = None
+
+    def toggle_sharing(self, enabled):
+        if enabled and self.camera and not self.frame_server:
+            self.frame_server = FrameServer(self.camera, FRAME_SERVER_HOST, FRAME_SERVER_PORT)
+            if self.frame_server.start() is None:
+                self.response_box.append(self.frame_server.error)
+                self.frame_server = None
+                self.share_button.setChecked(False)
+                return
+            self.response_box.append(f"Sharing camera at http://<this-host>:{self.frame_server.port}/")
+        elif not enabled and self.frame_server:
+            self.frame_server.stop()
+            self.frame_server = None
+            self.response_box.append("Camera sharing stopped.")
+
+    def toggle_analysis(self, enabled):
+        if enabled and self.camera and not self.analysis:
+            self.analysis = AnalysisPipeline(
+                self.camera, [FocusStage(), IntensityStage()], controller=self.cnc_controller,
+                every=ANALYSIS_EVERY, on_result=self.analysis_signals.result.emit)
+            if not self.analysis.start():
+                self.response_box.append(f"Could not start analysis: {self.analysis.error}")
+                self.analysis = None
+                self.analyze_button.setChecked(False)
+                return
+            self.analysis_results.clear()
+            self.analysis_label.setText("Analysis starting...")
+            self.analysis_label.show()
+        elif not enabled and self.analysis:
+            self.analysis.stop()
+            self.analysis = None
+            self.analysis_label.hide()
+
+    def show_analysis_result(self, result):
+        if self.analysis is None:
+            return
+        self.analysis_results[result.stage] = result
+        parts = []
+        for stage, r in self.analysis_results.items():
+            if r.error:
+                parts.append(f"{stage}: {r.error}")
+            elif isinstance(r.value, dict):
+                parts.append(f"{stage}: " + ", ".join(f"{k} {v:.1f}" for k, v in r.value.items()
+                                                      if isinstance(v, (int, float))))
+            else:
+                parts.append(f"{stage}: {r.value:.1f}")
+        position = ""
+        if result.position:
+            position = "  @ X {:.3f} Y {:.3f} Z {:.3f}".format(*result.position)
+        self.analysis_label.setText(f"Frame {result.frame_id}{position}   " + "   ".join(parts))
+
+    def toggle_metrics(self, enabled):
+        METRICS.enable(enabled)
+        self.metrics_overlay.setVisible(enabled)
+        if enabled:
+            self.refresh_metrics_overlay()
+            self.metrics_timer.start(METRICS_OVERLAY_MS)
+        else:
+            self.metrics_timer.stop()
+
+    def refresh_metrics_overlay(self):
+        self.metrics_overlay.setText("\n".join(METRICS.overlay_lines()) or "No measurements yet.")
+        self.metrics_overlay.adjustSize()
+
+    def save_metrics(self):
+        base = os.path.join(RECORDINGS_DIR, time.strftime("metrics_%Y%m%d_%H%M%S"))
+        try:
+            METRICS.write(base + ".json")
+            METRICS.write(base + ".prom")
+            self.response_box.append(f"Stats written to {base}.json and {base}.prom")
+        except OSError as e:
+            self.response_box.append(f"Could not write stats: {e}")
 
     def stop_camera(self):
-        if self.cap:
-            self.cap.release()
-            self.cap = None
+        if self.record_button.isChecked():
+            self.record_button.setChecked(False)
+        self.record_button.setEnabled(False)
+        if self.share_button.isChecked():
+            self.share_button.setChecked(False)
+        self.share_button.setEnabled(False)
+        if self.analyze_button.isChecked():
+            self.analyze_button.setChecked(False)
+        self.analyze_button.setEnabled(False)
         self.timer.stop()
+        if self.camera:
+            self.camera.stop()
+            self.camera = None
+        self.display_frames = None
+        self.renderer.clear()
         self.video_label.clear()
         self.stop_button.setEnabled(False)
 
     def send_cnc_command(self):
         if self.cnc_controller:
-            response = self.cnc_controller.send_command("G28")
-            self.response_box.append(f"CNC Response: {response or 'No response.'}")
+            self.submit_command("G28", "CNC Response:")
         else:
             self.response_box.append("No CNC controller connected.")
 
-    def closeEvent(self, event):
-        self.stop_camera()
-        if self.reader_thread:
-            self.reader_thread.stop()
+    def close_cnc(self):
+        if self.jog:
+            self.jog.close()
+            self.jog = None
         if self.cnc_controller:
             self.cnc_controller.disconnect()
+            if self.session_log:
+                self.session_log.detach(self.cnc_controller)
+            self.cnc_controller = None
+
+    def closeEvent(self, event):
+        self.stop_camera()
+        self.close_cnc()
+        if self.session_log:
+            self.session_log.close()
         event.accept()
\ No newline at end of file
@@ -1,10 +1,10 @@
 import serial
 import serial.tools.list_ports
-import cv2
 import subprocess
 import re
 import platform
 import os
+import time
 
 class InitialCommunication:
     def __init__(self,
@@ -40,9 +40,12 @@ class InitialCommunication:
             with serial.Serial(port, self.cnc_baudrate, timeout=self.cnc_timeout) as ser:
                 for cmd in self.cnc_cmds:
                     ser.write((cmd + '\n').encode('utf-8'))
-                    response = ser.readline().decode('utf-8').strip().lower()
-                    if response and "ok" in response:
-                        return True
+                    # Boards reset on open and print a banner first, so read until the timeout
+                    deadline = time.monotonic() + self.cnc_timeout
+                    while time.monotonic() < deadline:
+                        response = ser.readline().decode('utf-8', errors='ignore').strip().lower()
+                        if "ok" in response or response.startswith(("grbl", "start")):
+                            return True
         except Exception as e:
             self.log(f"CNC detection error on {port}: {e}")
         return False
@@ -72,15 +75,23 @@ class InitialCommunication:
             self.log(f"Camera listing error: {e}")
             return {}
 
+    def probe_camera(self, index):
+        """Return True if the camera at index opens and delivers a frame."""
+        import cv2  # only needed for camera discovery; keeps headless startup fast
+        cap = cv2.VideoCapture(index)
+        try:
+            if cap.isOpened():
+                ret, _ = cap.read()
+                return bool(ret)
+            return False
+        finally:
+            cap.release()
+
     def find_cameras(self):
         camera_names = self.get_camera_names_windows()
         available_cams = []
         for i in range(self.max_cam_index):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                ret, _ = cap.read()
-                if ret:
-                    name = camera_names.get(i, f"Camera {i}")
-                    available_cams.append((i, name))
-                cap.release()
+            if self.probe_camera(i):
+                name = camera_names.get(i, f"Camera {i}")
+                available_cams.append((i, name))
         return available_cams
\ No newline at end of file
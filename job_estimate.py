@@ -0,0 +1,255 @@
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from gcode_loader import GCodeProgram
+
+JobEstimate = namedtuple('JobEstimate', 'duration moves distance dwell bounds travel')
+
+_NON_MOTION_G = (4.0, 10.0, 28.0, 30.0, 92.0)  # coordinates on these lines are not a move
+
+
+def _floats(values):
+    return tuple(float(v) for v in values)
+
+
+_COMMENT = re.compile(rb';[^\n]*|\([^)\n]*\)')
+_BAD_LINE = re.compile(rb'^.*[^A-Z0-9.+\-\n].*$', re.MULTILINE)
+_WORD_CHARS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.+-\n'
+# Letters and newlines become number separators
+_SEPARATORS = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ\n', b' ' * 27)
+
+
+def _tokenize(data):
+    """Split G-code bytes into word letters, values and line numbers (all numpy).
+
+    Cleaning uses C-level bytes operations (comments, whitespace and lines
+    with other characters such as `$` commands are removed), then every
+    letter and newline becomes a separator and all numbers are converted
+    in one np.fromstring call; no Python code runs per line.
+    """
+    data = data.upper()
+    if b';' in data or b'(' in data:
+        data = _COMMENT.sub(b'', data)
+    data = data.translate(None, b' \t\r') + b'\n'
+    if data.translate(None, _WORD_CHARS):
+        data = _BAD_LINE.sub(b'', data)
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newline = np.flatnonzero(buf == 10)
+    at = np.flatnonzero((buf >= 65) & (buf <= 90))
+    line = np.searchsorted(newline, at)
+    if not len(at):
+        return buf[:0], np.empty(0), line, len(newline)
+    following = buf[at + 1]  # data ends in '\n', so at + 1 is always valid
+    empty = (following >= 65) | (following == 10)  # a letter without a number
+    text = data.translate(_SEPARATORS)
+    if empty.any():
+        text = np.insert(np.frombuffer(text, dtype=np.uint8), at[empty] + 1, np.uint8(48)).tobytes()
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if len(values) != len(at):
+        raise ValueError("Malformed number in G-code program.")
+    keep = ~empty
+    return buf[at][keep], values[keep], line[keep], len(newline)
+
+
+def _forward_fill(values, initial):
+    """Replace NaNs by the last preceding value (or `initial`)."""
+    values = np.concatenate(([initial], values))
+    index = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    return values[index][1:]
+
+
+class JobEstimator:
+    """Estimate how long a program or scan takes, without a machine.
+
+    The whole program is parsed into per-line numpy arrays (modal words are
+    forward-filled, G91 positions built with a cumulative sum) and every
+    move's time is computed at once from a trapezoidal velocity profile:
+    accelerate at `accel` (mm/s^2) to the programmed feed, cruise,
+    decelerate. Junction speeds between moves follow GRBL's junction
+    deviation model, limited to what the neighbouring moves can reach;
+    the planner's full forward/backward pass is not replayed, so long
+    chains of very short segments are estimated slightly pessimistically.
+
+    Arcs are timed along their true length; bounds and per-axis travel
+    use their end points.
+    """
+
+    def __init__(self, accel=500.0, rapid_rate=3000.0, default_feed=1000.0, junction_deviation=0.01):
+        self.accel = float(accel)
+        self.rapid_rate = float(rapid_rate)        # mm/min for G0
+        self.default_feed = float(default_feed)    # mm/min until the first F word
+        self.junction_deviation = float(junction_deviation)
+
+    def estimate_program(self, source, start=(0.0, 0.0, 0.0)):
+        """Estimate a G-code program: path, multi-line string, GCodeProgram or lines."""
+        if isinstance(source, GCodeProgram):
+            source = source.path
+        if isinstance(source, os.PathLike) or (isinstance(source, str) and '\n' not in source
+                                               and os.path.isfile(source)):
+            with open(source, 'rb') as f:
+                data = f.read()
+        elif isinstance(source, str):
+            data = source.encode('utf-8', errors='ignore')
+        elif isinstance(source, bytes):
+            data = source
+        else:
+            data = b'\n'.join(line if isinstance(line, bytes) else line.rstrip('\n').encode('utf-8', 'ignore')
+                               for line in source)
+        return self._estimate_bytes(data, start)
+
+    def estimate_path(self, points, feed=3000.0, dwell=0.0, start=None, stop_at_points=True):
+        """Estimate visiting `points` (N x 2 or N x 3, mm) in order with G1 moves.
+
+        With `stop_at_points` every point is a full stop (as a scan's
+        `G4 P0` synchronisation enforces); `dwell` seconds are added per point.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+        points = np.pad(points, ((0, 0), (0, 3 - points.shape[1])))
+        if start is None:
+            start = points[0] if len(points) else np.zeros(3)
+        start = np.pad(np.asarray(start, dtype=np.float64), (0, 3 - len(start)))
+        path = np.vstack((start, points))
+        delta = np.diff(path, axis=0)
+        feeds = np.full(len(delta), feed / 60.0)
+        stops = np.ones(len(delta) + 1, dtype=bool) if stop_at_points else None
+        duration, moves, distance = self._motion_time(delta, np.linalg.norm(delta, axis=1), feeds, stops)
+        dwell_total = dwell * len(points)
+        return JobEstimate(duration + dwell_total, moves, distance, dwell_total,
+                           (_floats(path.min(axis=0)), _floats(path.max(axis=0))),
+                           _floats(np.abs(delta).sum(axis=0)))
+
+    def estimate_scan(self, plan, feed=3000.0, dwell=0.2, start=None):
+        """Estimate a tile_scan.ScanPlan acquired with TileScanner(feed, dwell)."""
+        tiles = plan.tiles()
+        return self.estimate_path([(t.x, t.y) for t in tiles], feed=feed, dwell=dwell, start=start)
+
+    def _estimate_bytes(self, data, start):
+        start = np.pad(np.asarray(start, dtype=np.float64), (0, 3 - len(start)))
+        letters, values, line, n = _tokenize(data)
+        if not len(letters):
+            return JobEstimate(0.0, 0, 0.0, 0.0, (_floats(start), _floats(start)), (0.0, 0.0, 0.0))
+
+        words = {}
+
+        def column(letter, allowed=None):
+            if letter not in words:
+                sel = letters == ord(letter)
+                words[letter] = values[sel], line[sel]
+            v, at = words[letter]
+            if allowed is not None:
+                sel = np.isin(v, allowed)
+                v, at = v[sel], at[sel]
+            col = np.full(n, np.nan)
+            col[at] = v
+            return col
+
+        motion = _forward_fill(column('G', (0.0, 1.0, 2.0, 3.0)), 0.0)
+        relative = _forward_fill(column('G', (90.0, 91.0)), 90.0) == 91.0
+        scale = np.where(_forward_fill(column('G', (20.0, 21.0)), 21.0) == 20.0, 25.4, 1.0)
+        special = ~np.isnan(column('G', _NON_MOTION_G))
+        dwell_line = ~np.isnan(column('G', (4.0,)))
+        dwell = float(np.nansum(column('P')[dwell_line]))
+        feed = _forward_fill(column('F') * scale, self.default_feed) / 60.0
+
+        # Absolute targets: last absolute value plus relative deltas since then
+        pos = np.empty((n + 1, 3))
+        present = np.zeros(n, dtype=bool)
+        for k, axis in enumerate('XYZ'):
+            v = column(axis) * scale
+            v[special] = np.nan
+            has = ~np.isnan(v)
+            present |= has
+            absolute = has & ~relative
+            cum = np.concatenate(([0.0], np.cumsum(np.where(has & relative, v, 0.0))))
+            base = np.concatenate(([start[k]], np.where(absolute, v, 0.0)))
+            last = np.concatenate(([0], np.where(absolute, np.arange(1, n + 1), 0)))
+            np.maximum.accumulate(last, out=last)
+            pos[:, k] = base[last] + cum - cum[last]
+
+        move = np.flatnonzero(present)
+        delta = pos[move + 1] - pos[move]
+        length = np.linalg.norm(delta, axis=1)
+        feeds = np.where(motion[move] == 0.0, self.rapid_rate / 60.0, feed[move])
+
+        arc = np.flatnonzero(motion[move] >= 2.0)
+        if len(arc):
+            length[arc] = self._arc_length(arc, move, delta, motion, scale, column)
+
+        # Stops: program ends and dwells between consecutive moves
+        dwells_before = np.cumsum(dwell_line)
+        stops = np.zeros(len(move) + 1, dtype=bool)
+        stops[0] = stops[-1] = True
+        if len(move) > 1:
+            stops[1:-1] = dwells_before[move[1:]] != dwells_before[move[:-1]]
+        duration, moves, distance = self._motion_time(delta, length, feeds, stops)
+
+        visited = pos[np.concatenate(([0], move + 1))]
+        return JobEstimate(duration + dwell, moves, distance, dwell,
+                           (_floats(visited.min(axis=0)), _floats(visited.max(axis=0))),
+                           _floats(np.abs(delta).sum(axis=0)))
+
+    @staticmethod
+    def _arc_length(arc, move, delta, motion, scale, column):
+        lines = move[arc]
+        i = np.nan_to_num(column('I')[lines]) * scale[lines]
+        j = np.nan_to_num(column('J')[lines]) * scale[lines]
+        r = column('R')[lines] * scale[lines]
+        dx, dy, dz = delta[arc, 0], delta[arc, 1], delta[arc, 2]
+        chord = np.hypot(dx, dy)
+        ccw = motion[lines] == 3.0
+
+        # I/J arcs: sweep from the angles of start and end around the centre
+        a0 = np.arctan2(-j, -i)
+        a1 = np.arctan2(dy - j, dx - i)
+        sweep = np.mod(np.where(ccw, a1 - a0, a0 - a1), 2 * np.pi)
+        # End point == start point is a full circle (atan2 may return -pi and pi for it)
+        sweep = np.where(chord < 1e-9, 2 * np.pi, sweep)
+        radius = np.hypot(i, j)
+        # R arcs: minor arc for R > 0, major arc for R < 0
+        has_r = ~np.isnan(r)
+        r_abs = np.abs(np.nan_to_num(r))
+        minor = 2 * np.arcsin(np.clip(chord / np.maximum(2 * r_abs, 1e-12), 0.0, 1.0))
+        sweep = np.where(has_r, np.where(np.nan_to_num(r) < 0, 2 * np.pi - minor, minor), np.abs(sweep))
+        radius = np.where(has_r, r_abs, radius)
+        return np.hypot(radius * sweep, dz)
+
+    def _motion_time(self, delta, length, feeds, stops):
+        """Total time of moves with trapezoidal profiles; returns (seconds, moves, mm)."""
+        keep = length > 1e-9
+        if stops is not None and not keep.all():
+            # A stop before a dropped zero-length move carries over to the next kept move
+            kept = np.flatnonzero(keep)
+            seen = np.concatenate(([0], np.cumsum(stops[:-1])))
+            stops = np.concatenate((seen[kept + 1] - seen[np.concatenate(([0], kept[:-1] + 1))] > 0,
+                                    [True]))
+        delta, length, feeds = delta[keep], length[keep], feeds[keep]
+        if not len(length):
+            return 0.0, 0, 0.0
+        a = self.accel
+        unit = delta / length[:, None]
+
+        # Junction speed between move k and k+1 (GRBL junction deviation)
+        cos_theta = -np.einsum('ij,ij->i', unit[:-1], unit[1:])
+        sin_half = np.sqrt(np.clip((1.0 - cos_theta) / 2.0, 0.0, 1.0))
+        with np.errstate(divide='ignore'):
+            v_sq = np.where(sin_half < 0.999999,
+                            a * self.junction_deviation * sin_half / (1.0 - sin_half), np.inf)
+        v_junction = np.sqrt(np.minimum.reduce([
+            v_sq, feeds[:-1] ** 2, feeds[1:] ** 2, 2 * a * length[:-1], 2 * a * length[1:]]))
+        v_edges = np.concatenate(([0.0], v_junction, [0.0]))
+        if stops is not None:
+            v_edges[stops] = 0.0
+        v0, v1 = v_edges[:-1], v_edges[1:]
+
+        peak = np.sqrt((2 * a * length + v0 ** 2 + v1 ** 2) / 2.0)
+        vc = np.minimum(feeds, peak)
+        d_acc = (vc ** 2 - v0 ** 2) / (2 * a)
+        d_dec = (vc ** 2 - v1 ** 2) / (2 * a)
+        cruise = np.maximum(length - d_acc - d_dec, 0.0) / vc
+        times = (vc - v0) / a + (vc - v1) / a + cruise
+        return float(times.sum()), len(length), float(length.sum())
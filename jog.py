@@ -0,0 +1,138 @@
+import threading
+
+from command_queue import PRIORITY_HIGH
+
+
+class JogController:
+    """Coalesced step jogging and press-and-hold continuous jogging.
+
+    Step jogs for the same axis that arrive within `window` seconds are
+    merged into a single motion, so ten quick clicks become one move
+    instead of thirty round trips.
+
+    With `grbl_jog` (default) moves use GRBL's `$J=` jog command, which
+    carries its own distance mode and feed and can be aborted at once with
+    the real-time jog cancel. Otherwise plain G91/G1 moves are sent and the
+    G90/G91 mode and feed rate are only resent when they differ from what
+    the controller last received.
+
+    `on_reply(label, response)` is called on the I/O worker thread once a
+    jog was acknowledged.
+    """
+
+    def __init__(self, controller, feed=3000, window=0.05, grbl_jog=True,
+                 continuous_travel=100.0, on_reply=None):
+        self.controller = controller
+        self.feed = feed
+        self.window = window
+        self.grbl_jog = grbl_jog
+        self.continuous_travel = continuous_travel  # mm per hold; GRBL soft limits still apply
+        self.on_reply = on_reply
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._restore_timer = None
+        self.continuous_axis = None
+        self._continuous = None  # Future of the running continuous jog
+
+    def step(self, axis, distance):
+        """Queue an incremental move; merged with others for `window` seconds."""
+        axis = axis.upper()
+        with self._lock:
+            self._pending[axis] = self._pending.get(axis, 0.0) + distance
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send all pending step jogs now."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for axis, distance in pending.items():
+            if abs(distance) < 1e-6:
+                continue  # X+ then X- inside one window cancel out
+            self._submit(self._send_step, axis, distance)
+
+    def start_continuous(self, axis, direction, feed=None):
+        """Jog towards `direction` (+1/-1) until stop_continuous() is called."""
+        if not self.grbl_jog:
+            print("Continuous jogging requires GRBL $J= jog support.")
+            return False
+        self.flush()
+        self.continuous_axis = axis.upper()
+        distance = direction * self.continuous_travel
+        self._continuous = self._submit(self._send_lines, [self._jog_line(axis.upper(), distance, feed or self.feed)],
+                                        f"Jog {axis.upper()}  continuous   Status:", priority=PRIORITY_HIGH)
+        return True
+
+    def stop_continuous(self):
+        """Abort a continuous jog immediately (real-time jog cancel).
+
+        A jog line still waiting in the queue is cancelled instead; one
+        being sent is cancelled once acknowledged, since a jog cancel that
+        overtakes the line would let the full jog run. Never blocks, so it
+        can be called from the GUI thread.
+        """
+        if self.continuous_axis is None:
+            return
+        self.continuous_axis = None
+        future, self._continuous = self._continuous, None
+        if not future.cancel():
+            # Runs right away if the jog was already acknowledged, else on the I/O worker
+            future.add_done_callback(lambda _: self.controller.jog_cancel())
+
+    def close(self):
+        """Send pending jogs and restore absolute mode if it was changed."""
+        self.flush()
+        self.stop_continuous()
+        if self._restore_timer is not None:
+            self._restore_timer.cancel()
+            self._restore_timer = None
+        if not self.grbl_jog:
+            self._submit(self._restore_absolute)
+
+    def _submit(self, fn, *args, priority=None):
+        kwargs = {} if priority is None else {'priority': priority}
+        return self.controller.commands.submit(fn, *args, **kwargs)
+
+    def _jog_line(self, axis, distance, feed):
+        return f"$J=G91 {axis}{distance:.3f} F{feed:g}"
+
+    def _modal_lines(self, distance_mode):
+        # Runs on the I/O worker, so controller.modal reflects everything sent before
+        if self.controller.modal['distance'] == distance_mode:
+            return []
+        return [distance_mode]
+
+    def _send_step(self, axis, distance):
+        label = f"Jog {axis}  {distance:g}mm   Status:"
+        if self.grbl_jog:
+            return self._send_lines([self._jog_line(axis, distance, self.feed)], label)
+        move = f"G1 {axis}{distance:.3f}"
+        if self.controller.modal['feed'] != float(self.feed):
+            move += f" F{self.feed:g}"
+        self._schedule_restore()
+        return self._send_lines(self._modal_lines('G91') + [move], label)
+
+    def _schedule_restore(self):
+        # Go back to absolute mode once the user stopped jogging
+        if self._restore_timer is not None:
+            self._restore_timer.cancel()
+        self._restore_timer = threading.Timer(0.5, self._submit, args=(self._restore_absolute,))
+        self._restore_timer.daemon = True
+        self._restore_timer.start()
+
+    def _restore_absolute(self):
+        return self._send_lines(self._modal_lines('G90'), None)
+
+    def _send_lines(self, lines, label):
+        if not lines:
+            return None
+        response = self.controller.send_command("\n".join(lines))
+        if label and self.on_reply:
+            self.on_reply(label, response)
+        return response
\ No newline at end of file
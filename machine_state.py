@@ -0,0 +1,176 @@
+import threading
+import time
+
+
+class MachineState:
+    """Latest known machine status, fed by GRBL real-time status reports.
+
+    The serial reader thread calls update_from_status() for every
+    `<State|MPos:...|FS:...|Bf:...>` report. Parsing works in place on
+    preallocated fields, and subscribers are only notified when a value
+    actually changed, so high poll rates stay cheap.
+
+    Subscribers are called on the reader thread with the MachineState
+    itself and must return quickly (e.g. emit a Qt signal).
+    """
+
+    def __init__(self):
+        self.state = "Unknown"
+        self.position = [0.0, 0.0, 0.0]     # machine position (MPos), mm
+        self.work_offset = [0.0, 0.0, 0.0]  # WCO, mm
+        self.feed = 0.0
+        self.spindle = 0.0
+        self.buffer_blocks = None   # free planner blocks
+        self.buffer_bytes = None    # free RX buffer bytes
+        self.alarm = None
+        self.updated = 0.0          # time.monotonic() of the last report
+        self.reports = 0
+        self._scratch = ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])  # MPos, WPos, WCO being parsed
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """Call callback(state) whenever a report changes a value."""
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    @property
+    def work_position(self):
+        p, o = self.position, self.work_offset
+        return [p[0] - o[0], p[1] - o[1], p[2] - o[2]]
+
+    def snapshot(self):
+        """Return a consistent copy of the current values as a dict."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'position': tuple(self.position),
+                'work_position': tuple(self.work_position),
+                'feed': self.feed,
+                'spindle': self.spindle,
+                'buffer_blocks': self.buffer_blocks,
+                'buffer_bytes': self.buffer_bytes,
+                'alarm': self.alarm,
+                'updated': self.updated,
+            }
+
+    def update_from_status(self, line):
+        """Parse one status report line; returns True if anything changed."""
+        with self._lock:
+            changed = parse_status(line, self)
+            self.updated = time.monotonic()
+            self.reports += 1
+        if changed:
+            self._notify()
+        return changed
+
+    def handle_message(self, line):
+        """Track alarms from unsolicited controller messages."""
+        if line.startswith("ALARM:"):
+            with self._lock:
+                self.alarm = line[6:]
+                self.state = "Alarm"
+            self._notify()
+        elif line.startswith("Grbl") and self.alarm is not None:
+            # Soft reset / reboot banner
+            with self._lock:
+                self.alarm = None
+            self._notify()
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Machine state listener error: {e}")
+
+
+def _parse_axes(text, target):
+    # "x,y,z" into an existing list
+    start = 0
+    for i in range(3):
+        end = text.find(',', start)
+        if end < 0:
+            end = len(text)
+        target[i] = float(text[start:end])
+        start = end + 1
+        if start > len(text):
+            break
+
+
+def _assign(source, target):
+    # Copy three values; returns True if one changed
+    if source[0] == target[0] and source[1] == target[1] and source[2] == target[2]:
+        return False
+    target[:] = source
+    return True
+
+
+def parse_status(line, state):
+    """Update `state` from a GRBL 1.1 status report; returns True if changed.
+
+    Unknown fields are ignored. The report is parsed completely into
+    scratch values first, so a malformed report leaves state untouched.
+    """
+    if not line.startswith('<'):
+        return False
+    end = line.find('>')
+    body = line[1:end] if end > 0 else line[1:]
+    mpos, wpos, wco = state._scratch
+    has_mpos = has_wpos = has_wco = False
+    feed = spindle = blocks = free = None
+    try:
+        fields = body.split('|')
+        name = fields[0]
+        for field in fields[1:]:
+            key = field[:2]
+            if key == 'MP':     # MPos:x,y,z
+                _parse_axes(field[5:], mpos)
+                has_mpos = True
+            elif key == 'WP':   # WPos:x,y,z -> MPos derived from the offset below
+                _parse_axes(field[5:], wpos)
+                has_wpos = True
+            elif key == 'WC':   # WCO:x,y,z
+                _parse_axes(field[4:], wco)
+                has_wco = True
+            elif key == 'FS':   # FS:feed,spindle
+                comma = field.find(',')
+                feed = float(field[3:comma])
+                spindle = float(field[comma + 1:])
+            elif key == 'F:':   # F:feed (no spindle)
+                feed = float(field[2:])
+            elif key == 'Bf':   # Bf:blocks,bytes
+                comma = field.find(',')
+                blocks = int(field[3:comma])
+                free = int(field[comma + 1:])
+    except (ValueError, IndexError):
+        return False
+
+    changed = False
+    if state.state != name:
+        state.state = name
+        if not name.startswith('Alarm'):
+            state.alarm = None
+        changed = True
+    if has_wco:
+        changed |= _assign(wco, state.work_offset)
+    if has_mpos:
+        changed |= _assign(mpos, state.position)
+    elif has_wpos:
+        o = state.work_offset
+        wpos[0] += o[0]
+        wpos[1] += o[1]
+        wpos[2] += o[2]
+        changed |= _assign(wpos, state.position)
+    if feed is not None and (feed != state.feed or (spindle is not None and spindle != state.spindle)):
+        state.feed = feed
+        if spindle is not None:
+            state.spindle = spindle
+        changed = True
+    if blocks is not None and (blocks != state.buffer_blocks or free != state.buffer_bytes):
+        state.buffer_blocks, state.buffer_bytes = blocks, free
+        changed = True
+    return changed
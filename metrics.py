@@ -0,0 +1,202 @@
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+
+class Histogram:
+    """Timing histogram with log-spaced buckets in a fixed-size array.
+
+    observe() is a bisect and a few in-place updates; nothing is allocated
+    per event. Updates are not locked: under heavy contention an increment
+    can be lost, which is acceptable for monitoring.
+    """
+
+    def __init__(self, name, labels=None, help="", low=1e-5, high=10.0, buckets=36):
+        self.name = name
+        self.labels = dict(labels or {})
+        self.help = help
+        ratio = (high / low) ** (1.0 / (buckets - 1))
+        self.bounds = [low * ratio ** i for i in range(buckets)]  # upper bucket bounds
+        self.counts = array('Q', bytes(8 * (buckets + 1)))  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (0..1); max for the last one."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    """Registry of timing histograms and sampled values.
+
+    Hot paths guard their timing with `if METRICS.enabled:` so that a
+    disabled registry costs one attribute check per event. Counters and
+    gauges that components already keep (frames captured, bytes written,
+    queue depth) are not pushed at all: a component registers a collector
+    returning (name, labels, value) tuples, which is only called when a
+    snapshot is taken. Names ending in `_total` are exported as counters.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._collectors = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def histogram(self, name, labels=None, help="", **kwargs):
+        """Return the histogram for name/labels, creating it on first use."""
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(name, labels, help, **kwargs)
+            return hist
+
+    def add_collector(self, key, fn):
+        with self._lock:
+            self._collectors[key] = fn
+
+    def remove_collector(self, key):
+        with self._lock:
+            self._collectors.pop(key, None)
+
+    def reset(self):
+        with self._lock:
+            histograms = list(self._histograms.values())
+        for hist in histograms:
+            hist.reset()
+
+    def snapshot(self):
+        """Current values as a JSON-serialisable dict."""
+        with self._lock:
+            histograms = list(self._histograms.values())
+            collectors = list(self._collectors.items())
+        values = []
+        for key, fn in collectors:
+            try:
+                for name, labels, value in fn():
+                    values.append({'name': name, 'labels': dict(labels or {}), 'value': value})
+            except Exception as e:
+                values.append({'name': 'collector_error', 'labels': {'collector': str(key)}, 'value': str(e)})
+        return {
+            'time': time.time(),
+            'enabled': self.enabled,
+            'histograms': [dict(name=h.name, labels=h.labels, **h.summary()) for h in histograms],
+            'values': values,
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            histograms = list(self._histograms.values())
+        lines = []
+        described = set()
+        for hist in histograms:
+            if hist.name not in described:
+                described.add(hist.name)
+                if hist.help:
+                    lines.append(f"# HELP {hist.name} {hist.help}")
+                lines.append(f"# TYPE {hist.name} histogram")
+            cumulative = 0
+            for bound, count in zip(hist.bounds + [math.inf], hist.counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else f"{bound:.6g}"
+                lines.append(f"{hist.name}_bucket{_labels(hist.labels, le=le)} {cumulative}")
+            lines.append(f"{hist.name}_sum{_labels(hist.labels)} {hist.sum:.9g}")
+            lines.append(f"{hist.name}_count{_labels(hist.labels)} {hist.count}")
+        for value in self.snapshot()['values']:
+            if not isinstance(value['value'], (int, float)):
+                continue
+            name = value['name']
+            if name not in described:
+                described.add(name)
+                lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name}{_labels(value['labels'])} {value['value']:.9g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Dump to `path`: JSON for *.json, Prometheus text otherwise."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                json.dump(self.snapshot(), f, indent=1)
+            else:
+                f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def overlay_lines(self):
+        """Short human-readable lines for a live overlay."""
+        snapshot = self.snapshot()
+        lines = []
+        for h in snapshot['histograms']:
+            if h['count']:
+                lines.append(f"{_short(h['name'], h['labels'])}: p50 {1000 * h['p50']:.1f} ms  "
+                             f"p99 {1000 * h['p99']:.1f} ms  max {1000 * h['max']:.1f} ms  n={h['count']}")
+        for v in snapshot['values']:
+            value = v['value']
+            text = f"{value:.1f}" if isinstance(value, float) else str(value)
+            lines.append(f"{_short(v['name'], v['labels'])}: {text}")
+        return lines
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _short(name, labels):
+    return name + (f"[{','.join(str(v) for v in labels.values())}]" if labels else "")
+
+
+# Process-wide registry used by the built-in hooks
+METRICS = Metrics()
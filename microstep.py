@@ -0,0 +1,534 @@
+"""Headless scripting API and command line for Microstep Control.
+
+    python -m microstep discover [--probe-ports] [--no-cameras] [--json]
+    python -m microstep send --port COM3 G28 "G1 X10 F3000"
+    python -m microstep run --port COM3 job.nc [--arc-segment 0.1]
+    python -m microstep estimate job.nc
+    python -m microstep capture --camera 0 frame.png [--port COM3 --at 10 5 0]
+    python -m microstep scan --port COM3 --camera 0 --region 0 0 10 10 --fov 1.2 0.9 --out scan/
+    python -m microstep calibrate --port COM3 --camera 0 [--step 0.05]
+    python -m microstep scan ... --drift-correct [--mm-per-px 0.002]
+    python -m microstep scan ... --stitch mosaic/ [--mm-per-px 0.002]
+    python -m microstep --log run.jsonl run --port COM3 job.nc
+    python -m microstep replay run.jsonl [--speed 0 --port COM3]
+    python -m microstep serve --camera 0 [--host 0.0.0.0 --http-port 8080]
+    python -m microstep dashboard stations.json
+    python -m microstep gui
+
+`--simulate` runs any command against the simulated controller and
+virtual camera instead of hardware. Heavy dependencies (numpy, OpenCV,
+PySide6) are imported only by the commands that use them, so discovery,
+sending and streaming start in a fraction of a second.
+"""
+import argparse
+import json
+import sys
+import time
+
+STATUS_POLL_HZ = 10
+
+
+def discover(probe_ports=False, cameras=True, deadline=3.0, cache_path=None):
+    """Return (ports, cameras) like the GUI's device lists.
+
+    ports: [(port, description, vid_pid, is_cnc)], is_cnc None unless probed
+    cameras: [(index, name)]
+    """
+    from initialial_communication_base import InitialCommunication
+    from device_discovery import DeviceDiscovery, DEFAULT_CACHE_PATH
+
+    comm = InitialCommunication()
+    if not cameras:
+        comm.max_cam_index = 0
+    discovery = DeviceDiscovery(comm, cache_path=cache_path or DEFAULT_CACHE_PATH,
+                                deadline=deadline, probe_ports=probe_ports)
+    found = {}
+    discovery.discover(on_done=lambda p, c: found.update(ports=p, cameras=c))
+    return found.get('ports', []), found.get('cameras', [])
+
+
+class Microscope:
+    """Stage controller and camera for scripts, without Qt.
+
+    Either part is optional: pass `port` for the CNC controller and/or
+    `camera` (an index, or any cv2.VideoCapture-like object). With
+    `simulate=True` a SimulatedController and a stage-following
+    VirtualCamera stand in for missing hardware.
+
+        with Microscope(port="COM3", camera=0) as scope:
+            scope.move_to(10, 5)
+            image = scope.capture("frame.png")
+    """
+
+    def __init__(self, port=None, camera=None, baudrate=115200, width=None, height=None, simulate=False,
+                 log=None):
+        self.port = port
+        self.camera_source = camera
+        self.baudrate = baudrate
+        self.width = width
+        self.height = height
+        self.simulate = simulate
+        self.log_path = log  # session_log.SessionLog file for controller traffic
+        self.session_log = None
+        self.controller = None
+        self.camera = None
+        self.simulator = None
+        self._frames = None
+
+    def open(self):
+        if self.simulate:
+            from simulator import SimulatedController, VirtualCamera
+            self.simulator = SimulatedController(baudrate=self.baudrate)
+            self.port = self.simulator.start()
+            if self.camera_source is None:
+                self.camera_source = VirtualCamera(self.width or 1280, self.height or 720, stage=self.simulator)
+
+        if self.port is not None:
+            from cnc_control import CNCController
+            self.controller = CNCController(self.port, baudrate=self.baudrate)
+            if self.log_path:
+                # Attach before connecting so the startup banner is logged
+                from session_log import SessionLog
+                self.session_log = SessionLog(self.log_path).start(port=self.port)
+                self.session_log.attach(self.controller)
+            self.controller.connect()
+            if not (self.controller.ser and self.controller.ser.is_open):
+                self.close()
+                raise ConnectionError(f"Could not open CNC port {self.port}.")
+            self.controller.start_status_polling(STATUS_POLL_HZ)
+
+        if self.camera_source is not None:
+            from camera_stream import CameraStream
+            if isinstance(self.camera_source, int):
+                self.camera = CameraStream(self.camera_source, self.width, self.height)
+            else:
+                self.camera = CameraStream(width=self.width, height=self.height, capture=self.camera_source)
+            if not self.camera.start():
+                error = self.camera.error
+                self.close()
+                raise ConnectionError(f"Could not open camera: {error}")
+            self._frames = self.camera.subscribe('script')
+        return self
+
+    def close(self):
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera = None
+        if self.controller is not None:
+            self.controller.disconnect()
+            self.controller = None
+        if self.session_log is not None:
+            self.session_log.close()
+            self.session_log = None
+        if self.simulator is not None:
+            self.simulator.stop()
+            self.simulator = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Motion ---
+
+    def _require_controller(self):
+        if self.controller is None:
+            raise RuntimeError("No CNC controller connected.")
+        return self.controller
+
+    def send(self, *commands):
+        """Send lines in order; returns the (line, reply) pairs that failed."""
+        return self._require_controller().stream(list(commands))
+
+    def move_to(self, x=None, y=None, z=None, feed=3000, wait=True):
+        """Absolute move; with `wait` returns once motion has finished."""
+        axes = ''.join(f" {a}{v:.4f}" for a, v in (('X', x), ('Y', y), ('Z', z)) if v is not None)
+        lines = ["G90", f"G1{axes} F{feed}"] if axes else []
+        if wait:
+            lines.append("G4 P0")  # acknowledged only once the planner is empty
+        return self.send(*lines)
+
+    def position(self):
+        """Last reported work position (x, y, z)."""
+        return tuple(self._require_controller().state.work_position)
+
+    def run_program(self, path, arc_segment=None, on_progress=None):
+        """Stream a G-code file; returns the GCodeProgram (counters) and failed lines."""
+        from gcode_loader import GCodeProgram
+        program = GCodeProgram(path, arc_segment=arc_segment)
+
+        def on_reply(line, reply):
+            program.on_reply(line, reply)
+            if on_progress:
+                on_progress(program)
+
+        failed = self._require_controller().stream(program, on_reply)
+        return program, failed
+
+    # --- Camera ---
+
+    def capture(self, path=None, timeout=2.0):
+        """Return a copy of the first frame captured after this call; optionally save it."""
+        if self._frames is None:
+            raise RuntimeError("No camera open.")
+        requested = time.perf_counter()
+        deadline = requested + timeout
+        while True:
+            frame = self._frames.get(timeout=max(0.0, deadline - time.perf_counter()))
+            if frame is None:
+                raise TimeoutError("No frame from camera.")
+            with frame:
+                if frame.timestamp >= requested:
+                    image = frame.image.copy()
+                    break
+        if path:
+            import cv2
+            if not cv2.imwrite(path, image):
+                raise OSError(f"Could not write {path}")
+        return image
+
+    def scan(self, plan, output_dir, **kwargs):
+        """Acquire a tile_scan.ScanPlan; kwargs go to TileScanner. Returns its stats."""
+        from tile_scan import TileScanner
+        if self.camera is None:
+            raise RuntimeError("No camera open.")
+        scanner = TileScanner(self._require_controller(), self.camera, plan, output_dir, **kwargs)
+        return scanner.run()
+
+    def drift_corrector(self, mm_per_px=None, calibration=None, **kwargs):
+        """A drift.DriftCorrector for this stage (e.g. for scan(drift_corrector=...)).
+
+        Uses the saved calibration (see calibrate_drift()) unless mm_per_px is given.
+        """
+        from drift import DEFAULT_CALIBRATION_PATH, DriftCorrector
+        controller = self._require_controller()
+        if mm_per_px:
+            return DriftCorrector(controller, mm_per_px=mm_per_px, **kwargs)
+        return DriftCorrector.from_calibration(controller, calibration or DEFAULT_CALIBRATION_PATH, **kwargs)
+
+    def stitcher(self, plan, path, mm_per_px=None, calibration=None, **kwargs):
+        """A mosaic.MosaicStitcher for a scan of `plan` (e.g. for scan(stitcher=...)).
+
+        Uses the saved calibration (see calibrate_drift()) unless mm_per_px is
+        given; close() it after the scan to finish the mosaic.
+        """
+        from drift import DEFAULT_CALIBRATION_PATH, load_calibration
+        from mosaic import MosaicStitcher
+        if mm_per_px:
+            return MosaicStitcher(path, plan.bounds(), mm_per_px, **kwargs)
+        px_per_mm = load_calibration(calibration or DEFAULT_CALIBRATION_PATH)
+        return MosaicStitcher(path, plan.bounds(), px_per_mm=px_per_mm, **kwargs)
+
+    def calibrate_drift(self, step=0.05, calibration=None):
+        """Measure image shift per mm of stage travel and save it; returns the 2x2 matrix."""
+        from drift import DEFAULT_CALIBRATION_PATH, DriftCorrector
+        if self.camera is None:
+            raise RuntimeError("No camera open.")
+        # Placeholder scale, replaced by the measurement
+        corrector = DriftCorrector(self._require_controller(), mm_per_px=1.0)
+        px_per_mm = corrector.calibrate(self.camera, step)
+        corrector.save_calibration(calibration or DEFAULT_CALIBRATION_PATH)
+        return px_per_mm
+
+
+# --- Command line ---
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def _cmd_discover(args):
+    ports, cameras = discover(args.probe_ports, not args.no_cameras, args.deadline)
+    if args.json:
+        print(json.dumps({'ports': ports, 'cameras': cameras}, indent=1))
+        return 0
+    for port, desc, vid_pid, is_cnc in ports:
+        tag = {True: "CNC", False: "-", None: "?"}[is_cnc]
+        print(f"port   {port:<20} {vid_pid:<10} {tag:<4} {desc}")
+    for index, name in cameras:
+        print(f"camera {index:<20} {name}")
+    return 0
+
+
+def _cmd_send(args):
+    with Microscope(args.port, baudrate=args.baudrate, simulate=args.simulate, log=args.log) as scope:
+        failed = scope.send(*args.commands)
+    for line, reply in failed:
+        print(f"{line}: {reply or 'timeout'}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _cmd_run(args):
+    last = [0.0]
+
+    def progress(program):
+        now = time.monotonic()
+        if now - last[0] >= 1.0:
+            last[0] = now
+            print(f"{100 * program.progress():5.1f}%  {program.lines_acked} lines  "
+                  f"{program.bytes_sent / 1024:.0f} KiB  {program.errors} errors", file=sys.stderr)
+
+    started = time.perf_counter()
+    with Microscope(args.port, baudrate=args.baudrate, simulate=args.simulate, log=args.log) as scope:
+        program, failed = scope.run_program(args.program, args.arc_segment, progress)
+    print(f"{program.lines_acked} lines acknowledged, {len(failed or [])} failed "
+          f"in {time.perf_counter() - started:.1f} s")
+    for line, reply in failed or []:
+        print(f"{line}: {reply or 'timeout'}", file=sys.stderr)
+    return 1 if failed or failed is None else 0
+
+
+def _cmd_estimate(args):
+    from job_estimate import JobEstimator
+    estimate = JobEstimator(accel=args.accel, rapid_rate=args.rapid).estimate_program(args.program)
+    (x0, y0, z0), (x1, y1, z1) = estimate.bounds
+    print(f"duration  {_duration(estimate.duration)} (dwell {_duration(estimate.dwell)})")
+    print(f"moves     {estimate.moves}, {estimate.distance:.1f} mm")
+    print(f"bounds    X {x0:.3f}..{x1:.3f}  Y {y0:.3f}..{y1:.3f}  Z {z0:.3f}..{z1:.3f}")
+    print("travel    X {:.1f}  Y {:.1f}  Z {:.1f} mm".format(*estimate.travel))
+    return 0
+
+
+def _cmd_capture(args):
+    camera = args.camera if not args.simulate else None
+    with Microscope(args.port, camera, args.baudrate, args.width, args.height, args.simulate,
+                    log=args.log) as scope:
+        if args.at:
+            failed = scope.move_to(*args.at)
+            if failed:
+                print(f"Move failed: {failed}", file=sys.stderr)
+                return 1
+        image = scope.capture(args.output)
+    print(f"{args.output}: {image.shape[1]}x{image.shape[0]}")
+    return 0
+
+
+def _cmd_scan(args):
+    from tile_scan import ScanPlan
+    plan = ScanPlan(*args.region, *args.fov, overlap=args.overlap)
+    if args.estimate:
+        from job_estimate import JobEstimator
+        estimate = JobEstimator().estimate_scan(plan, feed=args.feed, dwell=args.dwell)
+        print(f"{len(plan)} tiles, about {_duration(estimate.duration)} of motion and dwell")
+        return 0
+    camera = args.camera if not args.simulate else None
+    with Microscope(args.port, camera, args.baudrate, args.width, args.height, args.simulate,
+                    log=args.log) as scope:
+        corrector = stitcher = None
+        if args.drift_correct:
+            corrector = scope.drift_corrector(args.mm_per_px, args.calibration)
+        if args.stitch:
+            stitcher = scope.stitcher(plan, args.stitch, args.mm_per_px, args.calibration)
+        try:
+            stats = scope.scan(plan, args.out, feed=args.feed, dwell=args.dwell, drift_corrector=corrector,
+                               stitcher=stitcher)
+        finally:
+            if stitcher is not None:
+                stitcher.close()
+    if corrector is not None:
+        stats['drift'] = corrector.stats()
+    if stitcher is not None:
+        stats['mosaic'] = {'path': args.stitch, 'width': stitcher.width, 'height': stitcher.height,
+                           'placed': stitcher.tiles_placed, 'registered': stitcher.tiles_registered,
+                           'errors': len(stitcher.errors) + stitcher.registration_errors}
+    print(json.dumps(stats, indent=1, default=str))
+    return 1 if stats.get('errors') else 0
+
+
+def _cmd_calibrate(args):
+    camera = args.camera if not args.simulate else None
+    with Microscope(args.port, camera, args.baudrate, args.width, args.height, args.simulate,
+                    log=args.log) as scope:
+        (xx, xy), (yx, yy) = scope.calibrate_drift(args.step, args.calibration)
+    print(f"+1 mm X moves the image by ({xx:.1f}, {yx:.1f}) px, +1 mm Y by ({xy:.1f}, {yy:.1f}) px")
+    return 0
+
+
+def _cmd_replay(args):
+    from session_log import format_entry, read_header, replay_session
+    header = read_header(args.session)
+    if header.get('session'):
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['session']))
+        print(f"Session started {started}" + (f" on {header['port']}" if header.get('port') else ""))
+    directions = set(args.only) if args.only else None
+    if not (args.port or args.simulate):
+        replay_session(args.session, args.speed, directions=directions)
+        return 0
+    with Microscope(args.port, baudrate=args.baudrate, simulate=args.simulate, log=args.log) as scope:
+        count = replay_session(args.session, args.speed, controller=scope.controller, directions=directions,
+                               on_entry=lambda e: args.verbose and print(format_entry(e)))
+        print(f"Replayed {count} entries; position now " + " ".join(f"{v:.3f}" for v in scope.position()))
+    return 0
+
+
+def _cmd_serve(args):
+    from frame_server import FrameServer
+    camera = args.camera if not args.simulate else None
+    with Microscope(camera=camera, width=args.width, height=args.height, simulate=args.simulate,
+                    log=args.log) as scope:
+        server = FrameServer(scope.camera, args.host, args.http_port, args.quality,
+                             max_fps=args.max_fps, max_kbps=args.max_kbps)
+        if server.start() is None:
+            return 1
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+    return 0
+
+
+def _cmd_dashboard(args):
+    from PySide6.QtWidgets import QApplication
+    from dashboard import StationDashboard
+    from stations import Station, StationManager
+
+    simulators = []
+    if args.simulate:
+        from simulator import SimulatedController, VirtualCamera
+        stations = []
+        for i in range(args.stations):
+            sim = SimulatedController(baudrate=args.baudrate)
+            simulators.append(sim)
+            stations.append(Station(f"sim{i + 1}", sim.start(), VirtualCamera(640, 480, stage=sim, seed=i)))
+        manager = StationManager(stations, workers=args.workers)
+    elif args.config:
+        manager = StationManager.from_config(args.config, workers=args.workers)
+    else:
+        print("dashboard: a station config file is required (or --simulate)", file=sys.stderr)
+        return 2
+
+    app = QApplication(sys.argv[:1])
+    window = StationDashboard(manager)
+    manager.start()
+    window.show()
+    try:
+        return app.exec()
+    finally:
+        manager.stop()
+        for sim in simulators:
+            sim.stop()
+
+
+def _cmd_gui(args):
+    from main import main as gui_main
+    sys.argv = sys.argv[:1]
+    gui_main()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="microstep", description="Headless Microstep Control.")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--simulate", action="store_true", help="use the simulated controller and camera")
+    parser.add_argument("--log", help="record controller traffic to this session log (JSON lines)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("discover", help="list serial ports and cameras")
+    p.add_argument("--probe-ports", action="store_true", help="write a probe command to every port")
+    p.add_argument("--no-cameras", action="store_true")
+    p.add_argument("--deadline", type=float, default=3.0)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=_cmd_discover)
+
+    p = commands.add_parser("send", help="send G-code lines")
+    p.add_argument("--port")
+    p.add_argument("commands", nargs="+")
+    p.set_defaults(func=_cmd_send)
+
+    p = commands.add_parser("run", help="stream a G-code program")
+    p.add_argument("--port")
+    p.add_argument("program")
+    p.add_argument("--arc-segment", type=float, default=None, help="expand G2/G3 into chords of this length (mm)")
+    p.set_defaults(func=_cmd_run)
+
+    p = commands.add_parser("estimate", help="estimate a program's run time without a machine")
+    p.add_argument("program")
+    p.add_argument("--accel", type=float, default=500.0, help="mm/s^2")
+    p.add_argument("--rapid", type=float, default=3000.0, help="G0 rate, mm/min")
+    p.set_defaults(func=_cmd_estimate)
+
+    for name, help_text in (("capture", "save one camera frame"), ("scan", "acquire a tile scan"),
+                            ("calibrate", "measure image shift per mm of stage travel for drift correction")):
+        p = commands.add_parser(name, help=help_text)
+        p.add_argument("--port")
+        p.add_argument("--camera", type=int, default=0)
+        p.add_argument("--width", type=int)
+        p.add_argument("--height", type=int)
+    capture, scan, calibrate = commands.choices["capture"], commands.choices["scan"], commands.choices["calibrate"]
+    for p in (scan, calibrate):
+        p.add_argument("--calibration", help="drift calibration file (default ~/.microstep/calibration.json)")
+
+    capture.add_argument("output")
+    capture.add_argument("--at", type=float, nargs=3, metavar=("X", "Y", "Z"), help="move here first")
+    capture.set_defaults(func=_cmd_capture)
+
+    scan.add_argument("--region", type=float, nargs=4, metavar=("X0", "Y0", "X1", "Y1"), required=True)
+    scan.add_argument("--fov", type=float, nargs=2, metavar=("W", "H"), required=True, help="field of view, mm")
+    scan.add_argument("--overlap", type=float, default=0.1)
+    scan.add_argument("--out", default="scan")
+    scan.add_argument("--feed", type=float, default=3000)
+    scan.add_argument("--dwell", type=float, default=0.2)
+    scan.add_argument("--estimate", action="store_true", help="only print the expected duration")
+    scan.add_argument("--drift-correct", action="store_true", help="register every tile and correct stage drift")
+    scan.add_argument("--mm-per-px", type=float, help="image scale, instead of the saved calibration")
+    scan.add_argument("--stitch", metavar="DIR", help="stitch the tiles into a mosaic in this directory")
+    scan.set_defaults(func=_cmd_scan)
+
+    calibrate.add_argument("--step", type=float, default=0.05, help="test move, mm")
+    calibrate.set_defaults(func=_cmd_calibrate)
+
+    p = commands.add_parser("replay", help="show a session log, or send its commands again with --port")
+    p.add_argument("session")
+    p.add_argument("--port")
+    p.add_argument("--speed", type=float, default=1.0, help="timing multiplier; 0 = as fast as possible")
+    p.add_argument("--only", nargs="+", choices=["tx", "rx", "rt", "msg", "st", "ev"], help="entry kinds")
+    p.add_argument("--verbose", action="store_true", help="print entries while sending")
+    p.set_defaults(func=_cmd_replay)
+
+    p = commands.add_parser("serve", help="stream the camera as MJPEG over HTTP")
+    p.add_argument("--camera", type=int, default=0)
+    p.add_argument("--width", type=int)
+    p.add_argument("--height", type=int)
+    p.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to accept other machines")
+    p.add_argument("--http-port", type=int, default=8080)
+    p.add_argument("--quality", type=int, nargs="+", default=[50, 80], help="JPEG quality levels offered")
+    p.add_argument("--max-fps", type=float)
+    p.add_argument("--max-kbps", type=float, help="per-viewer bandwidth cap")
+    p.set_defaults(func=_cmd_serve)
+
+    p = commands.add_parser("dashboard", help="monitor several stations from one window")
+    p.add_argument("config", nargs="?", help='JSON list of {"name", "port", "camera", ...}')
+    p.add_argument("--stations", type=int, default=4, help="number of simulated stations")
+    p.add_argument("--workers", type=int, default=4, help="shared save/analysis threads")
+    p.set_defaults(func=_cmd_dashboard)
+
+    p = commands.add_parser("gui", help="start the graphical interface")
+    p.set_defaults(func=_cmd_gui)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    needs_port = (args.command in ("send", "run", "calibrate") or (args.command == "scan" and not args.estimate)
+                  or (args.command == "capture" and args.at))
+    if needs_port and not args.port and not args.simulate:
+        print(f"{args.command}: --port is required (or --simulate)", file=sys.stderr)
+        return 2
+    try:
+        return args.func(args)
+    except (ConnectionError, RuntimeError, TimeoutError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from drift import default_px_per_mm
+
+_SIDES = ('left', 'right', 'top', 'bottom')
+
+
+def register_overlap(reference, moving):
+    """Phase-correlate two equally sized overlap regions (runs in a worker process).
+
+    Returns (dx, dy, response): the position correction of `moving`
+    in pixels and the correlation peak strength.
+    """
+    if reference.ndim == 3:
+        reference = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+        moving = cv2.cvtColor(moving, cv2.COLOR_BGR2GRAY)
+    reference = np.ascontiguousarray(reference, dtype=np.float32)
+    moving = np.ascontiguousarray(moving, dtype=np.float32)
+    window = cv2.createHanningWindow(reference.shape[::-1], cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(reference, moving, window)
+    # The content of `moving` appears shifted opposite to its placement error
+    return -dx, -dy, response
+
+
+class MosaicStitcher:
+    """Stitch tiles into a memory-mapped canvas with an incremental pyramid.
+
+    Tiles are placed from their stage coordinates (tile centre in mm).
+    `px_per_mm` is the camera calibration in drift.DriftCorrector's form,
+    the image shift for a 1 mm stage move in X (first column) and Y; a
+    tile lands opposite to that shift, so the canvas shows the specimen
+    the way the camera does. Without it `mm_per_px` is used with the
+    default orientation, image rows along -Y. Optionally each tile's overlaps with
+    already placed neighbours are phase-correlated on a process pool and
+    the refined offset is applied. Tiles are feather-blended into
+    `level_0.npy`, a numpy memmap that is never read as a whole, and every
+    coarser pyramid level (`level_N.npy`, half the size of N-1) is updated
+    only inside the rectangle the tile touched.
+
+    Placement runs on a background thread in submission order; add_tile()
+    only blocks when `max_pending` tiles are waiting. add_tile() may be
+    called from several threads, but tiles are registered against the
+    neighbours added before them, so feed them in scan order for
+    reproducible results.
+    """
+
+    def __init__(self, path, bounds, mm_per_px=None, feather=32, register=True, workers=None,
+                 min_response=0.1, max_shift=None, max_pending=8, min_level_size=256,
+                 strip_fraction=0.25, keep_neighbours=32, px_per_mm=None):
+        if px_per_mm is None:
+            if not mm_per_px:
+                raise ValueError("MosaicStitcher needs mm_per_px or a px_per_mm calibration.")
+            px_per_mm = default_px_per_mm(mm_per_px)
+        self.path = path
+        self.x0, self.y0, self.x1, self.y1 = bounds  # stage mm covered by the canvas
+        self.px_per_mm = np.array(px_per_mm, dtype=np.float64)
+        self.mm_per_px = mm_per_px or float(1.0 / np.sqrt(abs(np.linalg.det(self.px_per_mm))))
+        self.feather = feather
+        self.register = register
+        self.min_response = min_response
+        self.max_shift = max_shift  # px; None = a quarter of the overlap
+        # Canvas pixel of a stage position = -px_per_mm @ (x, y) - origin
+        corners = -self.px_per_mm @ np.array([[self.x0, self.x1, self.x0, self.x1],
+                                              [self.y0, self.y0, self.y1, self.y1]])
+        self._origin = corners.min(axis=1)
+        self.width, self.height = (int(n) for n in np.ceil(corners.max(axis=1) - self._origin - 1e-6))
+        self.channels = None
+        self.levels = []
+        self.coverage = None
+        self.min_level_size = min_level_size
+        self.strip_fraction = strip_fraction    # largest overlap that can be registered
+        self.keep_neighbours = keep_neighbours  # recent tiles kept for registration
+
+        self.tiles_placed = 0
+        self.tiles_registered = 0
+        self.registration_errors = 0
+        self.errors = []
+        self._recent = {}    # key -> (nominal x, y, edge strips) of recently added tiles
+        self._final = {}     # key -> (nominal x, y, final x, y) once placed
+        self._alpha = None
+        self._add_lock = threading.Lock()  # canvas creation, _recent and queue order
+        self._queue = queue.Queue(max_pending)
+        self._pool = ProcessPoolExecutor(max_workers=workers) if register else None
+        self._thread = threading.Thread(target=self._run, name="mosaic-placer", daemon=True)
+        self._thread.start()
+
+    # --- Public API ---
+
+    def add_tile(self, image, x, y, key=None):
+        """Queue a tile whose centre was at stage (x, y) mm; the image is copied."""
+        cx, cy = self.stage_to_pixel(x, y)
+        px = int(round(cx - image.shape[1] / 2))
+        py = int(round(cy - image.shape[0] / 2))
+        key = key if key is not None else (px, py)
+        image = np.array(image, copy=True)
+        with self._add_lock:
+            if self.channels is None:
+                self._create(image)
+            registrations = []
+            if self.register:
+                registrations = self._submit_registrations(image, px, py)
+                self._recent[key] = (px, py, self._edge_strips(image, px, py))
+                if len(self._recent) > self.keep_neighbours:
+                    self._recent.pop(next(iter(self._recent)))
+            self._queue.put((key, image, px, py, registrations))
+
+    def close(self):
+        """Place every queued tile, flush the memmaps and write mosaic.json."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        for level in self.levels:
+            level.flush()
+        if self.coverage is not None:
+            self.coverage.flush()
+        self._write_metadata()
+
+    def level_for_zoom(self, scale):
+        """Coarsest level still at least `scale` times the level-0 resolution."""
+        level = 0
+        while level + 1 < len(self.levels) and 0.5 ** (level + 1) >= scale:
+            level += 1
+        return level
+
+    def view(self, x, y, width, height, max_width, max_height=None):
+        """Return a BGR image of the level-0 rectangle (x, y, width, height) px.
+
+        The coarsest pyramid level that still fills max_width x max_height
+        is read, so zoomed-out views never touch full-resolution data.
+        """
+        if not self.levels:
+            return None
+        max_height = max_height or max_width
+        scale = min(max_width / float(width), max_height / float(height), 1.0)
+        level = self.level_for_zoom(scale)
+        f = 2 ** level
+        data = self.levels[level]
+        region = data[y // f:(y + height) // f, x // f:(x + width) // f]
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if region.size == 0:
+            return None
+        return cv2.resize(np.asarray(region), size, interpolation=cv2.INTER_AREA)
+
+    def stage_to_pixel(self, x, y):
+        """Level-0 canvas pixel that shows stage position (x, y) mm."""
+        cx, cy = -self.px_per_mm @ (x, y) - self._origin
+        return float(cx), float(cy)
+
+    # --- Setup ---
+
+    def _create(self, image):
+        os.makedirs(self.path, exist_ok=True)
+        self.channels = image.shape[2] if image.ndim == 3 else 1
+        shape = (self.height, self.width) + ((self.channels,) if image.ndim == 3 else ())
+        level = 0
+        while True:
+            self.levels.append(np.lib.format.open_memmap(
+                os.path.join(self.path, f"level_{level}.npy"), mode='w+', dtype=np.uint8, shape=shape))
+            if max(shape[0], shape[1]) <= self.min_level_size:
+                break
+            shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2) + shape[2:]
+            level += 1
+        self.coverage = np.lib.format.open_memmap(
+            os.path.join(self.path, "coverage.npy"), mode='w+', dtype=np.uint8, shape=(self.height, self.width))
+
+    def _write_metadata(self):
+        meta = {
+            'bounds_mm': [self.x0, self.y0, self.x1, self.y1],
+            'mm_per_px': self.mm_per_px,
+            'px_per_mm': self.px_per_mm.tolist(),
+            'width': self.width,
+            'height': self.height,
+            'channels': self.channels,
+            'levels': len(self.levels),
+            'tiles_placed': self.tiles_placed,
+            'tiles_registered': self.tiles_registered,
+            'registration_errors': self.registration_errors,
+        }
+        with open(os.path.join(self.path, "mosaic.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
+
+    def _feather(self, h, w):
+        if self._alpha is None or self._alpha.shape != (h, w):
+            ramp_x = np.minimum(np.arange(w) + 1, np.arange(w)[::-1] + 1) / float(self.feather)
+            ramp_y = np.minimum(np.arange(h) + 1, np.arange(h)[::-1] + 1) / float(self.feather)
+            self._alpha = np.clip(np.minimum.outer(ramp_y, ramp_x), 0.0, 1.0).astype(np.float32)
+        return self._alpha
+
+    # --- Registration ---
+
+    def _submit_registrations(self, image, px, py):
+        """Start phase correlation against every placed neighbour that overlaps."""
+        h, w = image.shape[:2]
+        jobs = []
+        for key, (nx, ny, strips) in self._recent.items():
+            ix0, iy0 = max(px, nx), max(py, ny)
+            ix1, iy1 = min(px + w, nx + w), min(py + h, ny + h)
+            if ix1 - ix0 < 16 or iy1 - iy0 < 16:
+                continue
+            side = self._side(px - nx, py - ny)
+            strip, sx, sy = strips[side]
+            # Only the part of the overlap that lies inside the stored strip
+            ix0, iy0 = max(ix0, sx), max(iy0, sy)
+            ix1, iy1 = min(ix1, sx + strip.shape[1]), min(iy1, sy + strip.shape[0])
+            if ix1 - ix0 < 16 or iy1 - iy0 < 16:
+                continue
+            ref = strip[iy0 - sy:iy1 - sy, ix0 - sx:ix1 - sx]
+            mov = image[iy0 - py:iy1 - py, ix0 - px:ix1 - px]
+            if ref.shape != mov.shape or ref.size == 0:
+                continue
+            overlap = min(ix1 - ix0, iy1 - iy0)
+            jobs.append((key, overlap, self._pool.submit(register_overlap, ref, mov)))
+        return jobs
+
+    @staticmethod
+    def _side(dx, dy):
+        """Which edge of the neighbour the new tile overlaps."""
+        if abs(dx) >= abs(dy):
+            return 'right' if dx > 0 else 'left'
+        return 'bottom' if dy > 0 else 'top'
+
+    def _edge_strips(self, image, px, py):
+        """Copies of the tile borders that later neighbours register against."""
+        h, w = image.shape[:2]
+        sw = max(1, int(w * self.strip_fraction))
+        sh = max(1, int(h * self.strip_fraction))
+        return {
+            'left': (image[:, :sw].copy(), px, py),
+            'right': (image[:, w - sw:].copy(), px + w - sw, py),
+            'top': (image[:sh].copy(), px, py),
+            'bottom': (image[h - sh:].copy(), px, py + h - sh),
+        }
+
+    # --- Placement ---
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._place(*item)
+            except Exception as e:
+                self.errors.append((item[0], str(e)))
+
+    def _place(self, key, image, px, py, registrations):
+        # Final position = neighbour's final position + nominal offset + correction
+        estimates = []
+        for neighbour, overlap, future in registrations:
+            try:
+                dx, dy, response = future.result()
+            except Exception as e:
+                # Keep the tile at its stage position rather than dropping it
+                self.registration_errors += 1
+                print(f"Mosaic registration of {key} against {neighbour} failed: {e}")
+                continue
+            limit = self.max_shift if self.max_shift is not None else overlap / 4.0
+            if response < self.min_response or abs(dx) > limit or abs(dy) > limit:
+                continue
+            if neighbour not in self._final:
+                continue
+            nx, ny, fx, fy = self._final[neighbour]
+            estimates.append((px + (fx - nx) + dx, py + (fy - ny) + dy, response))
+        if estimates:
+            weights = np.array([e[2] for e in estimates])
+            fx = int(round(np.average([e[0] for e in estimates], weights=weights)))
+            fy = int(round(np.average([e[1] for e in estimates], weights=weights)))
+            self.tiles_registered += 1
+        else:
+            fx, fy = px, py
+
+        self._blend(image, fx, fy)
+        self._final[key] = (px, py, fx, fy)
+        self.tiles_placed += 1
+
+    def _blend(self, image, x, y):
+        h, w = image.shape[:2]
+        # Clip the tile to the canvas
+        cx0, cy0 = max(0, x), max(0, y)
+        cx1, cy1 = min(self.width, x + w), min(self.height, y + h)
+        if cx1 <= cx0 or cy1 <= cy0:
+            return
+        tile = image[cy0 - y:cy1 - y, cx0 - x:cx1 - x]
+        alpha = self._feather(h, w)[cy0 - y:cy1 - y, cx0 - x:cx1 - x]
+        canvas = self.levels[0][cy0:cy1, cx0:cx1]
+        covered = self.coverage[cy0:cy1, cx0:cx1]
+
+        # Feather only where the canvas already holds image data
+        a = np.where(covered > 0, alpha, np.float32(1.0))
+        if tile.ndim == 3:
+            a = a[..., None]
+        canvas[...] = (canvas * (1.0 - a) + tile * a + 0.5).astype(np.uint8)
+        covered[...] = 1
+        self._update_pyramid(cx0, cy0, cx1, cy1)
+
+    def _update_pyramid(self, x0, y0, x1, y1):
+        """Rebuild the touched rectangle on every coarser level."""
+        for level in range(1, len(self.levels)):
+            x0, y0 = x0 // 2 * 2, y0 // 2 * 2
+            src = self.levels[level - 1]
+            x1, y1 = min(src.shape[1], x1 + (x1 & 1)), min(src.shape[0], y1 + (y1 & 1))
+            dst = self.levels[level]
+            dx0, dy0 = x0 // 2, y0 // 2
+            dx1, dy1 = min(dst.shape[1], (x1 + 1) // 2), min(dst.shape[0], (y1 + 1) // 2)
+            region = np.asarray(src[y0:y1, x0:x1])
+            dst[dy0:dy1, dx0:dx1] = cv2.resize(region, (dx1 - dx0, dy1 - dy0), interpolation=cv2.INTER_AREA)
+            x0, y0, x1, y1 = dx0, dy0, dx1, dy1
\ No newline at end of file
@@ -0,0 +1,259 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from camera_stream import POLICY_DROP_OLDEST
+from metrics import METRICS
+
+MODE_RAW = 'raw'      # memory-mapped chunk files, no encoding
+MODE_VIDEO = 'video'  # compressed video via an ffmpeg process
+
+# Sidecar index record: 32 bytes per frame
+INDEX_DTYPE = np.dtype([('frame', '<u8'), ('t', '<f8'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('pad', '<u4')])
+
+
+def load_index(path):
+    """Read a recording's sidecar index as a structured numpy array."""
+    return np.fromfile(os.path.join(path, "index.bin"), dtype=INDEX_DTYPE)
+
+
+def load_raw_frames(path):
+    """Yield (index record, frame) pairs of a raw recording without loading it whole."""
+    with open(os.path.join(path, "recording.json"), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    index = load_index(path)
+    shape = tuple(meta['shape'])
+    per_chunk = meta['chunk_frames']
+    frames = None
+    for i, record in enumerate(index):
+        chunk, slot = divmod(i, per_chunk)
+        if slot == 0 or frames is None:
+            data = np.memmap(os.path.join(path, f"frames_{chunk:05d}.raw"), dtype=np.uint8, mode='r')
+            frames = data.reshape((-1,) + shape)
+        yield record, frames[slot]
+
+
+class Recorder:
+    """Record camera frames tagged with time and stage position.
+
+    Frames come from a drop-oldest subscription on the CameraStream, so a
+    slow disk or encoder never stalls capture or preview: once `queue_depth`
+    frames are waiting the oldest is dropped and counted.
+
+    Every frame is tagged with the last position reported at or before its
+    capture time (the machine state only reports changes), written with
+    the frame number and wall clock time to `index.bin` (see INDEX_DTYPE).
+
+    MODE_RAW copies frames into preallocated memory-mapped chunk files of
+    `chunk_frames` frames each. MODE_VIDEO pipes frames into an ffmpeg
+    process for encoding, so compression never runs in this process.
+    """
+
+    def __init__(self, camera, path, controller=None, mode=MODE_RAW, chunk_frames=256,
+                 queue_depth=32, fps=30, ffmpeg_path="ffmpeg", codec_args=None):
+        if mode not in (MODE_RAW, MODE_VIDEO):
+            raise ValueError(f"Unknown recording mode: {mode}")
+        self.camera = camera
+        self.path = path
+        self.controller = controller
+        self.mode = mode
+        self.chunk_frames = chunk_frames
+        self.queue_depth = queue_depth
+        self.fps = fps
+        self.ffmpeg_path = ffmpeg_path
+        self.codec_args = codec_args or ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p']
+
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.error = None
+        self._frames = None
+        self._thread = None
+        self._running = False
+        self._started = 0.0
+        self._stopped = 0.0
+
+        # Recent (perf_counter time, x, y, z) samples from status reports
+        self._positions = np.zeros((256, 4), np.float64)
+        self._position_count = 0
+        self._position_lock = threading.Lock()
+
+        self._chunk = None
+        self._chunk_index = -1
+        self._shape = None
+        self._encoder = None
+        self._index_file = None
+        self._record = np.zeros(1, INDEX_DTYPE)
+        self._write_time = METRICS.histogram('recorder_write_seconds', help="Time to write one frame and its index record")
+        # Offset that turns perf_counter timestamps into wall-clock time
+        self._clock_offset = time.time() - time.perf_counter()
+
+    @property
+    def dropped(self):
+        return self._frames.dropped if self._frames is not None else 0
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._index_file = open(os.path.join(self.path, "index.bin"), 'wb')
+        if self.controller is not None:
+            self.controller.state.subscribe(self._on_state)
+            self._on_state(self.controller.state)
+        self._frames = self.camera.subscribe('recorder', POLICY_DROP_OLDEST, depth=self.queue_depth)
+        self._running = True
+        self._started = time.perf_counter()
+        METRICS.add_collector(('recorder', id(self)), self._collect_metrics)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop recording, write out queued frames and close all files."""
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._stopped = time.perf_counter()
+        METRICS.remove_collector(('recorder', id(self)))
+        if self.controller is not None:
+            self.controller.state.unsubscribe(self._on_state)
+        if self._frames is not None:
+            self._frames.close()
+        self._close_chunk()
+        if self._encoder is not None:
+            self._encoder.stdin.close()
+            self._encoder.wait()
+            self._encoder = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._write_metadata()
+
+    def stats(self):
+        end = self._stopped if not self._running and self._stopped else time.perf_counter()
+        elapsed = max(1e-9, end - self._started)
+        return {
+            'frames_written': self.frames_written,
+            'frames_dropped': self.dropped,
+            'bytes_written': self.bytes_written,
+            'elapsed_s': elapsed,
+            'fps': self.frames_written / elapsed,
+            'mb_per_s': self.bytes_written / elapsed / 1e6,
+        }
+
+    def _collect_metrics(self):
+        labels = {'path': self.path}
+        yield 'recorder_frames_written_total', labels, self.frames_written
+        yield 'recorder_frames_dropped_total', labels, self.dropped
+        yield 'recorder_bytes_written_total', labels, self.bytes_written
+        yield 'recorder_mb_per_s', labels, self.stats()['mb_per_s']
+
+    # --- Position tagging ---
+
+    def _on_state(self, state):
+        x, y, z = state.position
+        with self._position_lock:
+            row = self._positions[self._position_count % len(self._positions)]
+            row[0], row[1], row[2], row[3] = time.perf_counter(), x, y, z
+            self._position_count += 1
+
+    def _position_at(self, t):
+        with self._position_lock:
+            count, size = self._position_count, len(self._positions)
+            if count == 0:
+                return 0.0, 0.0, 0.0
+            if count <= size:
+                samples = self._positions[:count].copy()
+            else:
+                start = count % size  # oldest sample in the ring
+                samples = np.concatenate((self._positions[start:], self._positions[:start]))
+        # Samples only arrive when the position changes: the last one at or before t still holds
+        i = max(0, int(np.searchsorted(samples[:, 0], t, side='right')) - 1)
+        return float(samples[i, 1]), float(samples[i, 2]), float(samples[i, 3])
+
+    # --- Writing ---
+
+    def _run(self):
+        while self._running or self._frames.pending():
+            frame = self._frames.get(timeout=0.1)
+            if frame is None:
+                continue
+            try:
+                with frame:
+                    if METRICS.enabled:
+                        t0 = time.perf_counter()
+                        self._write_frame(frame)
+                        self._write_time.observe(time.perf_counter() - t0)
+                    else:
+                        self._write_frame(frame)
+            except Exception as e:
+                self.error = str(e)
+                self._running = False
+                break
+
+    def _write_frame(self, frame):
+        image = frame.image
+        if self._shape is None:
+            self._shape = image.shape
+        elif image.shape != self._shape:
+            raise ValueError(f"Frame size changed from {self._shape} to {image.shape}.")
+
+        if self.mode == MODE_RAW:
+            slot = self.frames_written % self.chunk_frames
+            if slot == 0:
+                self._open_chunk(self.frames_written // self.chunk_frames)
+            np.copyto(self._chunk[slot], image)
+        else:
+            if self._encoder is None:
+                self._encoder = self._start_encoder(image)
+            self._encoder.stdin.write(np.ascontiguousarray(image).data)
+
+        x, y, z = self._position_at(frame.timestamp)
+        record = self._record[0]
+        record['frame'] = frame.index
+        record['t'] = frame.timestamp + self._clock_offset
+        record['x'], record['y'], record['z'] = x, y, z
+        self._index_file.write(self._record.tobytes())
+        self.frames_written += 1
+        self.bytes_written += image.nbytes
+
+    def _open_chunk(self, index):
+        self._close_chunk()
+        self._chunk_index = index
+        self._chunk = np.memmap(os.path.join(self.path, f"frames_{index:05d}.raw"), dtype=np.uint8,
+                                mode='w+', shape=(self.chunk_frames,) + self._shape)
+
+    def _close_chunk(self):
+        if self._chunk is None:
+            return
+        self._chunk.flush()
+        used = self.frames_written - self._chunk_index * self.chunk_frames
+        filename = self._chunk.filename
+        del self._chunk
+        self._chunk = None
+        if 0 < used < self.chunk_frames:
+            # Trim the preallocated tail of the last chunk
+            with open(filename, 'r+b') as f:
+                f.truncate(used * int(np.prod(self._shape)))
+
+    def _start_encoder(self, image):
+        h, w = image.shape[:2]
+        pix_fmt = 'bgr24' if image.ndim == 3 else 'gray'
+        cmd = [self.ffmpeg_path, '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f"{w}x{h}", '-r', str(self.fps), '-i', '-',
+               *self.codec_args, os.path.join(self.path, "video.mp4")]
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def _write_metadata(self):
+        meta = {
+            'mode': self.mode,
+            'shape': list(self._shape) if self._shape else None,
+            'dtype': 'uint8',
+            'chunk_frames': self.chunk_frames,
+            'index_dtype': INDEX_DTYPE.descr,
+            'stats': self.stats(),
+            'error': self.error,
+        }
+        with open(os.path.join(self.path, "recording.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
\ No newline at end of file
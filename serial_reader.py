@@ -0,0 +1,124 @@
+import queue
+import threading
+
+import serial
+
+
+class SerialReader:
+    """The only consumer of a CNC serial port.
+
+    A background thread blocks on incoming bytes, splits them into lines in
+    a reusable buffer and routes every line by kind:
+
+    - 'ack':     `ok` / `error:N` replies, handed to the pending command
+    - 'status':  real-time status reports (`<Idle|MPos:...>`)
+    - 'message': everything else (startup banner, ALARM, [MSG:...], echo)
+
+    Listeners registered with subscribe() are called on the reader thread
+    and must return quickly.
+    """
+
+    KINDS = ('ack', 'status', 'message')
+
+    def __init__(self):
+        self.ser = None
+        self.acks = queue.Queue()
+        self._listeners = {kind: [] for kind in self.KINDS}
+        self._buffer = bytearray()
+        self._thread = None
+        self._running = False
+
+    def subscribe(self, kind, callback):
+        """Call callback(line) for every line of the given kind."""
+        self._listeners[kind].append(callback)
+
+    def unsubscribe(self, kind, callback):
+        if callback in self._listeners[kind]:
+            self._listeners[kind].remove(callback)
+
+    def start(self, ser):
+        """Start reading from an open serial port."""
+        self.stop()
+        self.ser = ser
+        self._buffer.clear()
+        self.clear_acks()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"serial-reader-{ser.port}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread; the port itself stays open."""
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            cancel_read = getattr(self.ser, 'cancel_read', None)
+            if cancel_read:
+                cancel_read()
+            if threading.current_thread() is not self._thread:
+                self._thread.join()
+        self._thread = None
+
+    def wait_ack(self, timeout=None):
+        """Return the next `ok`/`error` reply, or None after timeout seconds or interrupt()."""
+        try:
+            return self.acks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def interrupt(self):
+        """Wake a wait_ack() in progress, which then returns None."""
+        self.acks.put(None)
+
+    def clear_acks(self):
+        """Drop replies nobody is waiting for (e.g. late replies after a timeout)."""
+        while True:
+            try:
+                self.acks.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self):
+        ser = self.ser
+        while self._running and ser.is_open:
+            try:
+                # Block for the first byte, then take whatever else has arrived
+                data = ser.read(1)
+                if data and ser.in_waiting:
+                    data += ser.read(ser.in_waiting)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._running:
+                    self._dispatch('message', f"Serial read error: {e}")
+                break
+            if data:
+                self.feed(data)
+
+    def feed(self, data):
+        """Append raw bytes and dispatch every complete line."""
+        buf = self._buffer
+        buf += data
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+            line = buf[start:end].strip()
+            start = end + 1
+            if line:
+                self._route(line.decode('utf-8', errors='ignore'))
+        if start:
+            del buf[:start]
+
+    def _route(self, line):
+        if line == 'ok' or line.startswith('ok ') or line.startswith('error'):
+            self.acks.put(line)
+            self._dispatch('ack', line)
+        elif line.startswith('<'):
+            self._dispatch('status', line)
+        else:
+            self._dispatch('message', line)
+
+    def _dispatch(self, kind, line):
+        for callback in self._listeners[kind]:
+            try:
+                callback(line)
+            except Exception as e:
+                print(f"Serial listener error: {e}")
\ No newline at end of file
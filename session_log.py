@@ -0,0 +1,228 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# Entry directions
+DIR_TX = 'tx'         # line written to the controller
+DIR_RX = 'rx'         # ok/error reply, with the line it answers and the round trip
+DIR_RT = 'rt'         # real-time command (feed hold, jog cancel, ...)
+DIR_MESSAGE = 'msg'   # unsolicited controller output (banner, [MSG:], ALARM)
+DIR_STATUS = 'st'     # status report, only if log_status=True
+DIR_EVENT = 'ev'      # application event (connected, recording started, ...)
+
+SessionEntry = namedtuple('SessionEntry', 't dir text command latency')
+
+FLUSH_INTERVAL = 0.5
+
+
+class SessionLog:
+    """Structured log of controller traffic, one compact JSON object per line.
+
+        {"t": 1718000000.123456, "d": "tx", "m": "G1 X10 F3000"}
+        {"t": 1718000000.125001, "d": "rx", "m": "ok", "c": "G1 X10 F3000", "l": 0.001545}
+
+    Callers only timestamp the entry and put it on a queue; a background
+    thread serialises and writes whatever has accumulated, flushing every
+    FLUSH_INTERVAL seconds, so logging never waits on the disk. The first
+    line is a header with the start time and the controller port.
+    """
+
+    def __init__(self, path, log_status=False):
+        self.path = path
+        self.log_status = log_status
+        self.entries = 0
+        self.error = None
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._controllers = []
+
+    def start(self, **header):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(dict(session=time.time(), version=1, **header)) + "\n")
+        self._thread = threading.Thread(target=self._run, name="session-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        for controller in list(self._controllers):
+            self.detach(controller)
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Sources ---
+
+    def attach(self, controller):
+        """Log a CNCController's commands, replies and messages."""
+        controller.session_log = self
+        controller.reader.subscribe('message', self.message)
+        if self.log_status:
+            controller.reader.subscribe('status', self.status)
+        self._controllers.append(controller)
+        self.event(f"attached {controller.port}")
+
+    def detach(self, controller):
+        if controller in self._controllers:
+            self._controllers.remove(controller)
+            controller.session_log = None
+            controller.reader.unsubscribe('message', self.message)
+            controller.reader.unsubscribe('status', self.status)
+
+    def sent(self, line):
+        self._queue.put((time.time(), DIR_TX, line, None, None))
+
+    def received(self, reply, line, latency=None):
+        self._queue.put((time.time(), DIR_RX, reply, line, latency))
+
+    def realtime(self, name):
+        self._queue.put((time.time(), DIR_RT, name, None, None))
+
+    def message(self, line):
+        self._queue.put((time.time(), DIR_MESSAGE, line, None, None))
+
+    def status(self, line):
+        self._queue.put((time.time(), DIR_STATUS, line, None, None))
+
+    def event(self, text):
+        self._queue.put((time.time(), DIR_EVENT, text, None, None))
+
+    # --- Writer ---
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            # Take everything that has accumulated in one go
+            while batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = bool(batch) and batch[-1] is None
+            lines = [_encode(entry) for entry in batch if entry is not None]
+            try:
+                if lines:
+                    self._file.write("".join(lines))
+                    self.entries += len(lines)
+                now = time.monotonic()
+                if done or now - last_flush >= FLUSH_INTERVAL:
+                    self._file.flush()
+                    last_flush = now
+            except OSError as e:
+                if self.error is None:
+                    self.error = str(e)
+                    print(f"Session log error: {e}")
+            if done:
+                return
+
+
+def _encode(entry):
+    t, direction, text, command, latency = entry
+    record = {'t': round(t, 6), 'd': direction, 'm': text}
+    if command is not None:
+        record['c'] = command
+    if latency is not None:
+        record['l'] = round(latency, 6)
+    return json.dumps(record, separators=(',', ':')) + "\n"
+
+
+def read_header(path):
+    """Return the header dict of a session log (empty if there is none)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline()
+    return json.loads(first) if first.strip() else {}
+
+
+def read_session(path):
+    """Return (header dict, iterator of SessionEntry) for a session log."""
+    f = open(path, 'r', encoding='utf-8')
+    first = f.readline()
+    header = json.loads(first) if first.strip() else {}
+
+    def entries():
+        with f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a crashed session
+                yield SessionEntry(r['t'], r['d'], r['m'], r.get('c'), r.get('l'))
+
+    return header, entries()
+
+
+def replay_session(path, speed=1.0, on_entry=None, controller=None, directions=None):
+    """Replay a session log with its original timing divided by `speed`.
+
+    Without a controller the entries are passed to on_entry(entry) (or
+    printed), e.g. to review a run. With a controller, the commands and
+    real-time commands that were sent are sent again in order; the logged
+    replies are not waited for, the controller's own flow control is.
+    speed=0 replays as fast as possible, streaming runs of commands with
+    character counting. Returns the number of entries replayed.
+    """
+    from cnc_control import REALTIME_COMMANDS
+
+    _, entries = read_session(path)
+    on_entry = on_entry or (lambda e: print(format_entry(e)))
+    batch = []  # commands waiting to be streamed when speed=0
+
+    def send(entry):
+        if controller is None:
+            return
+        if entry.dir == DIR_TX:
+            if speed:
+                controller.send_command(entry.text)
+            else:
+                batch.append(entry.text)
+        elif entry.dir == DIR_RT and entry.text in REALTIME_COMMANDS:
+            if batch:
+                controller.stream(batch)
+                batch.clear()
+            controller.realtime(entry.text)
+
+    start = time.monotonic()
+    first = None
+    count = 0
+    for entry in entries:
+        if directions and entry.dir not in directions:
+            continue
+        if first is None:
+            first = entry.t
+        if speed:
+            delay = (entry.t - first) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        send(entry)
+        on_entry(entry)
+        count += 1
+    if batch:
+        controller.stream(batch)
+    return count
+
+
+def format_entry(entry):
+    stamp = time.strftime("%H:%M:%S", time.localtime(entry.t)) + f".{int(entry.t % 1 * 1000):03d}"
+    text = f"{stamp} {entry.dir:<3} {entry.text}"
+    if entry.command is not None:
+        text += f"  <- {entry.command}"
+    if entry.latency is not None:
+        text += f"  ({1000 * entry.latency:.1f} ms)"
+    return text
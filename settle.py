@@ -0,0 +1,147 @@
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from camera_stream import POLICY_LATEST
+
+SettleResult = namedtuple('SettleResult', 'stable timestamp elapsed frame')
+
+METRIC_DIFFERENCE = 'difference'  # mean absolute frame difference, grey levels
+METRIC_SHARPNESS = 'sharpness'    # relative change of the Laplacian variance
+
+
+class SettleDetector:
+    """Decide from the camera image when the stage has stopped vibrating.
+
+    Every frame is reduced to a small greyscale copy of the ROI (at most
+    `size` pixels wide) in preallocated buffers, and consecutive frames are
+    compared with a cheap vectorized metric. The stage counts as stable once
+    `consecutive` comparisons in a row stay below `threshold`.
+    """
+
+    def __init__(self, camera, roi=None, size=128, metric=METRIC_DIFFERENCE,
+                 threshold=None, consecutive=3):
+        if metric not in (METRIC_DIFFERENCE, METRIC_SHARPNESS):
+            raise ValueError(f"Unknown settle metric: {metric}")
+        self.camera = camera
+        self.roi = roi  # (x, y, w, h) in full-resolution pixels, None = whole frame
+        self.size = size
+        self.metric = metric
+        if threshold is None:
+            threshold = 1.5 if metric == METRIC_DIFFERENCE else 0.05
+        self.threshold = threshold
+        self.consecutive = consecutive
+        self._frames = None
+        self._small = None
+        self._gray = [None, None]  # current / previous reduced frame
+        self._diff = None
+        self.last_value = None
+
+    def open(self):
+        if self._frames is None:
+            self._frames = self.camera.subscribe('settle', POLICY_LATEST)
+
+    def close(self):
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+
+    def wait_stable(self, after=None, timeout=2.0, keep_frame=False):
+        """Block until the image is stable or timeout seconds passed.
+
+        Only frames captured at or after `after` (time.perf_counter()) are
+        considered. With keep_frame the last examined Frame is returned in
+        the result and must be released by the caller.
+        """
+        self.open()
+        start = time.perf_counter()
+        after = start if after is None else after
+        deadline = start + timeout
+        previous_value = None
+        have_previous = False
+        calm = 0
+        last = None
+        try:
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                frame = self._frames.get(timeout=remaining)
+                if frame is None:
+                    break
+                if frame.timestamp < after:
+                    frame.release()
+                    continue
+                if last is not None:
+                    last.release()
+                last = frame
+
+                value = self._measure(frame.image, have_previous)
+                have_previous = True
+                if value is None:
+                    continue
+                if self.metric == METRIC_SHARPNESS:
+                    if previous_value is None:
+                        previous_value = value
+                        continue
+                    change = abs(value - previous_value) / max(previous_value, 1e-6)
+                    previous_value = value
+                    value = change
+                self.last_value = value
+
+                calm = calm + 1 if value < self.threshold else 0
+                if calm >= self.consecutive:
+                    result = SettleResult(True, frame.timestamp, time.perf_counter() - start,
+                                          frame if keep_frame else None)
+                    if keep_frame:
+                        last = None
+                    return result
+            return SettleResult(False, time.perf_counter(), time.perf_counter() - start, None)
+        finally:
+            if last is not None:
+                last.release()
+
+    def _measure(self, image, have_previous):
+        """Difference to the previous frame, or the frame's sharpness."""
+        self._gray.reverse()  # the last reduced frame becomes the previous one
+        current, resized = self._reduce(image)
+        if self.metric == METRIC_SHARPNESS:
+            return float(cv2.Laplacian(current, cv2.CV_32F).var())
+        if not have_previous or resized:
+            return None
+        cv2.absdiff(current, self._gray[1], dst=self._diff)
+        return float(cv2.mean(self._diff)[0])
+
+    def _reduce(self, image):
+        """Shrink the ROI into the preallocated greyscale buffer self._gray[0]."""
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            image = image[y:y + h, x:x + w]
+        h, w = image.shape[:2]
+        scale = min(1.0, self.size / float(w))
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        resized = False
+        if self._small is None or self._small.shape[1::-1] != size or self._small.shape[2:] != image.shape[2:]:
+            self._small = np.empty((size[1], size[0]) + image.shape[2:], dtype=image.dtype)
+            self._gray = [np.empty((size[1], size[0]), dtype=image.dtype) for _ in range(2)]
+            self._diff = np.empty_like(self._gray[0])
+            resized = True
+        cv2.resize(image, size, dst=self._small, interpolation=cv2.INTER_AREA)
+        if self._small.ndim == 3:
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray[0])
+        else:
+            np.copyto(self._gray[0], self._small)
+        return self._gray[0], resized
+
+
+def move_and_settle(controller, detector, cmd, move_timeout=60.0, settle_timeout=2.0):
+    """Send a move, wait for it to finish, then wait for a stable image.
+
+    Returns a SettleResult, or None if the move itself failed.
+    """
+    reply = controller.submit(f"{cmd}\nG4 P0", timeout=move_timeout).result()
+    if reply is None or reply.startswith('error'):
+        return None
+    return detector.wait_stable(after=time.perf_counter(), timeout=settle_timeout)
\ No newline at end of file
@@ -0,0 +1,611 @@
+import math
+import os
+import re
+import select
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+FLAVOR_GRBL = 'grbl'
+FLAVOR_MARLIN = 'marlin'
+
+GRBL_BANNER = "Grbl 1.1h ['$' for help]"
+MARLIN_BANNER = "start\r\necho:Marlin 2.1.2 (simulated)"
+
+_WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+_SUPPORTED_G = {0, 1, 2, 3, 4, 17, 20, 21, 28, 54, 90, 91, 92, 94}
+_REALTIME = {0x3F, 0x21, 0x7E, 0x85, 0x18}  # ? ! ~ jog-cancel reset
+
+
+class _Move:
+    __slots__ = ('target', 'feed', 'jog')
+
+    def __init__(self, target, feed, jog=False):
+        self.target = target
+        self.feed = feed
+        self.jog = jog
+
+
+class SimulatedController:
+    """A GRBL- or Marlin-style controller behind a pseudo-terminal.
+
+    start() returns a device path that CNCController, serial.Serial or
+    the discovery probe can open like a real port. The simulation models
+    what the host can observe:
+
+    - a serial RX buffer of `rx_buffer_size` bytes; bytes beyond it are
+      lost and counted in `rx_overflows`, like on the real firmware
+    - line timing at `baudrate` (10 bits per byte) in both directions
+    - a planner of `planner_blocks` moves: `ok` is sent once a line is
+      planned, so a full planner backs up the RX buffer
+    - motion in real time (scaled by `time_scale`), real-time commands
+      (? ! ~ 0x85 0x18) for GRBL, status reports and `error:N` replies
+    - the startup banner: like an Arduino reset by DTR, the controller
+      reboots `boot_delay` s after the host opens the port (and on 0x18)
+
+    Arcs are executed as straight moves to their end point. With `drift`
+    (mm per axis), every completed move slips the physical stage by that
+    much, like lost steps: status reports keep the commanded position,
+    while physical_position() (what a VirtualCamera sees) drifts away.
+    """
+
+    def __init__(self, flavor=FLAVOR_GRBL, baudrate=115200, rx_buffer_size=128, planner_blocks=15,
+                 time_scale=1.0, max_feed=3000.0, boot_delay=0.1, drift=(0.0, 0.0, 0.0)):
+        self.flavor = flavor
+        self.baudrate = baudrate
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.time_scale = time_scale
+        self.max_feed = max_feed  # mm/min, also used for G0
+        self.boot_delay = boot_delay
+        self.drift = tuple(drift) + (0.0,) * (3 - len(drift))
+        self.port = None
+
+        self._master = None
+        self._connected = False
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._rx = bytearray()
+        self._planner = deque()
+        self._position = [0.0, 0.0, 0.0]
+        self._slip = [0.0, 0.0, 0.0]  # physical minus machine position
+        self._move_from = None  # [start, move, duration, elapsed, resumed_at] while moving
+        self._hold = False
+        self._cancel_jog = False
+        self._reset = False
+        self._absolute = True
+        self._feed = 0.0
+
+        self.lines_received = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.rx_high_water = 0
+        self.rx_overflows = 0
+        self.status_reports = 0
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Create the pseudo-terminal; returns the device path to open."""
+        import tty
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        os.close(slave)  # the master sees a hang-up until a host opens the port
+        self._connected = False
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._receive_loop, name="sim-rx", daemon=True),
+            threading.Thread(target=self._process_loop, name="sim-parser", daemon=True),
+            threading.Thread(target=self._motion_loop, name="sim-motion", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        if self._master is not None:
+            os.close(self._master)
+        self._master = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Observable state ---
+
+    def position(self):
+        """Current machine position (mm), interpolated along the executing move."""
+        with self._lock:
+            return self._current_position()
+
+    def physical_position(self):
+        """Where the stage really is: position() plus the slip accumulated from `drift`."""
+        with self._lock:
+            return [p + s for p, s in zip(self._current_position(), self._slip)]
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._hold:
+                return 'Hold:0'
+            if self._move_from is not None or self._planner:
+                moving = self._move_from[1] if self._move_from else self._planner[0]
+                return 'Jog' if moving.jog else 'Run'
+            return 'Idle'
+
+    def stats(self):
+        return {
+            'lines_received': self.lines_received,
+            'bytes_received': self.bytes_received,
+            'errors': self.errors,
+            'rx_high_water': self.rx_high_water,
+            'rx_overflows': self.rx_overflows,
+            'status_reports': self.status_reports,
+        }
+
+    # --- Serial side ---
+
+    def _byte_time(self, count):
+        return count * 10.0 / self.baudrate
+
+    def _send(self, text):
+        data = (text + '\r\n').encode('ascii')
+        with self._write_lock:
+            if self._master is None or not self._connected:
+                return
+            time.sleep(self._byte_time(len(data)))  # the host sees the bytes once they crossed the wire
+            try:
+                os.write(self._master, data)
+            except OSError:
+                return
+
+    def _receive_loop(self):
+        poller = select.poll()
+        poller.register(self._master, select.POLLIN | select.POLLHUP)
+        while not self._stop.is_set():
+            try:
+                events = poller.poll(20)
+                flags = events[0][1] if events else 0
+                if flags & select.POLLHUP and not flags & select.POLLIN:
+                    self._connected = False  # no host has the port open
+                    time.sleep(0.01)
+                    continue
+                if not self._connected:
+                    self._boot()
+                    continue
+                if not flags & select.POLLIN:
+                    continue
+                data = os.read(self._master, 256)
+            except (OSError, ValueError, TypeError):
+                return
+            time.sleep(self._byte_time(len(data)))  # the wire is not faster than the baud rate
+            self.bytes_received += len(data)
+            for byte in data:
+                if self.flavor == FLAVOR_GRBL and byte in _REALTIME:
+                    self._realtime(byte)
+                    continue
+                with self._lock:
+                    if len(self._rx) >= self.rx_buffer_size:
+                        self.rx_overflows += 1
+                        continue
+                    self._rx.append(byte)
+                    self.rx_high_water = max(self.rx_high_water, len(self._rx))
+                    if byte == 0x0A:
+                        self._lock.notify_all()
+
+    def _boot(self):
+        """A host opened the port: reset (as DTR does on an Arduino) and greet it."""
+        self._connected = True
+        time.sleep(self.boot_delay)  # the host flushes its input right after opening
+        self._soft_reset()
+        self._send(self._banner())
+
+    def _soft_reset(self):
+        with self._lock:
+            self._reset = True
+            self._planner.clear()
+            self._rx.clear()
+            self._hold = False
+            self._lock.notify_all()
+
+    def _realtime(self, byte):
+        if byte == 0x3F:
+            self._send(self._status_report())
+            return
+        with self._lock:
+            if byte == 0x21 and (self._move_from or self._planner):
+                self._hold = True
+            elif byte == 0x7E:
+                self._hold = False
+            elif byte == 0x85:
+                self._cancel_jog = True
+                self._planner = deque(m for m in self._planner if not m.jog)
+            self._lock.notify_all()
+        if byte == 0x18:
+            self._soft_reset()
+            self._send(self._banner())
+
+    def _banner(self):
+        return '\r\n' + (GRBL_BANNER if self.flavor == FLAVOR_GRBL else MARLIN_BANNER)
+
+    def _status_report(self):
+        self.status_reports += 1
+        with self._lock:
+            pos = self._current_position()
+            free_blocks = self.planner_blocks - len(self._planner)
+            free_rx = self.rx_buffer_size - len(self._rx)
+            feed = self._move_from[1].feed if self._move_from else 0.0
+        state = self.state
+        mpos = ','.join(f"{v:.3f}" for v in pos)
+        return f"<{state}|MPos:{mpos}|Bf:{free_blocks},{free_rx}|FS:{feed:.0f},0>"
+
+    # --- Line processing ---
+
+    def _process_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                while b'\n' not in self._rx and not self._stop.is_set():
+                    self._lock.wait(0.1)
+                if self._stop.is_set():
+                    return
+                end = self._rx.index(b'\n')
+                raw = bytes(self._rx[:end])
+                del self._rx[:end + 1]
+                self._reset = False
+            line = raw.decode('ascii', errors='ignore').strip()
+            if not line:
+                continue
+            self.lines_received += 1
+            reply = self._execute(line)
+            if reply is not None and not self._reset:
+                self._send(reply)
+
+    def _execute(self, line):
+        """Run one line; returns the reply text (possibly several lines)."""
+        if len(line) > 80:
+            return self._error(11)
+        if self.flavor == FLAVOR_MARLIN:
+            return self._execute_marlin(line)
+        if line.startswith('$'):
+            return self._execute_system(line)
+        words = self._parse(line)
+        if words is None:
+            return self._error(1)
+        return self._execute_words(words)
+
+    def _execute_system(self, line):
+        command = line[1:].upper()
+        if command.startswith('J='):
+            words = self._parse(command[2:])
+            if words is None or not any(letter in 'XYZ' for letter, _ in words):
+                return self._error(3)
+            if not any(letter == 'F' for letter, _ in words):
+                return self._error(22)
+            return self._execute_words(words, jog=True)
+        if command == '':
+            return "[HLP:$$ $# $G $I $N $x=val $Nx=line $J=line $SLP $C $X $H ~ ! ? ctrl-x]\r\nok"
+        if command == '$':
+            return "$0=10\r\n$1=25\r\n$10=1\r\n$11=0.010\r\n$110=3000.000\r\n$120=500.000\r\nok"
+        if command == 'I':
+            return "[VER:1.1h.20190830:simulated]\r\n[OPT:V,15,128]\r\nok"
+        if command == 'G':
+            mode = 'G90' if self._absolute else 'G91'
+            return f"[GC:G0 G54 G17 G21 {mode} G94 M5 M9 T0 F{self._feed:.0f} S0]\r\nok"
+        if command == 'H':
+            self._plan(_Move([0.0, 0.0, 0.0], self.max_feed))
+            self._wait_idle()
+            return 'ok'
+        if command in ('X', '#', 'N', 'C', 'SLP'):
+            return 'ok'
+        return self._error(3)
+
+    def _execute_marlin(self, line):
+        words = self._parse(line)
+        if words is None:
+            self.errors += 1
+            return f'echo:Unknown command: "{line}"\r\nok'
+        codes = [(letter, value) for letter, value in words if letter in 'GM']
+        if codes and codes[0] == ('M', 114.0):
+            x, y, z = self.position()
+            return f"X:{x:.2f} Y:{y:.2f} Z:{z:.2f} E:0.00 Count X:0 Y:0 Z:0\r\nok"
+        if codes and codes[0] == ('M', 400.0):
+            self._wait_idle()
+            return 'ok'
+        return self._execute_words(words)
+
+    @staticmethod
+    def _parse(line):
+        text = line.upper().split(';', 1)[0].replace(' ', '')
+        words = _WORD.findall(text)
+        if ''.join(letter + value for letter, value in words) != text:
+            return None  # characters that are not part of a word
+        return [(letter, float(value)) for letter, value in words]
+
+    def _execute_words(self, words, jog=False):
+        target = None
+        motion = 'G1' if jog else None
+        dwell = None
+        for letter, value in words:
+            if letter == 'G':
+                code = int(value)
+                if code not in _SUPPORTED_G:
+                    return self._error(20)
+                if code in (0, 1, 2, 3):
+                    motion = f"G{min(code, 1)}"
+                elif code == 4:
+                    dwell = 0.0
+                elif code == 28:
+                    target = [0.0, 0.0, 0.0]
+                    motion = 'G0'
+                elif code == 90 and not jog:
+                    self._absolute = True
+                elif code == 91 and not jog:
+                    self._absolute = False
+            elif letter == 'F':
+                self._feed = value
+            elif letter == 'P' and dwell is not None:
+                dwell = value
+
+        if dwell is not None:
+            self._wait_idle()  # G4 synchronises with motion, like protocol_buffer_synchronize
+            if dwell > 0:
+                time.sleep(dwell * self.time_scale)
+            return 'ok'
+
+        axes = {letter: value for letter, value in words if letter in 'XYZ'}
+        if axes:
+            relative = (not self._absolute) if not jog else any(
+                letter == 'G' and value == 91.0 for letter, value in words)
+            with self._lock:
+                base = self._planned_end()
+            target = list(base)
+            for i, axis in enumerate('XYZ'):
+                if axis in axes:
+                    target[i] = base[i] + axes[axis] if relative else axes[axis]
+            if motion is None:
+                motion = 'G1'
+        if target is not None:
+            feed = self.max_feed if motion == 'G0' else min(self._feed or 0.0, self.max_feed)
+            if feed <= 0:
+                return self._error(22)
+            self._plan(_Move(target, feed, jog=jog))
+        return 'ok'
+
+    def _error(self, code):
+        self.errors += 1
+        return f"error:{code}"
+
+    # --- Planner and motion ---
+
+    def _planned_end(self):
+        if self._planner:
+            return list(self._planner[-1].target)
+        if self._move_from is not None:
+            return list(self._move_from[1].target)
+        return list(self._position)
+
+    def _plan(self, move):
+        with self._lock:
+            while len(self._planner) >= self.planner_blocks and not self._stop.is_set() and not self._reset:
+                self._lock.wait(0.05)
+            if not self._reset:
+                self._planner.append(move)
+                self._lock.notify_all()
+
+    def _wait_idle(self):
+        with self._lock:
+            while (self._planner or self._move_from is not None) and not self._stop.is_set() \
+                    and not self._reset:
+                self._lock.wait(0.05)
+
+    def _current_position(self):
+        if self._move_from is None:
+            return list(self._position)
+        start, move, duration, elapsed, resumed_at = self._move_from
+        if resumed_at is not None:
+            elapsed += time.perf_counter() - resumed_at
+        t = min(1.0, elapsed / duration) if duration > 0 else 1.0
+        return [a + (b - a) * t for a, b in zip(start, move.target)]
+
+    def _motion_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                while not self._planner and not self._stop.is_set():
+                    self._lock.wait(0.1)
+                if self._stop.is_set():
+                    return
+                move = self._planner.popleft()
+                start = list(self._position)
+                distance = math.dist(start, move.target)
+                duration = distance / (move.feed / 60.0) * self.time_scale if move.feed else 0.0
+                self._move_from = [start, move, duration, 0.0, time.perf_counter()]
+                self._cancel_jog = False
+                self._lock.notify_all()
+
+                while not self._stop.is_set():
+                    state = self._move_from
+                    if self._reset or (move.jog and self._cancel_jog):
+                        self._position = self._current_position()
+                        break
+                    if self._hold and state[4] is not None:
+                        state[3] += time.perf_counter() - state[4]
+                        state[4] = None
+                    elif not self._hold and state[4] is None:
+                        state[4] = time.perf_counter()
+                    elapsed = state[3] + (time.perf_counter() - state[4] if state[4] is not None else 0.0)
+                    if elapsed >= duration:
+                        self._position = list(move.target)
+                        if distance > 0:
+                            self._slip = [s + d for s, d in zip(self._slip, self.drift)]
+                        break
+                    self._lock.wait(min(0.005, max(duration - elapsed, 0.0)) if not self._hold else 0.05)
+                self._move_from = None
+                self._lock.notify_all()
+
+
+class VirtualCamera:
+    """A cv2.VideoCapture stand-in that replays a video or renders a test pattern.
+
+    With `source` (a video path) frames are read from the file, looped
+    and resized to width x height. Otherwise a pattern is rendered:
+
+    - with a `stage` (e.g. a SimulatedController), a fixed random texture
+      seen through a window that follows the stage XY position at
+      `mm_per_px`, blurred in proportion to the distance from `focus_z`,
+      so settle detection, autofocus and stitching see real motion
+    - without one, a cheap gradient that shifts every frame
+
+    Frames are paced to `fps` (0 = as fast as possible). read(image=...)
+    fills the given buffer in place, as CameraStream expects.
+    """
+
+    def __init__(self, width=1280, height=720, fps=30.0, source=None, stage=None,
+                 mm_per_px=0.002, focus_z=0.0, blur_per_mm=40.0, seed=0):
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = float(fps)
+        self.source = source
+        self.stage = stage
+        self.mm_per_px = mm_per_px
+        self.focus_z = focus_z
+        self.blur_per_mm = blur_per_mm
+        self.frames_read = 0
+        self._seed = seed
+        self._opened = True
+        self._video = None
+        self._texture = None
+        self._gradient = None
+        self._next = None
+        if source is not None:
+            import cv2
+            self._video = cv2.VideoCapture(source)
+            self._opened = self._video.isOpened()
+
+    # --- cv2.VideoCapture interface ---
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self, image=None):
+        if not self._opened:
+            return False, None
+        self._pace()
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), np.uint8)
+        if self._video is not None:
+            ok = self._read_video(image)
+        elif self.stage is not None:
+            ok = self._render_stage(image)
+        else:
+            ok = self._render_gradient(image)
+        if ok:
+            self.frames_read += 1
+        return ok, image if ok else None
+
+    def grab(self):
+        return self._opened
+
+    def retrieve(self, image=None):
+        return self.read(image)
+
+    def set(self, prop, value):
+        import cv2
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        elif prop == cv2.CAP_PROP_FPS:
+            self.fps = float(value)
+        else:
+            return False
+        self._texture = self._gradient = None
+        return True
+
+    def get(self, prop):
+        import cv2
+        return {cv2.CAP_PROP_FRAME_WIDTH: float(self.width),
+                cv2.CAP_PROP_FRAME_HEIGHT: float(self.height),
+                cv2.CAP_PROP_FPS: self.fps}.get(prop, 0.0)
+
+    def release(self):
+        self._opened = False
+        if self._video is not None:
+            self._video.release()
+
+    # --- Frame sources ---
+
+    def _pace(self):
+        if not self.fps:
+            return
+        now = time.perf_counter()
+        if self._next is None or self._next < now - 1.0:
+            self._next = now  # first frame, or far behind: do not burst to catch up
+        delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next += 1.0 / self.fps
+
+    def _read_video(self, image):
+        import cv2
+        ok, frame = self._video.read()
+        if not ok:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._video.read()
+            if not ok:
+                return False
+        if frame.shape[:2] != (self.height, self.width):
+            cv2.resize(frame, (self.width, self.height), dst=image, interpolation=cv2.INTER_LINEAR)
+        else:
+            np.copyto(image, frame)
+        return True
+
+    def _render_gradient(self, image):
+        if self._gradient is None:
+            self._gradient = np.tile(np.arange(self.width, dtype=np.uint8), (self.height, 1))
+        np.add(self._gradient, self.frames_read & 0xFF, out=image[..., 0], casting='unsafe')
+        image[..., 1] = image[..., 0]
+        image[..., 2] = image[..., 0]
+        return True
+
+    def _render_stage(self, image):
+        import cv2
+        if self._texture is None:
+            self._texture = self._make_texture()
+        th, tw = self._texture.shape[0] // 2, self._texture.shape[1] // 2
+        position = getattr(self.stage, 'physical_position', self.stage.position)
+        x, y, z = position()
+        # Image x follows stage +X, image rows grow with stage -Y
+        ox = int(round(x / self.mm_per_px)) % tw
+        oy = int(round(-y / self.mm_per_px)) % th
+        view = self._texture[oy:oy + self.height, ox:ox + self.width]
+        sigma = abs(z - self.focus_z) * self.blur_per_mm
+        if sigma > 0.3:
+            cv2.GaussianBlur(view, (0, 0), sigma, dst=image)
+        else:
+            np.copyto(image, view)
+        return True
+
+    def _make_texture(self):
+        """A periodic, sharp, non-repeating-looking texture twice the frame size."""
+        import cv2
+        rng = np.random.default_rng(self._seed)
+        th, tw = max(self.height, 256), max(self.width, 256)
+        small = rng.integers(0, 256, (th // 8, tw // 8, 3), dtype=np.uint8)
+        texture = cv2.resize(small, (tw, th), interpolation=cv2.INTER_CUBIC)
+        detail = rng.integers(0, 64, (th, tw, 1), dtype=np.uint8)
+        texture = cv2.add(texture, np.repeat(detail, 3, axis=2))
+        # Tile 2x2 so any frame-sized window at a wrapped offset is one slice
+        return np.tile(texture, (2, 2, 1))
@@ -0,0 +1,343 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from camera_stream import CameraStream
+from cnc_control import CNCController
+
+STATE_OFFLINE = 'offline'
+STATE_CONNECTING = 'connecting'
+STATE_READY = 'ready'
+STATE_BUSY = 'busy'
+STATE_FAULT = 'fault'
+
+STATUS_POLL_HZ = 5
+STATUS_STALE_S = 3.0   # no status report for this long: controller unresponsive
+CAMERA_STALE_S = 3.0   # no new frame for this long: camera stalled
+JOB_POLL_S = 0.2
+
+
+class Station:
+    """One CNC controller and camera pair.
+
+    Each part keeps its own I/O threads (command queue, serial reader,
+    status poller, capture thread), so nothing a station does can block
+    another. Either part is optional. `camera` is an index or any
+    cv2.VideoCapture-like object.
+    """
+
+    def __init__(self, name, port=None, camera=None, baudrate=115200, width=None, height=None):
+        self.name = name
+        self.port = port
+        self.camera_source = camera
+        self.baudrate = baudrate
+        self.width = width
+        self.height = height
+        self.controller = None
+        self.camera = None
+        self.state = STATE_OFFLINE
+        self.error = None
+        self.job = None              # description of the running job
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self._jobs = queue.Queue()   # jobs pinned to this station
+        self._frames_seen = (0, 0.0)
+        self._on_change = None
+
+    def open(self):
+        """Connect controller and camera; returns True if the station is ready."""
+        self._set_state(STATE_CONNECTING)
+        try:
+            if self.port is not None:
+                self.controller = CNCController(self.port, baudrate=self.baudrate)
+                self.controller.connect()
+                if not (self.controller.ser and self.controller.ser.is_open):
+                    raise ConnectionError(f"Could not open CNC port {self.port}.")
+                self.controller.start_status_polling(STATUS_POLL_HZ)
+            if self.camera_source is not None:
+                if isinstance(self.camera_source, int):
+                    self.camera = CameraStream(self.camera_source, self.width, self.height)
+                else:
+                    self.camera = CameraStream(width=self.width, height=self.height, capture=self.camera_source)
+                if not self.camera.start():
+                    raise ConnectionError(self.camera.error)
+                self._frames_seen = (self.camera.frames_captured, time.monotonic())
+        except Exception as e:
+            self.fault(str(e))
+            return False
+        self.error = None
+        self._set_state(STATE_READY)
+        return True
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera = None
+        if self.controller is not None:
+            self.controller.disconnect()
+            self.controller = None
+
+    def fault(self, reason):
+        """Take the station out of service; a running job is interrupted."""
+        print(f"Station {self.name} fault: {reason}")
+        self.error = reason
+        self._set_state(STATE_FAULT)
+        # Disconnecting wakes a job waiting on a reply, so this returns promptly
+        self.close()
+
+    def check(self):
+        """Describe what is wrong with a running station, or return None."""
+        if self.controller is not None:
+            ser = self.controller.ser
+            if not (ser and ser.is_open):
+                return "serial port closed"
+            if not self.controller.reader._thread or not self.controller.reader._thread.is_alive():
+                return "serial reader stopped"
+            updated = self.controller.state.updated
+            if self.controller.is_polling() and updated and time.monotonic() - updated > STATUS_STALE_S:
+                return f"no status report for {time.monotonic() - updated:.1f} s"
+        if self.camera is not None:
+            count, since = self._frames_seen
+            now = time.monotonic()
+            if self.camera.frames_captured != count:
+                self._frames_seen = (self.camera.frames_captured, now)
+            elif now - since > CAMERA_STALE_S:
+                return f"no camera frame for {now - since:.1f} s"
+        return None
+
+    def stats(self):
+        stats = {
+            'name': self.name,
+            'state': self.state,
+            'error': self.error,
+            'job': self.job,
+            'jobs_done': self.jobs_done,
+            'jobs_failed': self.jobs_failed,
+            'jobs_pinned': self._jobs.qsize(),
+        }
+        if self.controller is not None:
+            stats['machine'] = self.controller.state.snapshot()
+        if self.camera is not None:
+            stats['fps'] = self.camera.fps
+        return stats
+
+    def _set_state(self, state):
+        self.state = state
+        if self._on_change:
+            self._on_change(self)
+
+
+class StationManager:
+    """Run several stations from one process.
+
+    Stations are opened in parallel and each gets a job thread. A job is a
+    callable `fn(station)`; it is either pinned to one station or put on a
+    shared queue that the next ready station takes from. `pool` is a
+    thread pool shared by all stations for saving and analysis.
+
+    A monitor checks every station each `health_interval` seconds, and
+    before and after every job. A failing station is faulted and closed,
+    interrupting its job, while the others keep running; a shared job that
+    failed that way is retried on another station (scans resume from their
+    manifest). reconnect() brings a faulted station back.
+
+    on_change(station) is called from worker threads whenever a station's
+    state changes.
+    """
+
+    def __init__(self, stations=(), workers=4, health_interval=1.0, on_change=None):
+        self.stations = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="station-pool")
+        self.health_interval = health_interval
+        self.on_change = on_change
+        self.running = False
+        self._shared = queue.Queue()
+        self._threads = []
+        self._stop = threading.Event()
+        for station in stations:
+            self.add(station)
+
+    @classmethod
+    def from_config(cls, path, **kwargs):
+        """Build from a JSON list of {"name", "port", "camera", "baudrate", "width", "height"}."""
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        return cls([Station(**entry) for entry in entries], **kwargs)
+
+    def add(self, station):
+        if station.name in self.stations:
+            raise ValueError(f"Duplicate station name: {station.name}")
+        station._on_change = self._changed
+        self.stations[station.name] = station
+        if self.running:
+            self._start_station(station)
+
+    def start(self):
+        """Open all stations in parallel and start their job threads."""
+        if self.running:
+            return
+        self.running = True
+        self._stop.clear()
+        for station in self.stations.values():
+            self._start_station(station)
+        monitor = threading.Thread(target=self._monitor, name="station-monitor", daemon=True)
+        monitor.start()
+        self._threads.append(monitor)
+
+    def stop(self):
+        """Stop all stations; queued jobs are cancelled."""
+        self.running = False
+        self._stop.set()
+        for station in self.stations.values():
+            if station.controller is not None:
+                station.controller.feed_hold()
+        self._cancel(self._shared)
+        for station in self.stations.values():
+            self._cancel(station._jobs)
+            # Interrupts running jobs; their threads then see _stop
+            station.close()
+            station._set_state(STATE_OFFLINE)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reconnect(self, name):
+        """Re-open a faulted station in the background."""
+        station = self.stations[name]
+        if station.state in (STATE_FAULT, STATE_OFFLINE):
+            threading.Thread(target=station.open, name=f"station-open-{name}", daemon=True).start()
+
+    # --- Jobs ---
+
+    def submit(self, fn, station=None, description=None):
+        """Run fn(station) on the named station, or on the next free one; returns a Future."""
+        future = Future()
+        job = (future, fn, description or getattr(fn, '__name__', 'job'))
+        if station is None:
+            self._shared.put(job)
+        elif station not in self.stations:
+            future.set_exception(KeyError(f"Unknown station: {station}"))
+        else:
+            self.stations[station]._jobs.put(job)
+        return future
+
+    def submit_scan(self, plan, output_dir, station=None, **kwargs):
+        """Queue a tile_scan.ScanPlan; the Future resolves to TileScanner.stats()."""
+        from tile_scan import TileScanner
+
+        def scan(st):
+            if st.controller is None or st.camera is None:
+                raise RuntimeError(f"Station {st.name} has no controller or camera.")
+            return TileScanner(st.controller, st.camera, plan, output_dir, executor=self.pool, **kwargs).run()
+
+        return self.submit(scan, station, description=f"scan {len(plan)} tiles -> {output_dir}")
+
+    def pending(self):
+        return self._shared.qsize() + sum(st._jobs.qsize() for st in self.stations.values())
+
+    def stats(self):
+        return {
+            'shared_jobs': self._shared.qsize(),
+            'stations': [st.stats() for st in self.stations.values()],
+        }
+
+    # --- Workers ---
+
+    def _start_station(self, station):
+        worker = threading.Thread(target=self._work, args=(station,), name=f"station-{station.name}", daemon=True)
+        worker.start()
+        self._threads.append(worker)
+
+    def _work(self, station):
+        station.open()
+        while not self._stop.is_set():
+            job, shared = self._next_job(station)
+            if job is None:
+                continue
+            future, fn, description = job
+            if station.state == STATE_READY:
+                self._check(station)
+            if station.state != STATE_READY:
+                if shared:
+                    self._shared.put(job)  # leave it to a healthy station
+                else:
+                    future.set_exception(RuntimeError(f"Station {station.name} is {station.state}: {station.error}"))
+                continue
+            # A retried shared job is already running
+            if not future.running() and not future.set_running_or_notify_cancel():
+                continue
+            station.job = description
+            station._set_state(STATE_BUSY)
+            try:
+                result = fn(station)
+            except Exception as e:
+                station.jobs_failed += 1
+                # The monitor may have faulted (and closed) the station first
+                faulted = station.state == STATE_FAULT or self._check(station)
+                if faulted and shared and not self._stop.is_set():
+                    print(f"Station {station.name}: retrying '{description}' on another station")
+                    self._shared.put(job)
+                else:
+                    future.set_exception(e)
+            else:
+                station.jobs_done += 1
+                future.set_result(result)
+            finally:
+                station.job = None
+                if station.state == STATE_BUSY:
+                    station._set_state(STATE_READY)
+
+    def _next_job(self, station):
+        try:
+            return station._jobs.get_nowait(), False
+        except queue.Empty:
+            pass
+        if station.state != STATE_READY:
+            self._stop.wait(JOB_POLL_S)
+            return None, False
+        try:
+            return self._shared.get(timeout=JOB_POLL_S), True
+        except queue.Empty:
+            return None, False
+
+    def _monitor(self):
+        while not self._stop.wait(self.health_interval):
+            for station in list(self.stations.values()):
+                if station.state in (STATE_READY, STATE_BUSY):
+                    self._check(station)
+
+    def _check(self, station):
+        """Fault the station if its health check fails; returns the problem or None."""
+        try:
+            problem = station.check()
+        except Exception as e:
+            problem = f"health check failed: {e}"
+        if problem and not self._stop.is_set() and station.state != STATE_FAULT:
+            station.fault(problem)
+        return problem
+
+    def _changed(self, station):
+        if self.on_change:
+            try:
+                self.on_change(station)
+            except Exception as e:
+                print(f"Station listener error: {e}")
+
+    @staticmethod
+    def _cancel(jobs):
+        while True:
+            try:
+                future, _, _ = jobs.get_nowait()
+            except queue.Empty:
+                return
+            future.cancel()
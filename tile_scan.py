@@ -0,0 +1,358 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+
+from camera_stream import POLICY_LATEST
+from drift import STATUS_DRIFT
+from metrics import METRICS
+
+Tile = namedtuple('Tile', 'index row col x y')
+
+
+class ScanPlan:
+    """Serpentine grid of fields of view covering a rectangular region.
+
+    The region (x0, y0)-(x1, y1) is given in stage mm; tile positions are
+    the stage coordinates of each field-of-view centre. Adjacent tiles
+    overlap by `overlap` (fraction of the FOV) unless an explicit `step`
+    (mm, or (step_x, step_y)) is given.
+    """
+
+    def __init__(self, x0, y0, x1, y1, fov_width, fov_height, overlap=0.1, step=None):
+        self.x0, self.x1 = min(x0, x1), max(x0, x1)
+        self.y0, self.y1 = min(y0, y1), max(y0, y1)
+        self.fov_width = fov_width
+        self.fov_height = fov_height
+        if step is None:
+            self.step_x = fov_width * (1.0 - overlap)
+            self.step_y = fov_height * (1.0 - overlap)
+        elif isinstance(step, (tuple, list)):
+            self.step_x, self.step_y = step
+        else:
+            self.step_x = self.step_y = step
+        if self.step_x <= 0 or self.step_y <= 0:
+            raise ValueError("Scan step must be positive; overlap must be below 1.")
+
+        self.cols = self._count(self.x1 - self.x0, fov_width, self.step_x)
+        self.rows = self._count(self.y1 - self.y0, fov_height, self.step_y)
+
+    @staticmethod
+    def _count(extent, fov, step):
+        if extent <= fov:
+            return 1
+        return int(math.ceil((extent - fov) / step - 1e-9)) + 1
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def tiles(self):
+        """Tiles in serpentine order: even rows left to right, odd rows back."""
+        result = []
+        for row in range(self.rows):
+            y = self.y0 + self.fov_height / 2 + row * self.step_y
+            cols = range(self.cols) if row % 2 == 0 else range(self.cols - 1, -1, -1)
+            for col in cols:
+                x = self.x0 + self.fov_width / 2 + col * self.step_x
+                result.append(Tile(len(result), row, col, round(x, 4), round(y, 4)))
+        return result
+
+    def bounds(self):
+        """Stage area (x0, y0, x1, y1) the tiles cover, which can reach past the region."""
+        return (self.x0, self.y0,
+                self.x0 + self.fov_width + (self.cols - 1) * self.step_x,
+                self.y0 + self.fov_height + (self.rows - 1) * self.step_y)
+
+    def to_dict(self):
+        return {
+            'region': [self.x0, self.y0, self.x1, self.y1],
+            'fov': [self.fov_width, self.fov_height],
+            'step': [self.step_x, self.step_y],
+            'rows': self.rows,
+            'cols': self.cols,
+        }
+
+
+class TileScanner:
+    """Acquire a ScanPlan with motion, settling, capture and saving overlapped.
+
+    For every tile the stage is moved and synchronised (`G4 P0` is
+    acknowledged only once motion has finished). With a SettleDetector the
+    scanner then waits until the image is stable and keeps that frame;
+    otherwise it sleeps a fixed `dwell` and takes the first frame captured
+    afterwards. The move to
+    the next tile is queued right away, while the frame is written to disk
+    on a background pool.
+
+    With a drift.DriftCorrector every captured tile is registered against
+    the previous one before the next move is queued; if the stage has
+    drifted it is moved back and the tile captured again, and later moves
+    are offset by the accumulated error.
+
+    Saves go to a private pool of `save_workers` threads, or to `executor`
+    when one is shared between scanners (e.g. by stations.StationManager).
+
+    Finished tiles are appended to `scan_manifest.jsonl` in the output
+    directory; running the same plan again with resume=True skips them.
+    """
+
+    MANIFEST = "scan_manifest.jsonl"
+
+    def __init__(self, controller, camera, plan, output_dir, feed=3000, z=None,
+                 dwell=0.2, save_workers=2, max_pending_saves=4, image_ext=".tif",
+                 resume=True, on_tile=None, settle_detector=None, settle_timeout=2.0,
+                 stitcher=None, executor=None, drift_corrector=None):
+        self.controller = controller
+        self.camera = camera
+        self.plan = plan
+        self.output_dir = output_dir
+        self.feed = feed
+        self.z = z
+        self.dwell = dwell
+        self.save_workers = save_workers
+        self.executor = executor
+        self.image_ext = image_ext
+        self.resume = resume
+        self.on_tile = on_tile  # on_tile(tile, path), called from a save worker
+        self.settle_detector = settle_detector
+        self.stitcher = stitcher  # optional MosaicStitcher fed while the scan runs
+        self.drift_corrector = drift_corrector
+        self.settle_timeout = settle_timeout
+        self.capture_timeout = 2.0
+        self.move_timeout = 60.0  # seconds to wait for a move to finish
+
+        self._pending_saves = threading.BoundedSemaphore(max_pending_saves)
+        self._manifest_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.tiles_done = 0
+        self.tiles_skipped = 0
+        self.tiles_unsettled = 0
+        self.tiles_corrected = 0
+        self.errors = []
+        self.timings = {'move': 0.0, 'settle': 0.0, 'capture': 0.0, 'drift': 0.0, 'save': 0.0}
+        self.elapsed = 0.0
+        self._save_time = METRICS.histogram('tile_save_seconds', help="Time to write one tile and its manifest entry")
+
+    def stop(self):
+        """Stop after the tile currently being acquired."""
+        self._stop.set()
+
+    def completed_tiles(self):
+        """(row, col) pairs already recorded in the manifest."""
+        done = set()
+        try:
+            with open(os.path.join(self.output_dir, self.MANIFEST), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # partially written last line of an interrupted scan
+                    if 'row' in entry:
+                        done.add((entry['row'], entry['col']))
+        except OSError:
+            pass
+        return done
+
+    def run(self):
+        """Acquire all remaining tiles; returns stats()."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        done = self.completed_tiles() if self.resume else set()
+        tiles = [t for t in self.plan.tiles() if (t.row, t.col) not in done]
+        self.tiles_skipped = len(self.plan) - len(tiles)
+        if not done:
+            self._append_manifest({'plan': self.plan.to_dict(), 'started': time.time()})
+
+        frames = self.camera.subscribe('scan', POLICY_LATEST)
+        if self.settle_detector is not None:
+            self.settle_detector.open()
+        if self.drift_corrector is not None:
+            self.drift_corrector.reset()
+        pool = self.executor or ThreadPoolExecutor(max_workers=self.save_workers, thread_name_prefix="tile-save")
+        saves = []
+        self._stop.clear()
+        started = time.perf_counter()
+        try:
+            if tiles:
+                self.controller.submit("G90").result()
+                move = self._queue_move(tiles[0])
+            for i, tile in enumerate(tiles):
+                if self._stop.is_set():
+                    break
+                t0 = time.perf_counter()
+                reply = move.result()
+                t1 = time.perf_counter()
+                synced = time.monotonic()
+                self.timings['move'] += t1 - t0
+                if reply is None or reply.startswith('error'):
+                    self.errors.append((tile, f"Move failed: {reply}"))
+                    break
+
+                settled_at, frame = self._settle(tile)
+                t2 = time.perf_counter()
+                self.timings['settle'] += t2 - t1
+
+                if frame is None:
+                    frame = self._capture_after(frames, settled_at)
+                t3 = time.perf_counter()
+                self.timings['capture'] += t3 - t2
+                if frame is not None and self.drift_corrector is not None:
+                    corrected = self.tiles_corrected
+                    frame = self._correct_drift(tile, frames, frame)
+                    if self.tiles_corrected != corrected:
+                        synced = time.monotonic()
+                    self.timings['drift'] += time.perf_counter() - t3
+                # Before the next move starts
+                position = self._stage_position(tile, synced)
+                # Queue the next move before this tile is written
+                if i + 1 < len(tiles) and not self._stop.is_set():
+                    move = self._queue_move(tiles[i + 1])
+                if frame is None:
+                    self.errors.append((tile, "No frame captured."))
+                    continue
+
+                if self.stitcher is not None:
+                    # From this thread so tiles register in scan order; add_tile copies the image
+                    self.stitcher.add_tile(frame.image, tile.x, tile.y, key=(tile.row, tile.col))
+                self._pending_saves.acquire()
+                saves.append(pool.submit(self._save, tile, frame, position))
+        finally:
+            if self.executor is None:
+                pool.shutdown(wait=True)
+            else:
+                wait(saves)
+            frames.close()
+            if self.settle_detector is not None:
+                self.settle_detector.close()
+            self.elapsed = time.perf_counter() - started
+        return self.stats()
+
+    def stats(self):
+        done = self.tiles_done
+        return {
+            'tiles': len(self.plan),
+            'done': done,
+            'skipped': self.tiles_skipped,
+            'unsettled': self.tiles_unsettled,
+            'corrected': self.tiles_corrected,
+            'errors': len(self.errors),
+            'elapsed_s': self.elapsed,
+            'tiles_per_second': done / self.elapsed if self.elapsed > 0 else 0.0,
+            'avg_ms': {k: 1000.0 * v / done if done else 0.0 for k, v in self.timings.items()},
+        }
+
+    def tile_path(self, tile):
+        return os.path.join(self.output_dir, f"tile_r{tile.row:04d}_c{tile.col:04d}{self.image_ext}")
+
+    def _queue_move(self, tile):
+        x, y = tile.x, tile.y
+        if self.drift_corrector is not None:
+            x, y = self.drift_corrector.target(x, y)
+        target = f"X{x:.4f} Y{y:.4f}"
+        if self.z is not None:
+            target += f" Z{self.z:.4f}"
+        # G4 P0 is only acknowledged once the move has finished
+        return self.controller.submit(f"G1 {target} F{self.feed:g}\nG4 P0", timeout=self.move_timeout)
+
+    def _stage_position(self, tile, synced):
+        """Work position of the tile just captured, for the manifest.
+
+        The reported position if a status report arrived after the move
+        finished (at monotonic time `synced`), otherwise the commanded one.
+        """
+        snapshot = self.controller.state.snapshot()
+        if snapshot['updated'] and snapshot['updated'] >= synced:
+            return snapshot['work_position']
+        x, y = tile.x, tile.y
+        if self.drift_corrector is not None:
+            x, y = self.drift_corrector.target(x, y)
+        return x, y, self.z if self.z is not None else snapshot['work_position'][2]
+
+    def _settle(self, tile):
+        """Wait until the stage is steady.
+
+        Returns (time it became steady, stable Frame or None).
+        """
+        if self.settle_detector is not None:
+            result = self.settle_detector.wait_stable(
+                after=time.perf_counter(), timeout=self.settle_timeout, keep_frame=True)
+            if result.stable:
+                return result.timestamp, result.frame
+            # Never became stable: capture anyway, but count it
+            self.tiles_unsettled += 1
+            return time.perf_counter(), None
+        if self.dwell > 0:
+            time.sleep(self.dwell)
+        return time.perf_counter(), None
+
+    def _correct_drift(self, tile, frames, frame):
+        """Register the tile's frame; on drift move back and capture again.
+
+        Returns the frame to keep (None if no new frame came).
+        """
+        corrector = self.drift_corrector
+        for attempt in range(corrector.max_corrections + 1):
+            measurement = corrector.check(frame.image, tile.x, tile.y)
+            if measurement.status != STATUS_DRIFT or attempt == corrector.max_corrections:
+                break
+            try:
+                corrector.correct(measurement, tile.x, tile.y)
+            except RuntimeError as e:
+                self.errors.append((tile, str(e)))
+                break
+            if attempt == 0:
+                self.tiles_corrected += 1
+            frame.release()
+            settled_at, frame = self._settle(tile)
+            if frame is None:
+                frame = self._capture_after(frames, settled_at)
+            if frame is None:
+                break
+        return frame
+
+    def _capture_after(self, frames, after):
+        """First frame whose capture started after `after`."""
+        deadline = time.perf_counter() + self.capture_timeout
+        while time.perf_counter() < deadline:
+            frame = frames.get(timeout=max(0.0, deadline - time.perf_counter()))
+            if frame is None:
+                return None
+            if frame.timestamp >= after:
+                return frame
+            frame.release()
+        return None
+
+    def _save(self, tile, frame, position):
+        path = self.tile_path(tile)
+        t0 = time.perf_counter()
+        try:
+            with frame:
+                ok = cv2.imwrite(path, frame.image)
+                frame_index = frame.index
+            if not ok:
+                raise OSError(f"Could not write {path}")
+            self._append_manifest({
+                'index': tile.index, 'row': tile.row, 'col': tile.col,
+                'x': tile.x, 'y': tile.y, 'stage': list(position),
+                'frame': frame_index, 'file': os.path.basename(path), 't': time.time(),
+            }, save_time=time.perf_counter() - t0)
+            if METRICS.enabled:
+                self._save_time.observe(time.perf_counter() - t0)
+            if self.on_tile:
+                self.on_tile(tile, path)
+        except Exception as e:
+            self.errors.append((tile, str(e)))
+        finally:
+            self._pending_saves.release()
+
+    def _append_manifest(self, entry, save_time=None):
+        with self._manifest_lock:
+            with open(os.path.join(self.output_dir, self.MANIFEST), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+            if save_time is not None:
+                self.timings['save'] += save_time
+                self.tiles_done += 1
\ No newline at end of file